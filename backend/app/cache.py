@@ -0,0 +1,269 @@
+"""Small caches shared by the API helpers."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Optional, Set, Tuple, TypeVar
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[V]):
+    """Thread-safe LRU cache with a per-entry time to live.
+
+    Size is bounded by ``max_entries``; the least recently used entry is
+    evicted first. Hit, miss, eviction and expiry counters are kept so the
+    cache can be tuned from ``stats()``.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def _lookup(self, key: Hashable) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return _MISSING
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: V, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SWRCache:
+    """Async read-through cache with single-flight loads and stale-while-revalidate.
+
+    Entries are fresh for ``ttl_seconds`` and may then be served stale for up
+    to ``stale_seconds`` more while one background task refreshes them.
+    Concurrent misses for a key share a single loader call. Values must be
+    JSON-serializable: with ``shared=True`` they are also written to the
+    ``cache_entries`` table so other worker processes start warm instead of
+    all calling upstream at once.
+    """
+
+    _PRUNE_EVERY = 100
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int,
+        ttl_seconds: float,
+        stale_seconds: float = 0.0,
+        shared: bool = True,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.shared = shared
+        # Local tier holds (fresh_until, value) for the whole stale window.
+        self._local: TTLCache[Tuple[float, Any]] = TTLCache(max_entries, ttl_seconds + stale_seconds)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+        self._writes = 0
+        self.loads = 0
+        self.stale_served = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        now = time.time()
+        entry = self._local.get(key)
+        if entry is None and self.shared:
+            entry = await asyncio.to_thread(self._read_shared, key, now)
+            if entry is not None:
+                self.shared_hits += 1
+        if entry is not None:
+            fresh_until, value = entry
+            if now >= fresh_until:
+                self.stale_served += 1
+                self._refresh_in_background(key, loader)
+            return value
+        return await self._load(key, loader)
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            # Shield so one cancelled caller doesn't cancel the shared load.
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.loads += 1
+            value = await loader()
+            await self._store(key, value)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark retrieved so an error nobody else awaited isn't logged.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._inflight:
+            return
+
+        async def refresh() -> None:
+            try:
+                await self._load(key, loader)
+            except Exception as exc:  # noqa: BLE001 - keep serving the stale value
+                logger.warning("Background refresh of %s:%s failed: %s", self.namespace, key, exc)
+
+        task = asyncio.create_task(refresh())
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    async def _store(self, key: str, value: Any) -> None:
+        fresh_until = time.time() + self.ttl_seconds
+        self._local.set(key, (fresh_until, value))
+        if self.shared:
+            try:
+                await asyncio.to_thread(self._write_shared, key, value, fresh_until)
+            except Exception as exc:  # noqa: BLE001 - the local tier still has it
+                logger.warning("Shared cache write for %s:%s failed: %s", self.namespace, key, exc)
+
+    def _read_shared(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        row = database.fetchone(
+            """
+            SELECT value_json, fresh_until, stale_until
+            FROM cache_entries
+            WHERE namespace = ? AND key = ?
+            """,
+            (self.namespace, key),
+        )
+        if row is None or row["stale_until"] <= now:
+            return None
+        entry = (row["fresh_until"], json.loads(row["value_json"]))
+        self._local.set(key, entry, ttl_seconds=row["stale_until"] - now)
+        return entry
+
+    def _write_shared(self, key: str, value: Any, fresh_until: float) -> None:
+        with database.transaction() as tx:
+            tx.execute(
+                """
+                INSERT INTO cache_entries (namespace, key, value_json, fresh_until, stale_until)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                    value_json = excluded.value_json,
+                    fresh_until = excluded.fresh_until,
+                    stale_until = excluded.stale_until
+                """,
+                (self.namespace, key, json.dumps(value), fresh_until, fresh_until + self.stale_seconds),
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._prune(tx)
+
+    def _prune(self, tx: database.Transaction) -> None:
+        tx.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND stale_until <= ?",
+            (self.namespace, time.time()),
+        )
+        # Keep the shared tier bounded like the local one.
+        tx.execute(
+            """
+            DELETE FROM cache_entries
+            WHERE namespace = ? AND key IN (
+                SELECT key FROM cache_entries
+                WHERE namespace = ?
+                ORDER BY stale_until DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.namespace, self.namespace, self._local.max_entries),
+        )
+
+    def invalidate(self, key: str) -> None:
+        self._local.invalidate(key)
+        if self.shared:
+            database.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._local.stats()
+        stats.update(
+            {
+                "fresh_seconds": self.ttl_seconds,
+                "stale_seconds": self.stale_seconds,
+                "shared": self.shared,
+                "shared_hits": self.shared_hits,
+                "loads": self.loads,
+                "coalesced": self.coalesced,
+                "stale_served": self.stale_served,
+                "inflight": len(self._inflight),
+            }
+        )
+        return stats
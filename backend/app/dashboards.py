@@ -0,0 +1,237 @@
+"""Materialized per-user dashboard summaries.
+
+``user_dashboards`` holds one row per user with everything the dashboards
+show: the borrow amount, the next payment and what is left on the schedule,
+loans taken, lender capital and the lender's portfolio (loans funded,
+outstanding principal, expected yield, next inflow), and the Knot spend
+summary.
+``refresh`` recomputes a row inside the transaction that changed its inputs
+(borrow amount, match, payment, Knot sync), so loading a dashboard is a
+single primary-key read and never writes.
+
+Borrowers with an amount and no loan yet get a projected first payment
+from ``schedules.compact``; the projection is stored, not written as a
+schedule. A paid-off loan shows no next payment and a zero balance.
+"""
+
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import database, knot_store, portfolio, schedules
+
+_CHUNK = 500
+_COLUMNS = (
+    "user_id",
+    "role",
+    "is_verified",
+    "max_amount",
+    "borrow_amount",
+    "next_due_date",
+    "next_payment_amount",
+    "payments_remaining",
+    "balance_remaining",
+    "schedule_projected",
+    "loans",
+    "borrowed_total",
+    "capital_total",
+    "capital_available",
+    "capital_committed",
+    "loans_funded",
+    "principal_outstanding",
+    "expected_yield_year",
+    "next_inflow_date",
+    "inflow_next_cycle",
+    "knot_json",
+    "updated_at",
+)
+_UPSERT = f"""
+    INSERT INTO user_dashboards ({", ".join(_COLUMNS)})
+    VALUES ({", ".join("?" for _ in _COLUMNS)})
+    ON CONFLICT(user_id) DO UPDATE SET
+        {", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:])}
+"""
+
+
+def _grouped(query: str, user_ids: List[str]) -> List:
+    placeholders = ", ".join("?" for _ in user_ids)
+    return database.fetchall(query.format(ids=placeholders), user_ids)
+
+
+def _compute_chunk(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    users = _grouped("SELECT id, role, is_verified, max_amount FROM users WHERE id IN ({ids})", user_ids)
+    amounts = {
+        row["user_id"]: row["amount"]
+        for row in _grouped("SELECT user_id, amount FROM borrow_amounts WHERE user_id IN ({ids})", user_ids)
+    }
+    # Next payment and balance are arithmetic on each compact schedule row.
+    # Closed loans still count as scheduled, so a paid-off borrower shows a
+    # zero balance rather than a projected new loan.
+    pending: Dict[str, Dict[str, Any]] = {}
+    for row in _grouped(
+        """
+        SELECT user_id, status, installments, payment, final_payment, paid_through, next_due_date
+        FROM loan_schedules
+        WHERE user_id IN ({ids})
+        """,
+        user_ids,
+    ):
+        totals = pending.setdefault(row["user_id"], {"payments": 0, "remaining": 0.0, "next_due": None, "amount": None})
+        if row["status"] != "active":
+            continue
+        totals["payments"] += max(0, row["installments"] - row["paid_through"])
+        totals["remaining"] += schedules.remaining_due(
+            row["payment"], row["final_payment"], row["installments"], row["paid_through"]
+        )
+        next_due = row["next_due_date"]
+        if next_due is not None and (totals["next_due"] is None or next_due < totals["next_due"]):
+            totals["next_due"] = next_due
+            totals["amount"] = schedules.installment_amount(
+                row["payment"], row["final_payment"], row["installments"], row["paid_through"]
+            )
+    loans = {
+        row["user_id"]: row
+        for row in _grouped(
+            """
+            SELECT user_id, COUNT(*) AS loans, SUM(total_amount) AS borrowed
+            FROM matches
+            WHERE user_id IN ({ids})
+            GROUP BY user_id
+            """,
+            user_ids,
+        )
+    }
+    balances = {
+        row["lender_id"]: row
+        for row in _grouped(
+            "SELECT lender_id, total, available, committed FROM lender_balances WHERE lender_id IN ({ids})",
+            user_ids,
+        )
+    }
+    funded = portfolio.totals(user_ids)
+    inflows = portfolio.next_inflows(user_ids)
+    linked = {
+        row["user_id"]
+        for row in _grouped("SELECT DISTINCT user_id FROM knot_merchants WHERE user_id IN ({ids})", user_ids)
+    }
+
+    now = datetime.utcnow().isoformat()
+    summaries: Dict[str, Dict[str, Any]] = {}
+    for user in users:
+        user_id = user["id"]
+        borrow_amount = amounts.get(user_id)
+        schedule = pending.get(user_id)
+        loan = loans.get(user_id)
+        # Only borrowers who never had a loan get a projection.
+        plan = schedules.compact(borrow_amount) if schedule is None and loan is None and borrow_amount else None
+        projected = plan is not None
+        if schedule is not None:
+            next_due, next_amount = schedule["next_due"], schedule["amount"]
+            payments, remaining = schedule["payments"], schedule["remaining"]
+        elif plan is not None:
+            next_due, next_amount, payments = plan.first_due, plan.payment, plan.installments
+            remaining = schedules.remaining_due(plan.payment, plan.final_payment, plan.installments, 0)
+        else:
+            next_due = next_amount = None
+            payments, remaining = 0, 0.0
+        balance = balances.get(user_id)
+        book = funded.get(user_id)
+        inflow = inflows.get(user_id)
+        knot = knot_store.summary(user_id) if user_id in linked else None
+        summaries[user_id] = {
+            "user_id": user_id,
+            "role": user["role"],
+            "is_verified": int(bool(user["is_verified"])),
+            "max_amount": user["max_amount"],
+            "borrow_amount": borrow_amount,
+            "next_due_date": next_due,
+            "next_payment_amount": next_amount,
+            "payments_remaining": payments,
+            "balance_remaining": round(remaining, 2),
+            "schedule_projected": int(projected),
+            "loans": loan["loans"] if loan else 0,
+            "borrowed_total": loan["borrowed"] if loan else 0.0,
+            "capital_total": balance["total"] if balance else None,
+            "capital_available": balance["available"] if balance else None,
+            "capital_committed": balance["committed"] if balance else None,
+            "loans_funded": book["loans"] if book else 0,
+            "principal_outstanding": book["outstanding"] if book else 0.0,
+            "expected_yield_year": book["expected_yield_year"] if book else 0.0,
+            "next_inflow_date": inflow["next_due"] if inflow else None,
+            "inflow_next_cycle": inflow["cycle"] if inflow else 0.0,
+            "knot_json": json.dumps(knot) if knot else None,
+            "updated_at": now,
+        }
+    return summaries
+
+
+def compute(user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Build summaries from the source tables; joins any open transaction.
+
+    Each input is read with one grouped query per chunk of users, so a batch
+    match refreshing thousands of users costs a handful of queries per
+    chunk rather than per user.
+    """
+    unique = list(dict.fromkeys(user_ids))
+    summaries: Dict[str, Dict[str, Any]] = {}
+    # Stay well under SQLite's bound-parameter limit.
+    for start in range(0, len(unique), _CHUNK):
+        summaries.update(_compute_chunk(unique[start : start + _CHUNK]))
+    return summaries
+
+
+def refresh(tx: database.Transaction, user_ids: Iterable[str]) -> int:
+    """Recompute the summary rows for ``user_ids`` inside ``tx``."""
+    summaries = compute(user_ids)
+    if summaries:
+        tx.executemany(
+            _UPSERT,
+            [tuple(summary[column] for column in _COLUMNS) for summary in summaries.values()],
+        )
+    return len(summaries)
+
+
+def _decode(row) -> Dict[str, Any]:
+    summary = dict(row)
+    knot = summary.pop("knot_json")
+    summary["knot"] = json.loads(knot) if knot else None
+    summary["is_verified"] = bool(summary["is_verified"])
+    summary["schedule_projected"] = bool(summary["schedule_projected"])
+    return summary
+
+
+def get(user_id: str) -> Optional[Dict[str, Any]]:
+    """A user's summary: one primary-key read.
+
+    Users that predate the table and haven't been backfilled yet are
+    computed on the fly without writing.
+    """
+    row = database.fetchone(
+        f"SELECT {', '.join(_COLUMNS)} FROM user_dashboards WHERE user_id = ?",
+        (user_id,),
+    )
+    if row is None:
+        summary = compute([user_id]).get(user_id)
+        return _decode(summary) if summary is not None else None
+    return _decode(row)
+
+
+def backfill(batch_size: int = 500) -> int:
+    """Materialize rows for users that don't have one; returns how many."""
+    written = 0
+    while True:
+        rows = database.fetchall(
+            """
+            SELECT u.id FROM users u
+            LEFT JOIN user_dashboards d ON d.user_id = u.id
+            WHERE d.user_id IS NULL
+            LIMIT ?
+            """,
+            (batch_size,),
+        )
+        if not rows:
+            return written
+        with database.transaction() as tx:
+            written += refresh(tx, [row["id"] for row in rows])
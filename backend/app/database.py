@@ -1,24 +1,226 @@
+import json
 import os
+import queue
 import sqlite3
-from contextlib import closing
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from . import essentials, metrics
 
 DB_FILENAME = os.getenv("DATABASE_FILENAME", "lendlocal.db")
 DEFAULT_PATH = Path(__file__).resolve().parent / DB_FILENAME
 DB_PATH = Path(os.getenv("DATABASE_URL", DEFAULT_PATH))
+DB_POOL_SIZE = max(1, int(os.getenv("DATABASE_POOL_SIZE", "8")))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DATABASE_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DATABASE_POOL_TIMEOUT_SECONDS", "30"))
+DB_CACHE_SIZE_KB = int(os.getenv("DATABASE_CACHE_SIZE_KB", "65536"))
 
 
 def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    # check_same_thread is off because pooled connections move between the
+    # threadpool workers FastAPI uses for sync endpoints; the pool guarantees
+    # a connection is only ever held by one thread at a time.
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+    )
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys=ON;")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+    conn.execute("PRAGMA journal_mode=WAL;")
+    # Negative cache_size is in KiB; long-lived connections keep it warm.
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};")
     return conn
 
 
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+
+    Connections are opened lazily up to ``max_size`` and handed back to an
+    idle queue after each use, so a request no longer pays for a fresh
+    connection (and its pragmas) on every query. ``close_all`` closes the
+    idle connections at once and retires the checked-out ones, which are
+    closed when they come back instead of being queued again.
+    """
+
+    def __init__(self, max_size: int, timeout: float) -> None:
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._connections: Set[sqlite3.Connection] = set()
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        if conn is None:
+            with self._lock:
+                can_open = self._open < self.max_size
+                if can_open:
+                    self._open += 1
+            if can_open:
+                try:
+                    conn = _connect()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+                with self._lock:
+                    self._connections.add(conn)
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty as exc:
+                    raise sqlite3.OperationalError(
+                        "Timed out waiting for a pooled database connection"
+                    ) from exc
+                finally:
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_seconds += time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        return conn
+
+    def _release(self, conn: sqlite3.Connection, broken: bool = False) -> None:
+        with self._lock:
+            self._in_use -= 1
+            retired = conn not in self._connections
+            if broken or retired:
+                self._connections.discard(conn)
+                self._open -= 1
+        if broken or retired:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except BaseException:
+            broken = not _rollback_quietly(conn)
+            raise
+        finally:
+            self._release(conn, broken=broken)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "open_connections": self._open,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds_total": round(self._wait_seconds, 6),
+            }
+
+    def close_all(self) -> None:
+        """Close every connection; ones still checked out close on release.
+
+        The pool stays usable and opens fresh connections on the next checkout.
+        """
+        with self._lock:
+            self._connections.clear()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._open -= 1
+            conn.close()
+
+
+def _rollback_quietly(conn: sqlite3.Connection) -> bool:
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+_pool = ConnectionPool(DB_POOL_SIZE, DB_POOL_TIMEOUT_SECONDS)
+
+
+def pool_stats() -> Dict[str, float]:
+    """Snapshot of pool usage for sizing under load."""
+    return _pool.stats()
+
+
+QUERY_SECONDS = metrics.Histogram(
+    "db_statement_duration_seconds",
+    "SQLite time per statement, by kind; BEGIN is the wait for the write lock.",
+    ("statement",),
+)
+QUERY_ERRORS = metrics.Counter("db_errors_total", "SQLite statements that raised, by kind.", ("statement",))
+
+
+@lru_cache(maxsize=2048)
+def _statement(query: str) -> str:
+    words = query.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+@contextmanager
+def _timed(query: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except sqlite3.Error:
+        QUERY_ERRORS.inc(_statement(query))
+        raise
+    finally:
+        QUERY_SECONDS.observe(time.perf_counter() - started, _statement(query))
+
+
+def _pool_metrics() -> List[metrics.Family]:
+    stats = _pool.stats()
+    connections = [({"state": "in_use"}, stats["in_use"]), ({"state": "idle"}, stats["idle"])]
+    return [
+        ("db_pool_connections", "gauge", "Pooled SQLite connections by state.", connections),
+        ("db_pool_waits_total", "counter", "Checkouts that waited for a connection.", [({}, stats["waits"])]),
+        (
+            "db_pool_wait_seconds_total",
+            "counter",
+            "Time spent waiting for a connection.",
+            [({}, stats["wait_seconds_total"])],
+        ),
+    ]
+
+
+metrics.register_collector(_pool_metrics)
+
+
+def close_pool() -> None:
+    _pool.close_all()
+
+
 def init_db() -> None:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with closing(_connect()) as conn:
+    with _pool.connection() as conn:
         conn.executescript(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -60,6 +262,7 @@ def init_db() -> None:
                 filename TEXT NOT NULL,
                 content_type TEXT NOT NULL,
                 size_bytes INTEGER NOT NULL,
+                content_sha256 TEXT,
                 status TEXT NOT NULL,
                 created_at TEXT NOT NULL,
                 reviewed_at TEXT
@@ -79,12 +282,373 @@ def init_db() -> None:
             );
             CREATE INDEX IF NOT EXISTS idx_payment_schedules_user_due
                 ON payment_schedules (user_id, due_date);
+            CREATE TABLE IF NOT EXISTS loan_schedules (
+                match_id TEXT PRIMARY KEY REFERENCES matches(id) ON DELETE CASCADE,
+                user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                principal REAL NOT NULL,
+                apr REAL NOT NULL,
+                frequency TEXT NOT NULL,
+                installments INTEGER NOT NULL,
+                first_due TEXT NOT NULL,
+                payment REAL NOT NULL,
+                final_payment REAL NOT NULL,
+                base_index INTEGER NOT NULL DEFAULT 0,
+                paid_through INTEGER NOT NULL DEFAULT 0,
+                next_due_date TEXT,
+                status TEXT NOT NULL DEFAULT 'active',
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_loan_schedules_user
+                ON loan_schedules (user_id, status);
+            DROP INDEX IF EXISTS idx_loan_schedules_due;
+            CREATE INDEX IF NOT EXISTS idx_loan_schedules_next_due
+                ON loan_schedules (status, next_due_date, match_id);
+            CREATE INDEX IF NOT EXISTS idx_loan_schedules_updated
+                ON loan_schedules (updated_at);
+            CREATE TABLE IF NOT EXISTS transfers (
+                id TEXT PRIMARY KEY,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                match_id TEXT NOT NULL UNIQUE REFERENCES matches(id) ON DELETE CASCADE,
+                amount REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                created_at TEXT NOT NULL,
+                settled_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS transfer_legs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transfer_id TEXT NOT NULL REFERENCES transfers(id) ON DELETE CASCADE,
+                lender_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                amount REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                run_id INTEGER,
+                UNIQUE (transfer_id, lender_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_transfer_legs_status
+                ON transfer_legs (status, id);
+            CREATE INDEX IF NOT EXISTS idx_transfer_legs_run
+                ON transfer_legs (run_id);
+            CREATE TABLE IF NOT EXISTS settlement_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL DEFAULT 'open',
+                legs INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                nessie_transfers INTEGER NOT NULL DEFAULT 0,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                owner TEXT,
+                claimed_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_settlement_runs_status
+                ON settlement_runs (status);
+            CREATE TABLE IF NOT EXISTS processor_checkpoints (
+                name TEXT PRIMARY KEY,
+                cutoff TEXT,
+                last_due TEXT,
+                last_match_id TEXT,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS lender_balances (
+                lender_id TEXT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                total REAL NOT NULL,
+                available REAL NOT NULL CHECK (available >= 0),
+                reserved REAL NOT NULL DEFAULT 0,
+                committed REAL NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS capital_reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                reservation_id TEXT NOT NULL,
+                lender_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                borrower_id TEXT REFERENCES users(id) ON DELETE SET NULL,
+                amount REAL NOT NULL,
+                status TEXT NOT NULL,
+                match_id TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_capital_reservations_reservation
+                ON capital_reservations (reservation_id);
+            CREATE INDEX IF NOT EXISTS idx_capital_reservations_status_created
+                ON capital_reservations (status, created_at);
+            CREATE TABLE IF NOT EXISTS capital_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lender_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                reservation_id TEXT,
+                match_id TEXT,
+                entry_type TEXT NOT NULL,
+                amount REAL NOT NULL,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_capital_ledger_lender
+                ON capital_ledger (lender_id, created_at);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                dedupe_key TEXT NOT NULL UNIQUE,
+                payload_json TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                run_after TEXT NOT NULL,
+                locked_at TEXT,
+                result_json TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after
+                ON jobs (status, run_after);
+            CREATE TABLE IF NOT EXISTS knot_merchants (
+                user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                merchant_id INTEGER NOT NULL,
+                merchant_name TEXT NOT NULL,
+                orders INTEGER NOT NULL DEFAULT 0,
+                total_spend REAL NOT NULL DEFAULT 0,
+                essential_spend REAL NOT NULL DEFAULT 0,
+                last_sync TEXT NOT NULL,
+                PRIMARY KEY (user_id, merchant_id)
+            );
+            CREATE TABLE IF NOT EXISTS knot_transactions (
+                user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                merchant_id INTEGER NOT NULL,
+                external_id TEXT NOT NULL,
+                merchant TEXT NOT NULL,
+                amount REAL NOT NULL,
+                category TEXT,
+                description TEXT,
+                is_essential INTEGER,
+                essential_amount REAL,
+                posted_at TEXT NOT NULL,
+                synced_at TEXT NOT NULL,
+                PRIMARY KEY (user_id, merchant_id, external_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_knot_transactions_user_posted
+                ON knot_transactions (user_id, posted_at);
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value_json TEXT NOT NULL,
+                fresh_until REAL NOT NULL,
+                stale_until REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_stale
+                ON cache_entries (namespace, stale_until);
+            CREATE INDEX IF NOT EXISTS idx_matches_user
+                ON matches (user_id);
+            CREATE TABLE IF NOT EXISTS match_allocations (
+                match_id TEXT NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+                lender_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                amount REAL NOT NULL,
+                rate REAL NOT NULL,
+                outstanding REAL NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (match_id, lender_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_match_allocations_lender
+                ON match_allocations (lender_id, outstanding, rate, amount);
+            CREATE INDEX IF NOT EXISTS idx_match_allocations_lender_created
+                ON match_allocations (lender_id, created_at);
+            CREATE TABLE IF NOT EXISTS user_dashboards (
+                user_id TEXT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                role TEXT NOT NULL,
+                is_verified INTEGER NOT NULL DEFAULT 0,
+                max_amount REAL,
+                borrow_amount REAL,
+                next_due_date TEXT,
+                next_payment_amount REAL,
+                payments_remaining INTEGER NOT NULL DEFAULT 0,
+                balance_remaining REAL NOT NULL DEFAULT 0,
+                schedule_projected INTEGER NOT NULL DEFAULT 0,
+                loans INTEGER NOT NULL DEFAULT 0,
+                borrowed_total REAL NOT NULL DEFAULT 0,
+                capital_total REAL,
+                capital_available REAL,
+                capital_committed REAL,
+                loans_funded INTEGER NOT NULL DEFAULT 0,
+                principal_outstanding REAL NOT NULL DEFAULT 0,
+                expected_yield_year REAL NOT NULL DEFAULT 0,
+                next_inflow_date TEXT,
+                inflow_next_cycle REAL NOT NULL DEFAULT 0,
+                knot_json TEXT,
+                updated_at TEXT NOT NULL
+            );
             """
         )
         _ensure_user_columns(conn)
+        _ensure_knot_columns(conn)
+        _ensure_verification_columns(conn)
+        _ensure_schedule_columns(conn)
+        _migrate_parametric_schedules(conn)
+        _ensure_dashboard_columns(conn)
+        _ensure_settlement_columns(conn)
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_users_role_community
+                ON users (role, community_id)
+            """
+        )
+        _ensure_lender_balances(conn)
+        _migrate_knot_blobs(conn)
+        _classify_knot_essentials(conn)
+        _backfill_match_allocations(conn)
         conn.commit()
 
 
+def _ensure_lender_balances(conn: sqlite3.Connection) -> None:
+    """Open a capital balance for any lender that predates the ledger."""
+    conn.execute(
+        """
+        INSERT INTO lender_balances (lender_id, total, available, updated_at)
+        SELECT id, max_amount, max(max_amount, 0), created_at
+        FROM users
+        WHERE role = 'lender'
+          AND id NOT IN (SELECT lender_id FROM lender_balances)
+        """
+    )
+
+
+def _backfill_match_allocations(conn: sqlite3.Connection) -> None:
+    """Recover allocations for matches written before ``match_allocations``.
+
+    ``matches.lenders_json`` only carries display ids, but every match leg was
+    committed through ``capital_ledger`` with the lender's user id. The
+    lender's rate at the time isn't recorded there, so their current
+    ``min_rate`` stands in. Runs once: later matches write their own rows.
+    """
+    if conn.execute("SELECT 1 FROM match_allocations LIMIT 1").fetchone():
+        return
+    conn.execute(
+        """
+        INSERT INTO match_allocations (match_id, lender_id, amount, rate, outstanding, created_at)
+        SELECT l.match_id, l.lender_id, round(SUM(l.amount), 2), u.min_rate, round(SUM(l.amount), 2), MIN(l.created_at)
+        FROM capital_ledger l
+        JOIN users u ON u.id = l.lender_id
+        JOIN matches m ON m.id = l.match_id
+        WHERE l.entry_type = 'commit'
+          AND NOT EXISTS (SELECT 1 FROM match_allocations a WHERE a.match_id = l.match_id)
+        GROUP BY l.match_id, l.lender_id
+        """
+    )
+
+
+def _migrate_knot_blobs(conn: sqlite3.Connection) -> None:
+    """Move Knot profiles stored as JSON blobs into the normalized tables.
+
+    The blob columns of ``knot_profiles`` are emptied once migrated; the row
+    itself stays as the per-user sync header.
+    """
+    rows = conn.execute(
+        """
+        SELECT user_id, merchants_json, transactions_json, updated_at
+        FROM knot_profiles
+        WHERE merchants_json != '[]' OR transactions_json != '[]'
+        """
+    ).fetchall()
+    for row in rows:
+        merchants = json.loads(row["merchants_json"] or "[]")
+        transactions = json.loads(row["transactions_json"] or "[]")
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO knot_transactions (
+                user_id, merchant_id, external_id, merchant, amount, category,
+                description, is_essential, posted_at, synced_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    row["user_id"],
+                    txn.get("merchant_id"),
+                    txn.get("id"),
+                    txn.get("merchant") or "",
+                    txn.get("amount") or 0,
+                    txn.get("category"),
+                    txn.get("description"),
+                    txn.get("is_essential"),
+                    txn.get("posted_at") or row["updated_at"],
+                    row["updated_at"],
+                )
+                for txn in transactions
+                if txn.get("id") and txn.get("merchant_id") is not None
+            ],
+        )
+        for merchant in merchants:
+            totals = conn.execute(
+                """
+                SELECT COUNT(*) AS orders, COALESCE(SUM(amount), 0) AS total
+                FROM knot_transactions
+                WHERE user_id = ? AND merchant_id = ?
+                """,
+                (row["user_id"], merchant.get("merchant_id")),
+            ).fetchone()
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO knot_merchants (
+                    user_id, merchant_id, merchant_name, orders, total_spend, last_sync
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    row["user_id"],
+                    merchant.get("merchant_id"),
+                    merchant.get("merchant_name") or "",
+                    totals["orders"],
+                    round(totals["total"], 2),
+                    merchant.get("last_sync") or row["updated_at"],
+                ),
+            )
+        conn.execute(
+            "UPDATE knot_profiles SET merchants_json = '[]', transactions_json = '[]' WHERE user_id = ?",
+            (row["user_id"],),
+        )
+
+
+def _classify_knot_essentials(conn: sqlite3.Connection) -> None:
+    """Classify Knot orders stored before ingestion recorded essential spend.
+
+    Product lines aren't kept, so each order is judged on its stored
+    description, then the affected merchant rollups are recomputed.
+    """
+    rows = conn.execute(
+        """
+        SELECT user_id, merchant_id, external_id, amount, description
+        FROM knot_transactions
+        WHERE essential_amount IS NULL
+        """
+    ).fetchall()
+    if not rows:
+        return
+    updates = []
+    for row in rows:
+        share = essentials.essential_share((), fallback=row["description"])
+        updates.append(
+            (int(share > 0), round((row["amount"] or 0) * share, 2), row["user_id"], row["merchant_id"], row["external_id"])
+        )
+    conn.executemany(
+        """
+        UPDATE knot_transactions SET is_essential = ?, essential_amount = ?
+        WHERE user_id = ? AND merchant_id = ? AND external_id = ?
+        """,
+        updates,
+    )
+    conn.executemany(
+        """
+        UPDATE knot_merchants SET essential_spend = (
+            SELECT ROUND(COALESCE(SUM(essential_amount), 0), 2) FROM knot_transactions t
+            WHERE t.user_id = knot_merchants.user_id AND t.merchant_id = knot_merchants.merchant_id
+        )
+        WHERE user_id = ? AND merchant_id = ?
+        """,
+        {(row["user_id"], row["merchant_id"]) for row in rows},
+    )
+    # Their materialized summaries carry the old ratio; the startup backfill rebuilds them.
+    conn.executemany(
+        "DELETE FROM user_dashboards WHERE user_id = ?",
+        {(row["user_id"],) for row in rows},
+    )
+
+
 def _ensure_user_columns(conn: sqlite3.Connection) -> None:
     """Ensure newer user fields exist without requiring manual migrations."""
     cursor = conn.execute("PRAGMA table_info(users)")
@@ -117,19 +681,258 @@ def _ensure_user_columns(conn: sqlite3.Connection) -> None:
         )
 
 
+def _ensure_verification_columns(conn: sqlite3.Connection) -> None:
+    """Add content hashes to ID verifications recorded before dedupe existed."""
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(id_verifications)")}
+    if "content_sha256" not in existing:
+        conn.execute("ALTER TABLE id_verifications ADD COLUMN content_sha256 TEXT")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_id_verifications_filename
+            ON id_verifications (filename)
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_id_verifications_user
+            ON id_verifications (user_id, id)
+        """
+    )
+
+
+def _ensure_settlement_columns(conn: sqlite3.Connection) -> None:
+    """Add the lease columns to settlement runs created before they existed."""
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(settlement_runs)")}
+    if "owner" not in existing:
+        conn.execute("ALTER TABLE settlement_runs ADD COLUMN owner TEXT")
+    if "claimed_at" not in existing:
+        conn.execute("ALTER TABLE settlement_runs ADD COLUMN claimed_at TEXT")
+
+
+def _ensure_schedule_columns(conn: sqlite3.Connection) -> None:
+    """Tie payment schedules to the match they repay, record its terms and how installments settled."""
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(payment_schedules)")}
+    if "match_id" not in existing:
+        conn.execute("ALTER TABLE payment_schedules ADD COLUMN match_id TEXT")
+        # Schedules are replaced per borrower, so the latest match owns them.
+        conn.execute(
+            """
+            UPDATE payment_schedules
+            SET match_id = (
+                SELECT m.id FROM matches m
+                WHERE m.user_id = payment_schedules.user_id
+                ORDER BY m.rowid DESC
+                LIMIT 1
+            )
+            """
+        )
+    if "principal" not in existing:
+        # Schedules written before amortization carried no interest.
+        conn.execute("ALTER TABLE payment_schedules ADD COLUMN principal REAL")
+        conn.execute("ALTER TABLE payment_schedules ADD COLUMN interest REAL NOT NULL DEFAULT 0")
+        conn.execute("UPDATE payment_schedules SET principal = amount")
+    if "installment" not in existing:
+        conn.execute("ALTER TABLE payment_schedules ADD COLUMN installment INTEGER")
+    if "txn_id" not in existing:
+        conn.execute("ALTER TABLE payment_schedules ADD COLUMN txn_id TEXT")
+        conn.execute("ALTER TABLE payment_schedules ADD COLUMN settled_at TEXT")
+    conn.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_schedules_installment
+            ON payment_schedules (match_id, installment)
+        """
+    )
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(matches)")}
+    for column, ddl in (
+        ("apr", "REAL NOT NULL DEFAULT 0"),
+        ("installments", "INTEGER"),
+        ("frequency", "TEXT"),
+    ):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE matches ADD COLUMN {column} {ddl}")
+
+
+def _migrate_parametric_schedules(conn: sqlite3.Connection) -> None:
+    """Collapse pending installment rows into one ``loan_schedules`` row per match.
+
+    Pending rows are derivable from the compact schedule, so they are deleted;
+    paid rows stay as the record of what was settled.
+    """
+    rows = conn.execute(
+        """
+        SELECT p.user_id, p.match_id, p.due_date, p.amount, p.principal, m.apr, m.frequency,
+               (SELECT COUNT(*) FROM payment_schedules s
+                WHERE s.match_id = p.match_id AND s.status != 'pending') AS settled
+        FROM payment_schedules p
+        JOIN matches m ON m.id = p.match_id
+        WHERE p.status = 'pending'
+        ORDER BY p.match_id, p.due_date
+        """
+    ).fetchall()
+    if not rows:
+        return
+    grouped: Dict[str, List[sqlite3.Row]] = {}
+    for row in rows:
+        grouped.setdefault(row["match_id"], []).append(row)
+    now = datetime.utcnow().isoformat()
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO loan_schedules (
+            match_id, user_id, principal, apr, frequency, installments, first_due,
+            payment, final_payment, base_index, next_due_date, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                match_id,
+                pending[0]["user_id"],
+                round(sum(row["principal"] if row["principal"] is not None else row["amount"] for row in pending), 2),
+                pending[0]["apr"] or 0.0,
+                pending[0]["frequency"] or "four_weekly",
+                len(pending),
+                pending[0]["due_date"],
+                pending[0]["amount"],
+                pending[-1]["amount"],
+                pending[0]["settled"],
+                pending[0]["due_date"],
+                now,
+            )
+            for match_id, pending in grouped.items()
+        ],
+    )
+    conn.execute("DELETE FROM payment_schedules WHERE status = 'pending' AND match_id IS NOT NULL")
+
+
+def _ensure_dashboard_columns(conn: sqlite3.Connection) -> None:
+    """Add portfolio columns to summary rows materialized before they existed."""
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(user_dashboards)")}
+    added = False
+    for column, ddl in (
+        ("principal_outstanding", "REAL NOT NULL DEFAULT 0"),
+        ("expected_yield_year", "REAL NOT NULL DEFAULT 0"),
+        ("next_inflow_date", "TEXT"),
+        ("inflow_next_cycle", "REAL NOT NULL DEFAULT 0"),
+    ):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE user_dashboards ADD COLUMN {column} {ddl}")
+            added = True
+    if added:
+        # Stale rows are rebuilt by the startup backfill.
+        conn.execute("DELETE FROM user_dashboards")
+
+
+def _ensure_knot_columns(conn: sqlite3.Connection) -> None:
+    """Add the essentials columns to Knot tables created before they existed."""
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(knot_transactions)")}
+    if "essential_amount" not in existing:
+        conn.execute("ALTER TABLE knot_transactions ADD COLUMN essential_amount REAL")
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(knot_merchants)")}
+    if "essential_spend" not in existing:
+        conn.execute(
+            "ALTER TABLE knot_merchants ADD COLUMN essential_spend REAL NOT NULL DEFAULT 0"
+        )
+
+
+class Transaction:
+    """Unit of work bound to a single pooled connection.
+
+    Every statement issued through it lands in one SQLite transaction that is
+    committed (and fsynced) once when the ``transaction()`` block exits, or
+    rolled back entirely if the block raises.
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def execute(self, query: str, params: Iterable = ()) -> sqlite3.Cursor:
+        with _timed(query):
+            return self._conn.execute(query, tuple(params))
+
+    def executemany(self, query: str, seq_of_params: Iterable[Iterable]) -> sqlite3.Cursor:
+        with _timed(query):
+            return self._conn.executemany(query, seq_of_params)
+
+    def fetchone(self, query: str, params: Iterable = ()) -> Optional[sqlite3.Row]:
+        with _timed(query):
+            cursor = self._conn.execute(query, tuple(params))
+            row = cursor.fetchone()
+        cursor.close()
+        return row
+
+    def fetchall(self, query: str, params: Iterable = ()):
+        with _timed(query):
+            return self._conn.execute(query, tuple(params)).fetchall()
+
+
+_local = threading.local()
+
+
+def _current_transaction() -> Optional[Transaction]:
+    return getattr(_local, "transaction", None)
+
+
+@contextmanager
+def transaction() -> Iterator[Transaction]:
+    """Run a multi-statement write as one atomic commit.
+
+    Nested calls on the same thread join the outermost transaction, and the
+    module-level helpers below route through it while it is open, so helpers
+    that write on their own can also be composed into a larger flow.
+    """
+    current = _current_transaction()
+    if current is not None:
+        yield current
+        return
+    with _pool.connection() as conn:
+        # IMMEDIATE takes the write lock up front so two writers never
+        # deadlock trying to upgrade from a shared read lock.
+        with _timed("BEGIN IMMEDIATE"):
+            conn.execute("BEGIN IMMEDIATE")
+        tx = Transaction(conn)
+        _local.transaction = tx
+        try:
+            yield tx
+            with _timed("COMMIT"):
+                conn.commit()
+        finally:
+            _local.transaction = None
+
+
 def execute(query: str, params: Iterable = ()) -> None:
-    with closing(_connect()) as conn:
-        conn.execute(query, tuple(params))
-        conn.commit()
+    current = _current_transaction()
+    if current is not None:
+        current.execute(query, params)
+        return
+    with _pool.connection() as conn:
+        with _timed(query):
+            conn.execute(query, tuple(params))
+            conn.commit()
+
+
+def executemany(query: str, seq_of_params: Iterable[Iterable]) -> None:
+    with transaction() as tx:
+        tx.executemany(query, seq_of_params)
 
 
 def fetchone(query: str, params: Iterable = ()) -> Optional[sqlite3.Row]:
-    with closing(_connect()) as conn:
-        cursor = conn.execute(query, tuple(params))
-        return cursor.fetchone()
+    current = _current_transaction()
+    if current is not None:
+        return current.fetchone(query, params)
+    with _pool.connection() as conn:
+        with _timed(query):
+            cursor = conn.execute(query, tuple(params))
+            # Close explicitly so a half-read cursor doesn't pin a WAL read
+            # snapshot on a connection that goes back to the pool.
+            row = cursor.fetchone()
+        cursor.close()
+        return row
 
 
 def fetchall(query: str, params: Iterable = ()):
-    with closing(_connect()) as conn:
-        cursor = conn.execute(query, tuple(params))
-        return cursor.fetchall()
+    current = _current_transaction()
+    if current is not None:
+        return current.fetchall(query, params)
+    with _pool.connection() as conn:
+        with _timed(query):
+            cursor = conn.execute(query, tuple(params))
+            return cursor.fetchall()
@@ -0,0 +1,62 @@
+"""Local essentials classifier for purchase descriptions.
+
+All keywords are compiled into one regular expression, so each product name
+is classified in a single C-level scan rather than one substring test per
+keyword. Matching stays case-insensitive substring matching, the rule the
+keyword list was written for.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Iterable, Optional, Sequence, Tuple
+
+ESSENTIAL_KEYWORDS = (
+    "grocery",
+    "milk",
+    "baby",
+    "diaper",
+    "produce",
+    "household",
+    "electric",
+    "utility",
+    "medicine",
+    "pharmacy",
+    "tuition",
+    "rent",
+    "gas",
+    "school",
+    "food",
+    "meal",
+    "pantry",
+)
+
+
+def compile_keywords(keywords: Iterable[str]) -> "re.Pattern[str]":
+    # Longest first so overlapping keywords resolve to the most specific one.
+    ordered = sorted({keyword.lower() for keyword in keywords}, key=len, reverse=True)
+    return re.compile("|".join(re.escape(keyword) for keyword in ordered))
+
+
+_PATTERN = compile_keywords(ESSENTIAL_KEYWORDS)
+
+
+def is_essential(text: Optional[str]) -> bool:
+    return bool(text) and _PATTERN.search(text.lower()) is not None
+
+
+def essential_share(lines: Sequence[Tuple[str, float]], fallback: Optional[str] = None) -> float:
+    """Weighted share of essential lines among ``(name, weight)`` product lines.
+
+    Orders without product lines are judged on ``fallback`` (e.g. the
+    merchant description) as a whole.
+    """
+    search = _PATTERN.search
+    total = essential = 0.0
+    for name, weight in lines:
+        total += weight
+        if search(name.lower()) is not None:
+            essential += weight
+    if total > 0:
+        return essential / total
+    return 1.0 if is_essential(fallback) else 0.0
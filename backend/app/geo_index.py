@@ -0,0 +1,191 @@
+"""Grid-cell spatial index for "points within N km" lookups.
+
+Points are bucketed into square cells of ``cell_km`` on a side (measured
+along the meridian). A radius query visits only the cells overlapping the
+query's bounding box - the cell containing the origin plus its neighbours -
+and keeps the points whose great-circle distance is within the radius, so
+cost depends on local density rather than on the total number of points.
+Longitude wraps at the antimeridian and the box widens towards the poles.
+
+Points are stored as unit vectors: great-circle distance grows with chord
+length, so the radius test is a squared-chord comparison with no
+trigonometry per point, and is exact rather than a flat-earth estimate.
+
+Each cell is kept sorted by a caller-supplied ``order`` key, so
+``ordered_within`` can merge the cells lazily and a caller that only needs
+the first few points in that order (the cheapest offers, say) stops early
+instead of collecting and sorting every point in range.
+"""
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import math
+from typing import Any, Dict, Iterator, List, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+Cell = Tuple[int, int]
+# (order, key, x, y, z, value); (order, key) is unique, so value is never compared.
+Item = Tuple[Any, str, float, float, float, Any]
+
+
+def _unit_vector(lat: float, lng: float) -> Tuple[float, float, float]:
+    phi = math.radians(lat)
+    lam = math.radians(lng)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def chord_km(chord: float) -> float:
+    """Great-circle distance for a squared chord returned by a query."""
+    return 2.0 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord) / 2.0))
+
+
+def _chord_limit(radius_km: float) -> float:
+    angle = min(math.pi, radius_km / EARTH_RADIUS_KM)
+    return (2.0 * math.sin(angle / 2.0)) ** 2
+
+
+class GridIndex:
+    """Points keyed by id, bucketed by grid cell. Not thread-safe on its own."""
+
+    def __init__(self, cell_km: float = 5.0) -> None:
+        if cell_km <= 0:
+            raise ValueError("cell_km must be positive")
+        self.cell_degrees = cell_km / KM_PER_DEGREE
+        self._columns = max(1, math.ceil(360.0 / self.cell_degrees))
+        self._cells: Dict[Cell, List[Item]] = {}
+        self._points: Dict[str, Tuple[Cell, Item]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _row(self, lat: float) -> int:
+        return math.floor(max(-90.0, min(90.0, lat)) / self.cell_degrees)
+
+    def _column(self, lng: float) -> int:
+        return math.floor((lng + 180.0) / self.cell_degrees) % self._columns
+
+    def cell(self, lat: float, lng: float) -> Cell:
+        return (self._row(lat), self._column(lng))
+
+    def insert(self, key: str, lat: float, lng: float, value: Any = None, order: Any = None) -> None:
+        """File ``key`` at a position; ``order`` (default: the key) sorts it within its cell."""
+        self.remove(key)
+        cell = self.cell(lat, lng)
+        item: Item = (key if order is None else order, key, *_unit_vector(lat, lng), value)
+        bisect.insort(self._cells.setdefault(cell, []), item)
+        self._points[key] = (cell, item)
+
+    def load(self, points: List[Tuple[str, float, float, Any, Any]]) -> None:
+        """Bulk ``insert`` of ``(key, lat, lng, value, order)``, sorting each cell once."""
+        for key, lat, lng, value, order in points:
+            self.remove(key)
+            cell = self.cell(lat, lng)
+            item: Item = (key if order is None else order, key, *_unit_vector(lat, lng), value)
+            self._cells.setdefault(cell, []).append(item)
+            self._points[key] = (cell, item)
+        for bucket in self._cells.values():
+            bucket.sort()
+
+    def remove(self, key: str) -> None:
+        existing = self._points.pop(key, None)
+        if existing is None:
+            return
+        cell, item = existing
+        bucket = self._cells[cell]
+        index = bisect.bisect_left(bucket, item)
+        if index < len(bucket) and bucket[index][1] == key:
+            del bucket[index]
+        if not bucket:
+            del self._cells[cell]
+
+    def clear(self) -> None:
+        self._cells.clear()
+        self._points.clear()
+
+    def _cells_near(self, lat: float, lng: float, radius_km: float) -> Iterator[List[Item]]:
+        radius_degrees = radius_km / KM_PER_DEGREE
+        low_row = self._row(lat - radius_degrees)
+        high_row = self._row(lat + radius_degrees)
+        # Widest longitude span of the box is at its most poleward edge.
+        edge = min(90.0, abs(lat) + radius_degrees)
+        cos_edge = math.cos(math.radians(edge))
+        span = 180.0 if cos_edge < 1e-9 else radius_degrees / cos_edge
+        if span >= 180.0:
+            columns = range(self._columns)
+        else:
+            first = math.floor((lng - span + 180.0) / self.cell_degrees)
+            last = math.floor((lng + span + 180.0) / self.cell_degrees)
+            if last - first + 1 >= self._columns:
+                columns = range(self._columns)
+            else:
+                columns = [column % self._columns for column in range(first, last + 1)]
+        cells = self._cells
+        for row in range(low_row, high_row + 1):
+            for column in columns:
+                bucket = cells.get((row, column))
+                if bucket:
+                    yield bucket
+
+    def within(self, lat: float, lng: float, radius_km: float) -> List[Tuple[float, Any, str, Any]]:
+        """``(chord, order, key, value)`` for every point within ``radius_km``, unordered.
+
+        ``chord`` sorts like distance; convert it with ``chord_km``.
+        """
+        if radius_km < 0:
+            return []
+        limit = _chord_limit(radius_km)
+        x0, y0, z0 = _unit_vector(lat, lng)
+        found: List[Tuple[float, Any, str, Any]] = []
+        append = found.append
+        for bucket in self._cells_near(lat, lng, radius_km):
+            for order, key, x, y, z, value in bucket:
+                dx = x - x0
+                dy = y - y0
+                dz = z - z0
+                chord = dx * dx + dy * dy + dz * dz
+                if chord <= limit:
+                    append((chord, order, key, value))
+        return found
+
+    def ordered_within(self, lat: float, lng: float, radius_km: float) -> Iterator[Tuple[Any, float, str, Any]]:
+        """``(order, chord, key, value)`` for points within ``radius_km``, lazily in ``order``.
+
+        Must be consumed before the index is modified.
+        """
+        if radius_km < 0:
+            return iter(())
+        limit = _chord_limit(radius_km)
+        x0, y0, z0 = _unit_vector(lat, lng)
+
+        def scan(bucket: List[Item]) -> Iterator[Tuple[Any, float, str, Any]]:
+            for order, key, x, y, z, value in bucket:
+                dx = x - x0
+                dy = y - y0
+                dz = z - z0
+                chord = dx * dx + dy * dy + dz * dz
+                if chord <= limit:
+                    yield (order, chord, key, value)
+
+        return heapq.merge(*[scan(bucket) for bucket in self._cells_near(lat, lng, radius_km)])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "points": len(self._points),
+            "cells": len(self._cells),
+            "cell_km": round(self.cell_degrees * KM_PER_DEGREE, 3),
+            "max_per_cell": max((len(bucket) for bucket in self._cells.values()), default=0),
+        }
@@ -0,0 +1,187 @@
+"""Shared async HTTP clients for outbound integrations (Grok, Gemini, X).
+
+Each integration gets one long-lived ``httpx.AsyncClient`` with keep-alive
+pooling (and HTTP/2 when the optional ``h2`` package is installed), its own
+timeout, and a semaphore capping in-flight calls so one slow upstream can't
+exhaust sockets or starve the others. Clients are opened and closed by the
+app lifespan; calls made outside it (scripts, tests) open them lazily.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import httpx
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+
+@dataclass(frozen=True)
+class IntegrationConfig:
+    name: str
+    timeout: float
+    max_concurrency: int
+    max_connections: int
+
+
+def _config(name: str, timeout: float, concurrency: int) -> IntegrationConfig:
+    prefix = f"{name.upper()}_HTTP"
+    return IntegrationConfig(
+        name=name,
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT_SECONDS", timeout)),
+        max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", concurrency)),
+        max_connections=int(os.getenv(f"{prefix}_MAX_CONNECTIONS", concurrency)),
+    )
+
+
+INTEGRATIONS: Dict[str, IntegrationConfig] = {
+    "grok": _config("grok", 20, 16),
+    "gemini": _config("gemini", 15, 32),
+    "x": _config("x", 10, 8),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+CALL_SECONDS = metrics.Histogram(
+    "http_client_request_duration_seconds",
+    "Outbound call time per integration, by outcome (2xx/4xx/5xx, or error when no response arrived).",
+    ("integration", "outcome"),
+)
+SLOT_WAIT_SECONDS = metrics.Histogram(
+    "http_client_slot_wait_seconds",
+    "Time outbound calls waited for a concurrency slot.",
+    ("integration",),
+)
+
+
+def _outcome(response: Optional[httpx.Response]) -> str:
+    return f"{response.status_code // 100}xx" if response is not None else "error"
+
+
+def _open(config: IntegrationConfig) -> httpx.AsyncClient:
+    client = httpx.AsyncClient(
+        timeout=config.timeout,
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_connections,
+            keepalive_expiry=60,
+        ),
+    )
+    _clients[config.name] = client
+    _semaphores[config.name] = asyncio.Semaphore(config.max_concurrency)
+    return client
+
+
+async def startup() -> None:
+    for config in INTEGRATIONS.values():
+        if config.name not in _clients:
+            _open(config)
+    logger.info("Outbound HTTP clients ready (http2=%s).", HTTP2_ENABLED)
+
+
+async def shutdown() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    _semaphores.clear()
+    for client in clients:
+        await client.aclose()
+
+
+async def request(
+    integration: str,
+    method: str,
+    url: str,
+    *,
+    timeout: Optional[float] = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """Send a request through the integration's pooled client.
+
+    Waits for a concurrency slot first; raises ``httpx.HTTPError`` subclasses
+    exactly like a plain ``httpx`` call would.
+    """
+    config = INTEGRATIONS[integration]
+    client = _clients.get(integration) or _open(config)
+    semaphore = _semaphores[integration]
+    queued = time.perf_counter()
+    async with semaphore:
+        started = time.perf_counter()
+        SLOT_WAIT_SECONDS.observe(started - queued, integration)
+        response = None
+        try:
+            response = await client.request(
+                method,
+                url,
+                timeout=config.timeout if timeout is None else timeout,
+                **kwargs,
+            )
+            return response
+        finally:
+            CALL_SECONDS.observe(time.perf_counter() - started, integration, _outcome(response))
+
+
+def stream(integration: str, method: str, url: str, **kwargs: Any) -> "_SlotStream":
+    """Streaming variant of ``request``; use as ``async with stream(...)``.
+
+    The concurrency slot is held until the streamed response is closed.
+    """
+    config = INTEGRATIONS[integration]
+    client = _clients.get(integration) or _open(config)
+    return _SlotStream(integration, _semaphores[integration], client.stream(method, url, **kwargs))
+
+
+class _SlotStream:
+    """Holds a concurrency slot for a streamed call; timed until the stream closes."""
+
+    def __init__(self, integration: str, semaphore: asyncio.Semaphore, inner: Any) -> None:
+        self._integration = integration
+        self._semaphore = semaphore
+        self._inner = inner
+        self._started = 0.0
+        self._response: Optional[httpx.Response] = None
+
+    async def __aenter__(self) -> httpx.Response:
+        queued = time.perf_counter()
+        await self._semaphore.acquire()
+        self._started = time.perf_counter()
+        SLOT_WAIT_SECONDS.observe(self._started - queued, self._integration)
+        try:
+            self._response = await self._inner.__aenter__()
+            return self._response
+        except BaseException:
+            self._semaphore.release()
+            CALL_SECONDS.observe(time.perf_counter() - self._started, self._integration, "error")
+            raise
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        try:
+            await self._inner.__aexit__(*exc_info)
+        finally:
+            self._semaphore.release()
+            outcome = "error" if exc_info[0] is not None else _outcome(self._response)
+            CALL_SECONDS.observe(time.perf_counter() - self._started, self._integration, outcome)
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        name: {
+            "open": name in _clients,
+            "timeout_seconds": config.timeout,
+            "max_concurrency": config.max_concurrency,
+            "max_connections": config.max_connections,
+            "http2": HTTP2_ENABLED,
+        }
+        for name, config in INTEGRATIONS.items()
+    }
@@ -0,0 +1,211 @@
+"""Retention and compaction for stored ID documents.
+
+Usage (from ``backend/``)::
+
+    python -m app.id_retention [--batch-size 500] [--dry-run]
+
+Three passes, each working in fixed-size batches so the write lock and
+memory stay bounded:
+
+1. documents of verified users that were superseded by a newer upload are
+   marked ``superseded``; their files are deleted unless another live
+   verification still references the same content;
+2. content-addressed files left at the root of the upload directory are
+   moved into their shard;
+3. files with no live ``id_verifications`` row (and stale ``.part`` files)
+   older than a grace period are deleted.
+
+Files modified within the grace period are never deleted: uploads write (or,
+for duplicate content, touch) the file before their row is committed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from . import database, id_storage
+
+ID_RETENTION_BATCH_SIZE = int(os.getenv("ID_RETENTION_BATCH_SIZE", "500"))
+ID_RETENTION_ORPHAN_GRACE_SECONDS = float(os.getenv("ID_RETENTION_ORPHAN_GRACE_SECONDS", "3600"))
+
+
+def _unlink(path: Path, report: Dict[str, int], key: str, dry_run: bool) -> None:
+    try:
+        size = path.stat().st_size
+        if not dry_run:
+            path.unlink()
+    except FileNotFoundError:
+        return
+    report[key] += 1
+    report["bytes_reclaimed"] += size
+
+
+def _purge_superseded(batch_size: int, report: Dict[str, int], dry_run: bool) -> None:
+    last_id = 0
+    while True:
+        rows = database.fetchall(
+            """
+            SELECT v.id, v.filename
+            FROM id_verifications v
+            JOIN users u ON u.id = v.user_id
+            WHERE u.is_verified = 1
+              AND v.status != 'superseded'
+              AND v.id > ?
+              AND v.id < (SELECT MAX(id) FROM id_verifications WHERE user_id = v.user_id)
+            ORDER BY v.id
+            LIMIT ?
+            """,
+            (last_id, batch_size),
+        )
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        report["superseded_rows"] += len(rows)
+        filenames = sorted({row["filename"] for row in rows})
+        if dry_run:
+            still_live = _live_filenames(filenames, exclude_ids=[row["id"] for row in rows])
+            _delete_superseded_files(filenames, still_live, report, dry_run)
+            continue
+        now = datetime.utcnow().isoformat()
+        with database.transaction() as tx:
+            tx.executemany(
+                "UPDATE id_verifications SET status = 'superseded', reviewed_at = ? WHERE id = ?",
+                [(now, row["id"]) for row in rows],
+            )
+            # Checked and deleted under the write lock, so no verification
+            # referencing these files can commit in between.
+            _delete_superseded_files(filenames, _live_filenames(filenames), report, dry_run)
+
+
+def _delete_superseded_files(filenames: List[str], live: set, report: Dict[str, int], dry_run: bool) -> None:
+    cutoff = time.time() - ID_RETENTION_ORPHAN_GRACE_SECONDS
+    for filename in filenames:
+        if filename in live:
+            continue
+        path = id_storage.path_for(filename)
+        try:
+            if path.stat().st_mtime >= cutoff:
+                # Just deduplicated against: its new row may not be committed yet.
+                continue
+        except FileNotFoundError:
+            continue
+        _unlink(path, report, "superseded_files_deleted", dry_run)
+
+
+def _live_filenames(filenames: List[str], exclude_ids: Optional[List[int]] = None) -> set:
+    """Subset of ``filenames`` still referenced by a non-superseded verification."""
+    live = set()
+    excluded = set(exclude_ids or ())
+    for start in range(0, len(filenames), 500):
+        chunk = filenames[start : start + 500]
+        placeholders = ", ".join("?" for _ in chunk)
+        rows = database.fetchall(
+            f"""
+            SELECT id, filename FROM id_verifications
+            WHERE status != 'superseded' AND filename IN ({placeholders})
+            """,
+            chunk,
+        )
+        live.update(row["filename"] for row in rows if row["id"] not in excluded)
+    return live
+
+
+def _shard_flat_files(report: Dict[str, int], dry_run: bool) -> None:
+    with os.scandir(id_storage.ID_UPLOAD_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file() or not id_storage.is_content_addressed(entry.name):
+                continue
+            destination = id_storage.path_for(entry.name)
+            report["files_sharded"] += 1
+            if dry_run:
+                continue
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            if destination.exists():
+                _unlink(Path(entry.path), report, "duplicates_deleted", dry_run)
+            else:
+                os.replace(entry.path, destination)
+
+
+def _iter_files() -> Iterator[os.DirEntry]:
+    stack = [str(id_storage.ID_UPLOAD_DIR)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def _delete_orphans(batch_size: int, report: Dict[str, int], dry_run: bool) -> None:
+    cutoff = time.time() - ID_RETENTION_ORPHAN_GRACE_SECONDS
+    batch: List[os.DirEntry] = []
+
+    def flush() -> None:
+        names = sorted({entry.name for entry in batch})
+        placeholders = ", ".join("?" for _ in names)
+        rows = database.fetchall(
+            f"""
+            SELECT DISTINCT filename FROM id_verifications
+            WHERE status != 'superseded' AND filename IN ({placeholders})
+            """,
+            names,
+        )
+        referenced = {row["filename"] for row in rows}
+        for entry in batch:
+            if entry.name not in referenced:
+                _unlink(Path(entry.path), report, "orphans_deleted", dry_run)
+        batch.clear()
+
+    for entry in _iter_files():
+        report["files_scanned"] += 1
+        if entry.stat().st_mtime >= cutoff:
+            continue
+        if entry.name.endswith(id_storage.PARTIAL_SUFFIX):
+            _unlink(Path(entry.path), report, "partials_deleted", dry_run)
+            continue
+        batch.append(entry)
+        if len(batch) >= min(batch_size, 500):
+            flush()
+    if batch:
+        flush()
+
+
+def compact(batch_size: int = ID_RETENTION_BATCH_SIZE, dry_run: bool = False) -> Dict[str, int]:
+    """Run every retention pass; returns counts and the bytes reclaimed."""
+    report = {
+        "superseded_rows": 0,
+        "superseded_files_deleted": 0,
+        "files_sharded": 0,
+        "duplicates_deleted": 0,
+        "files_scanned": 0,
+        "orphans_deleted": 0,
+        "partials_deleted": 0,
+        "bytes_reclaimed": 0,
+    }
+    started = time.perf_counter()
+    _purge_superseded(batch_size, report, dry_run)
+    _shard_flat_files(report, dry_run)
+    _delete_orphans(batch_size, report, dry_run)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["dry_run"] = dry_run
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reclaim space from superseded and orphaned ID documents.")
+    parser.add_argument("--batch-size", type=int, default=ID_RETENTION_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting.")
+    args = parser.parse_args()
+    database.init_db()
+    print(json.dumps(compact(args.batch_size, args.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""Content-addressed storage for uploaded ID documents.
+
+Documents are stored under the SHA-256 of their bytes, so re-uploading the
+same file finds the existing copy instead of writing another one. Files are
+sharded two levels deep by digest prefix (``ab/cd/abcd….jpg``) so no single
+directory grows past a few thousand entries.
+
+Uploads are hashed while they are copied into a temporary ``.part`` file,
+so every byte is read once; the file is then renamed to its digest path, or
+dropped when that content is already stored. Readers never see a
+half-written document. All file I/O runs in the threadpool, off the event
+loop.
+
+``receive_upload`` parses the multipart request body as it arrives instead
+of letting the framework spool it first. The file type is sniffed from the
+document's first bytes and must agree with the declared content type; a
+mislabeled upload is rejected before the rest of it is received, and
+nothing is written. The stored extension comes from the sniffed type, so
+the same bytes always map to the same name.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, FrozenSet, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from multipart.multipart import MultipartParser, parse_options_header
+
+from . import metrics
+
+ID_UPLOAD_DIR = Path(
+    os.getenv(
+        "ID_UPLOAD_DIR",
+        Path(__file__).resolve().parent / "uploads" / "id_documents",
+    )
+)
+ID_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+MAX_ID_UPLOAD_BYTES = int(os.getenv("ID_UPLOAD_MAX_BYTES", 5 * 1024 * 1024))
+ID_UPLOAD_CHUNK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = ".part"
+# Room in a request body for the form's other fields and part headers.
+ID_UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+IO_SECONDS = metrics.Histogram(
+    "id_upload_io_seconds",
+    "Time spent storing ID uploads: hashing and writing (write), then renaming or deduplicating (finish).",
+    ("step",),
+)
+
+_CONTENT_NAME = re.compile(r"[0-9a-f]{64}\.[a-z0-9]+")
+
+DOCUMENT_EXTENSIONS: Dict[str, str] = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/heic": ".heic",
+    "image/heif": ".heif",
+    "application/pdf": ".pdf",
+}
+# ISO-BMFF major brands (bytes 8-12, after the "ftyp" box type).
+_HEIC_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"hevm", b"hevs"}
+_HEIF_BRANDS = {b"mif1", b"msf1", b"mif2"}
+# Phones label HEIF stills as either type, so the two are interchangeable.
+_COMPATIBLE: Dict[str, FrozenSet[str]] = {
+    "image/heic": frozenset({"image/heic", "image/heif"}),
+    "image/heif": frozenset({"image/heic", "image/heif"}),
+}
+# The PDF header may follow a little leading junk; readers scan the first 1 KiB.
+_PDF_SCAN_BYTES = 1024
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded ``MAX_ID_UPLOAD_BYTES``."""
+
+
+class EmptyUpload(Exception):
+    """The upload contained no bytes."""
+
+
+class UnsupportedDocument(Exception):
+    """The upload's declared content type isn't one we store."""
+
+
+class BadUploadForm(Exception):
+    """The request body isn't a usable multipart form."""
+
+
+class MismatchedDocument(Exception):
+    """The upload's magic bytes don't match its declared content type."""
+
+    def __init__(self, declared: str, detected: Optional[str]) -> None:
+        super().__init__(f"Declared {declared or 'no type'} but content looks like {detected or 'unknown'}")
+        self.declared = declared
+        self.detected = detected
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """Content type from a file's leading bytes, or None if unrecognized."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in _HEIC_BRANDS:
+            return "image/heic"
+        if brand in _HEIF_BRANDS:
+            return "image/heif"
+    if b"%PDF-" in head[:_PDF_SCAN_BYTES]:
+        return "application/pdf"
+    return None
+
+
+def _check_type(head: bytes, declared: str) -> str:
+    detected = sniff(head)
+    if detected is None or detected not in _COMPATIBLE.get(declared, frozenset({declared})):
+        raise MismatchedDocument(declared, detected)
+    return detected
+
+
+@dataclass(frozen=True)
+class StoredDocument:
+    sha256: str
+    size: int
+    storage_name: str
+    content_type: str
+    deduplicated: bool
+
+
+def storage_name(digest: str, extension: str) -> str:
+    return f"{digest}{extension}"
+
+
+def is_content_addressed(name: str) -> bool:
+    return _CONTENT_NAME.fullmatch(name) is not None
+
+
+def path_for(name: str) -> Path:
+    """Where a stored document lives; legacy timestamped names sit at the root."""
+    if is_content_addressed(name):
+        return ID_UPLOAD_DIR / name[:2] / name[2:4] / name
+    return ID_UPLOAD_DIR / name
+
+
+class DocumentWriter:
+    """Hash and write a document in one pass as its bytes arrive; blocking.
+
+    The type is checked once the first ``_PDF_SCAN_BYTES`` have arrived,
+    before anything touches the disk. Bytes then go to a ``.part`` file in
+    the upload directory while being hashed; ``finish`` renames it to its
+    digest path, or drops it when that content is already stored.
+    """
+
+    def __init__(self, declared_type: str, max_bytes: int = MAX_ID_UPLOAD_BYTES) -> None:
+        if declared_type not in DOCUMENT_EXTENSIONS:
+            raise UnsupportedDocument(declared_type)
+        self.declared_type = declared_type
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.content_type = ""
+        self._hasher = hashlib.sha256()
+        self._head = b""
+        self._partial: Optional[Path] = None
+        self._out: Optional[BinaryIO] = None
+        self._write_seconds = 0.0
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        started = time.perf_counter()
+        try:
+            self._write(chunk)
+        finally:
+            self._write_seconds += time.perf_counter() - started
+
+    def _write(self, chunk: bytes) -> None:
+        if not self.content_type and len(self._head) + len(chunk) >= _PDF_SCAN_BYTES:
+            # Sniff first, so a mislabeled file is reported as such whatever its size.
+            _check_type(self._head + chunk[:_PDF_SCAN_BYTES], self.declared_type)
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge()
+        if not self.content_type:
+            self._head += chunk
+            if len(self._head) < _PDF_SCAN_BYTES:
+                return
+            chunk, self._head = self._head, b""
+            self._start(chunk)
+        self._hasher.update(chunk)
+        assert self._out is not None
+        self._out.write(chunk)
+
+    def _start(self, head: bytes) -> None:
+        # Reject on the first bytes, before opening anything on disk.
+        self.content_type = _check_type(head, self.declared_type)
+        self._partial = ID_UPLOAD_DIR / f".upload.{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+        self._out = self._partial.open("wb")
+
+    def finish(self) -> StoredDocument:
+        """Store the document under its digest; the writer is closed either way."""
+        IO_SECONDS.observe(self._write_seconds, "write")
+        with IO_SECONDS.time("finish"):
+            return self._finish()
+
+    def _finish(self) -> StoredDocument:
+        try:
+            if not self.content_type:
+                if not self._head:
+                    raise EmptyUpload()
+                # Shorter than the sniff window: the whole file is the head.
+                head, self._head = self._head, b""
+                self._start(head)
+                self._hasher.update(head)
+                assert self._out is not None
+                self._out.write(head)
+            assert self._out is not None and self._partial is not None
+            self._out.close()
+            digest = self._hasher.hexdigest()
+            name = storage_name(digest, DOCUMENT_EXTENSIONS[self.content_type])
+            written = _place(self._partial, path_for(name))
+        except BaseException:
+            self.abort()
+            raise
+        self._partial = None
+        return StoredDocument(
+            sha256=digest,
+            size=self.size,
+            storage_name=name,
+            content_type=self.content_type,
+            deduplicated=not written,
+        )
+
+    def abort(self) -> None:
+        if self._out is not None:
+            self._out.close()
+        if self._partial is not None:
+            self._partial.unlink(missing_ok=True)
+            self._partial = None
+
+
+def _place(partial: Path, destination: Path) -> bool:
+    """Move ``partial`` to ``destination`` unless it exists; returns True if moved.
+
+    An existing copy is touched, so retention's grace period protects it
+    until the new verification row referencing it is committed.
+    """
+    try:
+        os.utime(destination)
+    except FileNotFoundError:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # A concurrent upload of the same bytes may have won; either copy is identical.
+        os.replace(partial, destination)
+        return True
+    partial.unlink(missing_ok=True)
+    return False
+
+
+def save(fp: BinaryIO, declared_type: str, max_bytes: int = MAX_ID_UPLOAD_BYTES) -> StoredDocument:
+    """Validate, hash and store a file object; blocking, so call it off the event loop."""
+    writer = DocumentWriter(declared_type, max_bytes)
+    fp.seek(0)
+    try:
+        while True:
+            chunk = fp.read(ID_UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.finish()
+
+
+class _StreamingForm:
+    """Multipart callbacks that keep small fields and hand one file part to a writer."""
+
+    def __init__(self, file_field: str, max_bytes: int) -> None:
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.fields: Dict[str, str] = {}
+        self.writer: Optional[DocumentWriter] = None
+        # File bytes parsed from the latest network chunk, written off the loop.
+        self.pending: List[bytes] = []
+        self._field_bytes = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._name = ""
+        self._data: Optional[List[bytes]] = None
+        self._is_document = False
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._name = ""
+        self._data = None
+        self._is_document = False
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise BadUploadForm("Every form part needs a name.")
+        self._name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" not in options:
+            self._data = []
+        elif self._name == self.file_field and self.writer is None:
+            declared = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+            self.writer = DocumentWriter(declared, self.max_bytes)
+            self._is_document = True
+        # Other file parts are skipped.
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._is_document:
+            self.pending.append(data[start:end])
+        elif self._data is not None:
+            self._field_bytes += end - start
+            if self._field_bytes > ID_UPLOAD_FORM_OVERHEAD:
+                raise BadUploadForm("Form fields are too large.")
+            self._data.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self._data is not None:
+            self.fields.setdefault(self._name, b"".join(self._data).decode("utf-8", "replace"))
+        self._is_document = False
+
+
+async def receive_upload(
+    request: Request,
+    file_field: str = "document",
+    max_bytes: int = MAX_ID_UPLOAD_BYTES,
+) -> Tuple[Dict[str, str], StoredDocument]:
+    """Store the ``file_field`` part of a multipart request as it streams in.
+
+    Nothing is spooled: a declared length over the limit is refused before
+    the body is read, the type is checked on the document's first bytes,
+    and every later chunk is hashed and written straight to its ``.part``
+    file. Returns the form's other (text) fields and the stored document.
+    """
+    declared_length = request.headers.get("content-length", "")
+    if declared_length.isdigit() and int(declared_length) > max_bytes + ID_UPLOAD_FORM_OVERHEAD:
+        raise UploadTooLarge()
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise BadUploadForm("Expected a multipart/form-data body.")
+    form = _StreamingForm(file_field, max_bytes)
+    callbacks = {
+        name: getattr(form, name)
+        for name in (
+            "on_part_begin",
+            "on_part_data",
+            "on_part_end",
+            "on_header_field",
+            "on_header_value",
+            "on_header_end",
+            "on_headers_finished",
+        )
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if form.pending:
+                data = b"".join(form.pending)
+                form.pending.clear()
+                assert form.writer is not None
+                await run_in_threadpool(form.writer.write, data)
+        parser.finalize()
+        if form.writer is None:
+            raise BadUploadForm(f"The form has no {file_field} file.")
+        stored = await run_in_threadpool(form.writer.finish)
+    except BaseException:
+        if form.writer is not None:
+            await run_in_threadpool(form.writer.abort)
+        raise
+    return form.fields, stored
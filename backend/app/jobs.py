@@ -0,0 +1,272 @@
+"""Durable background jobs backed by the SQLite ``jobs`` table.
+
+Work that doesn't need to finish before a response is sent (e.g. posting a
+loan announcement to X) is enqueued here and run by asyncio workers started
+with the app. Jobs survive restarts, are deduplicated by ``dedupe_key`` and
+retried with exponential backoff until ``max_attempts`` is reached, after
+which they are marked ``failed`` with the last error kept for inspection.
+A handler raises ``RetryJob`` for a transient failure and ``FailJob`` for
+one that retrying can't fix. A job whose worker died on its last attempt
+is failed rather than claimed again.
+
+Claiming uses ``BEGIN IMMEDIATE``, so several processes can share one queue
+without running a job twice.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "2")))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "5"))
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "900"))
+# A job still "running" after this long belonged to a worker that died.
+JOB_LOCK_TIMEOUT_SECONDS = float(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "300"))
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+_handlers: Dict[str, Handler] = {}
+_tasks: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class RetryJob(Exception):
+    """Raised by a handler for a transient failure that should be retried."""
+
+
+class FailJob(Exception):
+    """Raised by a handler for a permanent failure; the job is failed without retrying."""
+
+
+def register(kind: str, handler: Handler) -> None:
+    _handlers[kind] = handler
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+def enqueue(
+    kind: str,
+    payload: Dict[str, Any],
+    dedupe_key: str,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+) -> int:
+    """Queue a job unless one with ``dedupe_key`` already exists; returns its id.
+
+    Joins the caller's transaction when there is one, so a job can be
+    committed atomically with the row it refers to.
+    """
+    now = _now().isoformat()
+    with database.transaction() as tx:
+        tx.execute(
+            """
+            INSERT INTO jobs (
+                kind, dedupe_key, payload_json, max_attempts, run_after, created_at, updated_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(dedupe_key) DO NOTHING
+            """,
+            (kind, dedupe_key, json.dumps(payload), max_attempts, now, now, now),
+        )
+        row = tx.fetchone("SELECT id FROM jobs WHERE dedupe_key = ?", (dedupe_key,))
+    return row["id"]
+
+
+def notify() -> None:
+    """Wake idle workers early; safe to call from any thread."""
+    if _loop is None or _wakeup is None:
+        return
+    try:
+        _loop.call_soon_threadsafe(_wakeup.set)
+    except RuntimeError:
+        # Loop already closed during shutdown.
+        pass
+
+
+def _serialize(row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "dedupe_key": row["dedupe_key"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "max_attempts": row["max_attempts"],
+        "run_after": row["run_after"],
+        "result": json.loads(row["result_json"]) if row["result_json"] else None,
+        "last_error": row["last_error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+def get(dedupe_key: str) -> Optional[Dict[str, Any]]:
+    row = database.fetchone("SELECT * FROM jobs WHERE dedupe_key = ?", (dedupe_key,))
+    return _serialize(row) if row else None
+
+
+def claim(limit: int = 1) -> List[Dict[str, Any]]:
+    """Mark up to ``limit`` due jobs as running and return them."""
+    now = _now()
+    stale = (now - timedelta(seconds=JOB_LOCK_TIMEOUT_SECONDS)).isoformat()
+    with database.transaction() as tx:
+        # A job that keeps killing its worker must not be retried forever.
+        tx.execute(
+            """
+            UPDATE jobs
+            SET status = 'failed', locked_at = NULL, updated_at = ?,
+                last_error = 'worker stopped during the final attempt'
+            WHERE status = 'running' AND locked_at < ? AND attempts >= max_attempts
+            """,
+            (now.isoformat(), stale),
+        )
+        rows = tx.fetchall(
+            """
+            SELECT id, kind, payload_json, attempts, max_attempts
+            FROM jobs
+            WHERE (status = 'queued' AND run_after <= ?)
+               OR (status = 'running' AND locked_at < ?)
+            ORDER BY run_after
+            LIMIT ?
+            """,
+            (now.isoformat(), stale, limit),
+        )
+        tx.executemany(
+            """
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, locked_at = ?, updated_at = ?
+            WHERE id = ?
+            """,
+            [(now.isoformat(), now.isoformat(), row["id"]) for row in rows],
+        )
+    return [
+        {
+            "id": row["id"],
+            "kind": row["kind"],
+            "payload": json.loads(row["payload_json"]),
+            "attempt": row["attempts"] + 1,
+            "max_attempts": row["max_attempts"],
+        }
+        for row in rows
+    ]
+
+
+def complete(job_id: int, result: Optional[Dict[str, Any]]) -> None:
+    now = _now().isoformat()
+    database.execute(
+        """
+        UPDATE jobs
+        SET status = 'succeeded', result_json = ?, last_error = NULL, locked_at = NULL, updated_at = ?
+        WHERE id = ?
+        """,
+        (json.dumps(result) if result is not None else None, now, job_id),
+    )
+
+
+def _backoff(attempt: int) -> float:
+    delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+    # Jitter so jobs that failed together don't retry in lockstep.
+    return delay * random.uniform(0.8, 1.2)
+
+
+def fail(job: Dict[str, Any], error: str) -> None:
+    """Reschedule a failed attempt, or give up once attempts run out."""
+    now = _now()
+    if job["attempt"] >= job["max_attempts"]:
+        status, run_after = "failed", now
+    else:
+        status, run_after = "queued", now + timedelta(seconds=_backoff(job["attempt"]))
+    database.execute(
+        """
+        UPDATE jobs
+        SET status = ?, run_after = ?, last_error = ?, locked_at = NULL, updated_at = ?
+        WHERE id = ?
+        """,
+        (status, run_after.isoformat(), error[:500], now.isoformat(), job["id"]),
+    )
+
+
+async def _run(job: Dict[str, Any]) -> None:
+    handler = _handlers.get(job["kind"])
+    if handler is None:
+        await asyncio.to_thread(fail, {**job, "attempt": job["max_attempts"]}, "no handler registered")
+        return
+    try:
+        result = await handler(job["payload"])
+    except asyncio.CancelledError:
+        raise
+    except RetryJob as exc:
+        logger.info("Job %s (%s) attempt %s will retry: %s", job["id"], job["kind"], job["attempt"], exc)
+        await asyncio.to_thread(fail, job, str(exc))
+        return
+    except FailJob as exc:
+        logger.warning("Job %s (%s) failed permanently: %s", job["id"], job["kind"], exc)
+        await asyncio.to_thread(fail, {**job, "attempt": job["max_attempts"]}, str(exc))
+        return
+    except Exception as exc:  # noqa: BLE001 - a bad job must not kill the worker
+        logger.exception("Job %s (%s) attempt %s crashed", job["id"], job["kind"], job["attempt"])
+        await asyncio.to_thread(fail, job, f"{type(exc).__name__}: {exc}")
+        return
+    await asyncio.to_thread(complete, job["id"], result)
+
+
+async def _worker(index: int) -> None:
+    assert _wakeup is not None
+    while True:
+        try:
+            claimed = await asyncio.to_thread(claim, 1)
+        except Exception:  # noqa: BLE001
+            logger.exception("Job worker %s failed to claim work", index)
+            claimed = []
+        if claimed:
+            await _run(claimed[0])
+            continue
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start(workers: int = JOB_WORKERS) -> None:
+    global _wakeup, _loop
+    if _tasks:
+        return
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    for index in range(workers):
+        _tasks.append(asyncio.create_task(_worker(index), name=f"job-worker-{index}"))
+    logger.info("Started %s background job worker(s).", workers)
+
+
+async def stop() -> None:
+    """Cancel the workers; a job interrupted mid-run is re-claimed after the lock timeout."""
+    global _wakeup, _loop
+    tasks = list(_tasks)
+    _tasks.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _wakeup = None
+    _loop = None
+
+
+def stats() -> Dict[str, Any]:
+    rows = database.fetchall("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status")
+    return {
+        "workers": len(_tasks),
+        "by_status": {row["status"]: row["total"] for row in rows},
+    }
@@ -0,0 +1,240 @@
+"""Streaming ingestion of Knot merchant exports.
+
+Exports are parsed incrementally: ``iter_orders`` walks the file in fixed
+size chunks and yields one order at a time with ``json.JSONDecoder``, so
+peak memory is bounded by the largest single order plus one chunk, not by
+the size of the export. Orders are normalized and upserted in batches, each
+in its own short transaction.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from . import dashboards, database, essentials, knot_store
+
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 2000
+# Top-level keys that may hold the list of orders in an export object.
+ORDER_LIST_KEYS = ("transactions", "orders", "data", "items")
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}:"
+
+
+class _Reader:
+    """Sliding window over a text stream for incremental JSON decoding."""
+
+    def __init__(self, fp: TextIO, chunk_size: int) -> None:
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos:
+            # Drop what has been consumed so the window never grows with the file.
+            self.buf = self.buf[self.pos :]
+            self.pos = 0
+        self.buf += chunk
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of export window")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut by the window edge ("12" of "12.5") still decodes;
+            # only trust it once the following delimiter is in view.
+            if (end == len(self.buf) or self.buf[end] not in _DELIMITERS) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_array(reader: _Reader) -> Iterator[Any]:
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError("Malformed order list in export")
+
+
+def iter_orders(fp: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yield the orders of an export one at a time.
+
+    Accepts the same shapes the exports come in: a bare list of orders, an
+    object holding the list under one of ``ORDER_LIST_KEYS``, or a single
+    order object.
+    """
+    reader = _Reader(fp, chunk_size)
+    first = reader.peek()
+    if first == "[":
+        yield from _iter_array(reader)
+        return
+    if first != "{":
+        return
+    reader.expect("{")
+    members: Dict[str, Any] = {}
+    while reader.peek() not in ("}", ""):
+        key = reader.value()
+        reader.expect(":")
+        if key in ORDER_LIST_KEYS and reader.peek() == "[":
+            yield from _iter_array(reader)
+            return
+        members[key] = reader.value()
+        if reader.peek() == ",":
+            reader.pos += 1
+    # No order list: the object itself is a single order.
+    yield members
+
+
+def to_float(value) -> float:
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        cleaned = value.replace("$", "").replace(",", "").strip()
+        try:
+            return float(cleaned)
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def _line_weight(product: Dict) -> float:
+    quantity = to_float(product.get("quantity"))
+    return quantity if quantity > 0 else 1.0
+
+
+def normalize_order(order: Any, merchant_id: int, meta: Dict) -> Optional[Dict]:
+    """Map one raw export order to a transaction row, or None to skip it."""
+    if not isinstance(order, dict):
+        return None
+    price = order.get("price")
+    if isinstance(price, dict):
+        amount = to_float(price.get("total") or price.get("sub_total"))
+    else:
+        amount = to_float(order.get("amount"))
+    if amount <= 0:
+        return None
+    products = order.get("products") or order.get("line_items") or []
+    lines = [
+        (p["name"].strip(), _line_weight(p))
+        for p in products
+        if isinstance(p, dict) and isinstance(p.get("name"), str) and p["name"].strip()
+    ]
+    product_names = [name for name, _ in lines]
+    essential_share = essentials.essential_share(lines, fallback=meta["description"])
+    description = ", ".join(product_names[:2]) or meta["description"]
+    if len(product_names) > 2:
+        description += "…"
+    posted_at = (
+        order.get("dateTime")
+        or order.get("datetime")
+        or order.get("posted_at")
+        or order.get("timestamp")
+        or datetime.utcnow().isoformat()
+    )
+    status = (
+        order.get("orderStatus")
+        or order.get("order_status")
+        or order.get("category")
+        or "order"
+    )
+    record_id = order.get("externalId") or order.get("external_id") or order.get("id")
+    if not record_id:
+        # Stable fallback so re-syncing the same export upserts, not duplicates.
+        digest = hashlib.sha1(json.dumps(order, sort_keys=True, default=str).encode()).hexdigest()
+        record_id = digest[:16]
+    return {
+        "id": f"{meta['slug']}_{record_id}",
+        "merchant": meta["merchant_name"],
+        "merchant_id": merchant_id,
+        "amount": round(amount, 2),
+        "category": str(status).lower(),
+        "description": description,
+        "is_essential": essential_share > 0,
+        "essential_amount": round(amount * essential_share, 2),
+        "posted_at": posted_at,
+    }
+
+
+def iter_transactions(path: Path, merchant_id: int, meta: Dict) -> Iterator[Dict]:
+    with path.open(encoding="utf-8") as fp:
+        for order in iter_orders(fp):
+            transaction = normalize_order(order, merchant_id, meta)
+            if transaction is not None:
+                yield transaction
+
+
+def ingest_export(
+    user_id: str,
+    merchant_id: int,
+    meta: Dict,
+    path: Path,
+    batch_size: int = BATCH_SIZE,
+    sample_size: int = 5,
+) -> Dict[str, Any]:
+    """Stream ``path`` into ``knot_transactions`` for one user and merchant.
+
+    Returns the refreshed merchant summary, how many orders were read and
+    written, and the first few transactions as a sample.
+    """
+    synced_at = datetime.utcnow().isoformat()
+    transactions = iter_transactions(path, merchant_id, meta)
+    sample: List[Dict] = []
+    read = written = 0
+    while True:
+        batch = list(itertools.islice(transactions, batch_size))
+        if not batch:
+            break
+        if len(sample) < sample_size:
+            sample.extend(batch[: sample_size - len(sample)])
+        read += len(batch)
+        with database.transaction() as tx:
+            written += knot_store.upsert_transactions(tx, user_id, batch, synced_at)
+    with database.transaction() as tx:
+        merchant = knot_store.refresh_merchant(tx, user_id, merchant_id, meta["merchant_name"], synced_at)
+        dashboards.refresh(tx, [user_id])
+    return {"merchant": merchant, "read": read, "written": written, "sample": sample}
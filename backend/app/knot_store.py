@@ -0,0 +1,219 @@
+"""Normalized storage for linked Knot merchant data.
+
+Transactions live one row per order in ``knot_transactions`` keyed by
+(user_id, merchant_id, external_id), so a merchant sync upserts only what
+changed instead of rewriting the whole history. ``knot_merchants`` keeps a
+per-merchant rollup (order count, total spend) maintained on every sync, so
+summaries never scan transactions. ``knot_profiles.updated_at`` remains the
+per-user sync stamp used to key cached risk results.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional
+
+from . import database
+
+_TRANSACTION_COLUMNS = (
+    "merchant_id, external_id, merchant, amount, category, description, is_essential, "
+    "essential_amount, posted_at"
+)
+
+
+def upsert_transactions(
+    tx: database.Transaction,
+    user_id: str,
+    transactions: Iterable[Dict],
+    synced_at: str,
+) -> int:
+    """Insert new orders and update changed ones; returns rows written.
+
+    Rows whose content is unchanged are left untouched, so re-syncing the
+    same export costs a primary-key probe per order and no page writes.
+    """
+    cursor = tx.executemany(
+        f"""
+        INSERT INTO knot_transactions (user_id, {_TRANSACTION_COLUMNS}, synced_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, merchant_id, external_id) DO UPDATE SET
+            merchant = excluded.merchant,
+            amount = excluded.amount,
+            category = excluded.category,
+            description = excluded.description,
+            is_essential = excluded.is_essential,
+            essential_amount = excluded.essential_amount,
+            posted_at = excluded.posted_at,
+            synced_at = excluded.synced_at
+        WHERE amount IS NOT excluded.amount
+           OR category IS NOT excluded.category
+           OR description IS NOT excluded.description
+           OR is_essential IS NOT excluded.is_essential
+           OR essential_amount IS NOT excluded.essential_amount
+        """,
+        (
+            (
+                user_id,
+                txn["merchant_id"],
+                txn["id"],
+                txn["merchant"],
+                txn["amount"],
+                txn.get("category"),
+                txn.get("description"),
+                txn.get("is_essential"),
+                txn.get("essential_amount"),
+                txn["posted_at"],
+                synced_at,
+            )
+            for txn in transactions
+        ),
+    )
+    return max(cursor.rowcount, 0)
+
+
+def refresh_merchant(
+    tx: database.Transaction,
+    user_id: str,
+    merchant_id: int,
+    merchant_name: str,
+    synced_at: str,
+) -> Dict:
+    """Recompute one merchant's rollup from its transactions and stamp the sync."""
+    totals = tx.fetchone(
+        """
+        SELECT
+            COUNT(*) AS orders,
+            COALESCE(SUM(amount), 0) AS total,
+            COALESCE(SUM(essential_amount), 0) AS essential
+        FROM knot_transactions
+        WHERE user_id = ? AND merchant_id = ?
+        """,
+        (user_id, merchant_id),
+    )
+    orders, total = totals["orders"], round(totals["total"], 2)
+    essential = round(totals["essential"], 2)
+    tx.execute(
+        """
+        INSERT INTO knot_merchants (
+            user_id, merchant_id, merchant_name, orders, total_spend, essential_spend, last_sync
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, merchant_id) DO UPDATE SET
+            merchant_name = excluded.merchant_name,
+            orders = excluded.orders,
+            total_spend = excluded.total_spend,
+            essential_spend = excluded.essential_spend,
+            last_sync = excluded.last_sync
+        """,
+        (user_id, merchant_id, merchant_name, orders, total, essential, synced_at),
+    )
+    tx.execute(
+        """
+        INSERT INTO knot_profiles (user_id, merchants_json, transactions_json, updated_at)
+        VALUES (?, '[]', '[]', ?)
+        ON CONFLICT(user_id) DO UPDATE SET updated_at = excluded.updated_at
+        """,
+        (user_id, synced_at),
+    )
+    return _merchant_summary(
+        {
+            "merchant_id": merchant_id,
+            "merchant_name": merchant_name,
+            "orders": orders,
+            "total_spend": total,
+            "essential_spend": essential,
+            "last_sync": synced_at,
+        }
+    )
+
+
+def _essentials_ratio(essential: float, total: float) -> Optional[float]:
+    return round(min(1.0, essential / total), 4) if total > 0 else None
+
+
+def _merchant_summary(row) -> Dict:
+    total = row["total_spend"]
+    return {
+        "merchant_id": row["merchant_id"],
+        "merchant_name": row["merchant_name"],
+        "avg_monthly_spend": round(total / 3, 2) if total else 0,
+        "orders": row["orders"],
+        "essentials_ratio": _essentials_ratio(row["essential_spend"], total),
+        "last_sync": row["last_sync"],
+    }
+
+
+def merchants(user_id: str) -> List[Dict]:
+    rows = database.fetchall(
+        """
+        SELECT merchant_id, merchant_name, orders, total_spend, essential_spend, last_sync
+        FROM knot_merchants
+        WHERE user_id = ?
+        ORDER BY last_sync
+        """,
+        (user_id,),
+    )
+    return [_merchant_summary(row) for row in rows]
+
+
+def recent_transactions(
+    user_id: str,
+    limit: int = 50,
+    merchant_id: Optional[int] = None,
+) -> List[Dict]:
+    """Newest transactions first, read straight off the (user, posted_at) index."""
+    query = f"""
+        SELECT {_TRANSACTION_COLUMNS}
+        FROM knot_transactions
+        WHERE user_id = ?
+    """
+    params: List = [user_id]
+    if merchant_id is not None:
+        query += " AND merchant_id = ?"
+        params.append(merchant_id)
+    query += " ORDER BY posted_at DESC LIMIT ?"
+    params.append(limit)
+    rows = database.fetchall(query, params)
+    return [
+        {
+            "id": row["external_id"],
+            "merchant": row["merchant"],
+            "merchant_id": row["merchant_id"],
+            "amount": row["amount"],
+            "category": row["category"],
+            "description": row["description"],
+            "is_essential": None if row["is_essential"] is None else bool(row["is_essential"]),
+            "essential_amount": row["essential_amount"],
+            "posted_at": row["posted_at"],
+        }
+        for row in rows
+    ]
+
+
+def last_sync(user_id: str) -> Optional[str]:
+    row = database.fetchone("SELECT updated_at FROM knot_profiles WHERE user_id = ?", (user_id,))
+    return row["updated_at"] if row else None
+
+
+def summary(user_id: str) -> Optional[Dict]:
+    """Spend rollup across linked merchants, or None when nothing is linked."""
+    rows = database.fetchall(
+        """
+        SELECT merchant_name, orders, total_spend, essential_spend
+        FROM knot_merchants
+        WHERE user_id = ?
+        ORDER BY last_sync
+        """,
+        (user_id,),
+    )
+    total = sum(row["total_spend"] for row in rows)
+    orders = sum(row["orders"] for row in rows)
+    essential = sum(row["essential_spend"] for row in rows)
+    if not orders or total <= 0:
+        return None
+    return {
+        "merchants": [row["merchant_name"] for row in rows],
+        "avg_monthly_spend": round(total / 3, 2),
+        "orders": orders,
+        "essentials_ratio": _essentials_ratio(essential, total),
+        "last_sync": last_sync(user_id),
+    }
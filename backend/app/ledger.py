@@ -0,0 +1,315 @@
+"""Lender capital ledger.
+
+``lender_balances`` holds each lender's available, reserved and committed
+capital. Capital moves through reservations:
+
+* ``reserve`` takes capital out of ``available`` with a conditional
+  decrement (``WHERE available >= ?``), so concurrent requests can never
+  over-allocate a lender - the loser simply sees zero rows updated;
+* ``commit`` turns a held reservation into committed capital for a match;
+* ``release`` returns a held reservation to ``available``.
+
+Holds abandoned by a crashed or failed request are returned by a sweep that
+the app runs every ``LEDGER_SWEEP_INTERVAL_SECONDS``, once they are older
+than ``LEDGER_RESERVATION_TTL_SECONDS``.
+
+Every movement is appended to ``capital_ledger``. Transactions are kept to a
+handful of indexed single-row updates so the write lock is held briefly.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import string
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import dashboards, database
+
+logger = logging.getLogger(__name__)
+
+LEDGER_RESERVATION_TTL_SECONDS = int(os.getenv("LEDGER_RESERVATION_TTL_SECONDS", "300"))
+LEDGER_SWEEP_INTERVAL_SECONDS = float(os.getenv("LEDGER_SWEEP_INTERVAL_SECONDS", "60"))
+
+_task: Optional[asyncio.Task] = None
+
+
+class CapitalUnavailable(Exception):
+    """A lender no longer has the capital a reservation asked for."""
+
+    def __init__(self, lender_id: str, amount: float) -> None:
+        super().__init__(f"Lender {lender_id} cannot cover {amount:.2f}")
+        self.lender_id = lender_id
+        self.amount = amount
+
+
+class ReservationExpired(Exception):
+    """The reservation was released (e.g. by the expiry sweep) before it was committed."""
+
+
+def _reservation_id() -> str:
+    return f"rsv_{''.join(random.choices(string.ascii_lowercase + string.digits, k=10))}"
+
+
+def open_balance(lender_id: str, capital: float) -> None:
+    now = datetime.utcnow().isoformat()
+    database.execute(
+        """
+        INSERT INTO lender_balances (lender_id, total, available, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(lender_id) DO NOTHING
+        """,
+        (lender_id, capital, max(capital, 0), now),
+    )
+
+
+def _ledger_rows(
+    legs: Iterable[Tuple[str, float]],
+    entry_type: str,
+    reservation_id: Optional[str],
+    match_id: Optional[str],
+    now: str,
+) -> List[Tuple]:
+    return [
+        (lender_id, reservation_id, match_id, entry_type, amount, now)
+        for lender_id, amount in legs
+    ]
+
+
+def _record(tx: database.Transaction, rows: List[Tuple]) -> None:
+    tx.executemany(
+        """
+        INSERT INTO capital_ledger (lender_id, reservation_id, match_id, entry_type, amount, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+
+
+def _merge_legs(legs: Sequence[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    merged: Dict[str, float] = {}
+    for lender_id, amount in legs:
+        merged[lender_id] = round(merged.get(lender_id, 0.0) + amount, 2)
+    return list(merged.items())
+
+
+def _available(tx: database.Transaction, lender_ids: Iterable[str]) -> Dict[str, float]:
+    balances: Dict[str, float] = {}
+    for lender_id in lender_ids:
+        row = tx.fetchone(
+            "SELECT available FROM lender_balances WHERE lender_id = ?",
+            (lender_id,),
+        )
+        if row:
+            balances[lender_id] = float(row["available"])
+    return balances
+
+
+def reserve(
+    legs: Sequence[Tuple[str, float]],
+    borrower_id: Optional[str] = None,
+) -> Tuple[str, Dict[str, float]]:
+    """Atomically hold capital from several lenders.
+
+    Either every leg is reserved or none is: a leg that fails its
+    conditional decrement raises ``CapitalUnavailable`` and rolls the whole
+    reservation back. Returns the reservation id and the lenders' new
+    available balances.
+    """
+    reservation_id = _reservation_id()
+    now = datetime.utcnow().isoformat()
+    merged = _merge_legs(legs)
+    with database.transaction() as tx:
+        for lender_id, amount in merged:
+            cursor = tx.execute(
+                """
+                UPDATE lender_balances
+                SET available = round(available - ?, 2),
+                    reserved = round(reserved + ?, 2),
+                    updated_at = ?
+                WHERE lender_id = ? AND available >= ?
+                """,
+                (amount, amount, now, lender_id, amount),
+            )
+            if cursor.rowcount != 1:
+                raise CapitalUnavailable(lender_id, amount)
+        tx.executemany(
+            """
+            INSERT INTO capital_reservations (
+                reservation_id, lender_id, borrower_id, amount, status, created_at, updated_at
+            )
+            VALUES (?, ?, ?, ?, 'held', ?, ?)
+            """,
+            [(reservation_id, lender_id, borrower_id, amount, now, now) for lender_id, amount in merged],
+        )
+        _record(tx, _ledger_rows(merged, "reserve", reservation_id, None, now))
+        balances = _available(tx, [lender_id for lender_id, _ in merged])
+    return reservation_id, balances
+
+
+def _held_legs(tx: database.Transaction, reservation_id: str) -> List[Tuple[str, float]]:
+    rows = tx.fetchall(
+        """
+        SELECT lender_id, amount
+        FROM capital_reservations
+        WHERE reservation_id = ? AND status = 'held'
+        """,
+        (reservation_id,),
+    )
+    return [(row["lender_id"], float(row["amount"])) for row in rows]
+
+
+def commit(reservation_id: str, match_id: str) -> None:
+    """Convert a held reservation into committed capital for ``match_id``."""
+    now = datetime.utcnow().isoformat()
+    with database.transaction() as tx:
+        legs = _held_legs(tx, reservation_id)
+        if not legs:
+            raise ReservationExpired(reservation_id)
+        tx.executemany(
+            """
+            UPDATE lender_balances
+            SET reserved = round(reserved - ?, 2),
+                committed = round(committed + ?, 2),
+                updated_at = ?
+            WHERE lender_id = ?
+            """,
+            [(amount, amount, now, lender_id) for lender_id, amount in legs],
+        )
+        tx.execute(
+            """
+            UPDATE capital_reservations
+            SET status = 'committed', match_id = ?, updated_at = ?
+            WHERE reservation_id = ? AND status = 'held'
+            """,
+            (match_id, now, reservation_id),
+        )
+        _record(tx, _ledger_rows(legs, "commit", reservation_id, match_id, now))
+
+
+def release(reservation_id: str) -> Dict[str, float]:
+    """Return a held reservation to the lenders' available capital."""
+    now = datetime.utcnow().isoformat()
+    with database.transaction() as tx:
+        legs = _held_legs(tx, reservation_id)
+        tx.executemany(
+            """
+            UPDATE lender_balances
+            SET available = round(available + ?, 2),
+                reserved = round(reserved - ?, 2),
+                updated_at = ?
+            WHERE lender_id = ?
+            """,
+            [(amount, amount, now, lender_id) for lender_id, amount in legs],
+        )
+        tx.execute(
+            """
+            UPDATE capital_reservations
+            SET status = 'released', updated_at = ?
+            WHERE reservation_id = ? AND status = 'held'
+            """,
+            (now, reservation_id),
+        )
+        _record(tx, _ledger_rows(legs, "release", reservation_id, None, now))
+        lender_ids = [lender_id for lender_id, _ in legs]
+        # Their materialized summaries show available capital.
+        dashboards.refresh(tx, lender_ids)
+        return _available(tx, lender_ids)
+
+
+def release_expired(max_age: timedelta = timedelta(seconds=LEDGER_RESERVATION_TTL_SECONDS)) -> Dict[str, float]:
+    """Release reservations held longer than ``max_age`` (e.g. after a crash)."""
+    cutoff = (datetime.utcnow() - max_age).isoformat()
+    rows = database.fetchall(
+        """
+        SELECT DISTINCT reservation_id
+        FROM capital_reservations
+        WHERE status = 'held' AND created_at < ?
+        """,
+        (cutoff,),
+    )
+    balances: Dict[str, float] = {}
+    for row in rows:
+        balances.update(release(row["reservation_id"]))
+    return balances
+
+
+async def _sweep_forever(on_release: Callable[[Dict[str, float]], None]) -> None:
+    while True:
+        await asyncio.sleep(LEDGER_SWEEP_INTERVAL_SECONDS)
+        try:
+            balances = await asyncio.to_thread(release_expired)
+        except Exception:  # noqa: BLE001 - retry on the next tick
+            logger.exception("Releasing expired reservations failed")
+            continue
+        if balances:
+            logger.info("Released expired holds for %s lender(s).", len(balances))
+            on_release(balances)
+
+
+async def start(on_release: Callable[[Dict[str, float]], None]) -> None:
+    """Sweep expired holds periodically; ``on_release`` gets the lenders' new available capital."""
+    global _task
+    if _task is not None:
+        return
+    _task = asyncio.create_task(_sweep_forever(on_release), name="ledger-sweep")
+
+
+async def stop() -> None:
+    global _task
+    task, _task = _task, None
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def commit_direct(
+    tx: database.Transaction,
+    legs: Sequence[Tuple[str, float]],
+    entries: Sequence[Tuple[str, str, float]],
+) -> None:
+    """Commit capital inside an existing transaction without a hold step.
+
+    Used by batch clearing, which already owns the write lock. ``legs`` are
+    per-lender totals to take from ``available``; ``entries`` are
+    ``(lender_id, match_id, amount)`` rows for the ledger.
+    """
+    now = datetime.utcnow().isoformat()
+    for lender_id, amount in _merge_legs(legs):
+        cursor = tx.execute(
+            """
+            UPDATE lender_balances
+            SET available = round(available - ?, 2),
+                committed = round(committed + ?, 2),
+                updated_at = ?
+            WHERE lender_id = ? AND available >= ?
+            """,
+            (amount, amount, now, lender_id, amount),
+        )
+        if cursor.rowcount != 1:
+            raise CapitalUnavailable(lender_id, amount)
+    _record(
+        tx,
+        [
+            (lender_id, None, match_id, "commit", amount, now)
+            for lender_id, match_id, amount in entries
+        ],
+    )
+
+
+def available_balances(lender_ids: Sequence[str]) -> Dict[str, float]:
+    balances: Dict[str, float] = {}
+    # Stay well under SQLite's bound-parameter limit.
+    for start in range(0, len(lender_ids), 500):
+        chunk = lender_ids[start : start + 500]
+        placeholders = ", ".join("?" for _ in chunk)
+        rows = database.fetchall(
+            f"SELECT lender_id, available FROM lender_balances WHERE lender_id IN ({placeholders})",
+            chunk,
+        )
+        balances.update({row["lender_id"]: float(row["available"]) for row in rows})
+    return balances
@@ -0,0 +1,360 @@
+"""In-memory lender order books, one per community.
+
+Lenders are kept sorted by (rate ASC, capital DESC) so matching can walk the
+cheapest offers first without querying SQLite. The books are rebuilt from the
+users table at startup and updated incrementally whenever a lender is created
+or re-verified.
+
+Lenders with a known position are also filed in a grid-cell spatial index,
+so "lenders within N km" can be answered without the community buckets.
+"""
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .geo_index import GridIndex, chord_km
+
+BookKey = Tuple[Optional[str], bool]
+SortKey = Tuple[float, float, str]
+Position = Optional[Tuple[float, float]]
+
+
+def _capital_key(entry: Dict) -> SortKey:
+    return (-entry["capital"], entry["rate"], entry["id"])
+
+
+def _position(lat: Optional[float], lng: Optional[float]) -> Position:
+    if lat is None or lng is None:
+        return None
+    return (float(lat), float(lng))
+
+
+class _Book:
+    __slots__ = ("keys", "entries", "capital_keys", "capital_entries", "total_capital")
+
+    def __init__(self) -> None:
+        self.keys: List[SortKey] = []
+        self.entries: List[Dict] = []
+        # Secondary index by capital DESC for "fewest lenders" matching.
+        self.capital_keys: List[SortKey] = []
+        self.capital_entries: List[Dict] = []
+        self.total_capital = 0.0
+
+    def insert(self, key: SortKey, entry: Dict) -> None:
+        index = bisect.bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self.entries.insert(index, entry)
+        capital_key = _capital_key(entry)
+        index = bisect.bisect_left(self.capital_keys, capital_key)
+        self.capital_keys.insert(index, capital_key)
+        self.capital_entries.insert(index, entry)
+        self.total_capital += entry["capital"]
+
+    def remove(self, key: SortKey) -> None:
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+            entry = self.entries.pop(index)
+            capital_key = _capital_key(entry)
+            index = bisect.bisect_left(self.capital_keys, capital_key)
+            if index < len(self.capital_keys) and self.capital_keys[index] == capital_key:
+                del self.capital_keys[index]
+                del self.capital_entries[index]
+            self.total_capital -= entry["capital"]
+
+
+class LenderOrderBook:
+    """Sorted lender offers keyed by community and location lock.
+
+    Each lender is filed under up to four books: its community, its community
+    restricted to location-locked lenders, and the same two views across all
+    communities (``community_id=None``), mirroring the filters that
+    ``_fetch_lenders`` used to apply in SQL.
+    """
+
+    def __init__(self, geo_cell_km: float = 5.0) -> None:
+        self._lock = threading.RLock()
+        self._books: Dict[BookKey, _Book] = {}
+        self._lenders: Dict[str, Tuple[SortKey, Optional[str], bool, Dict, Position]] = {}
+        self._geo_cell_km = geo_cell_km
+        self._geo = GridIndex(geo_cell_km)
+
+    @staticmethod
+    def _sort_key(entry: Dict) -> SortKey:
+        return (entry["rate"], -entry["capital"], entry["id"])
+
+    @staticmethod
+    def _book_keys(community_id: Optional[str], locked: bool) -> List[BookKey]:
+        keys: List[BookKey] = [(None, False), (community_id, False)]
+        if locked:
+            keys.extend([(None, True), (community_id, True)])
+        return keys
+
+    def _book(self, key: BookKey) -> _Book:
+        book = self._books.get(key)
+        if book is None:
+            book = self._books[key] = _Book()
+        return book
+
+    def _remove_locked(self, user_id: str) -> None:
+        existing = self._lenders.pop(user_id, None)
+        if not existing:
+            return
+        self._geo.remove(user_id)
+        sort_key, community_id, locked, _, _ = existing
+        for book_key in set(self._book_keys(community_id, locked)):
+            book = self._books.get(book_key)
+            if book is not None:
+                book.remove(sort_key)
+
+    def upsert(
+        self,
+        user_id: str,
+        capital: float,
+        rate: float,
+        community_id: Optional[str],
+        location_locked: bool,
+        lat: Optional[float] = None,
+        lng: Optional[float] = None,
+    ) -> None:
+        with self._lock:
+            self._remove_locked(user_id)
+            if not capital or capital <= 0:
+                return
+            entry = {"id": user_id, "capital": float(capital), "rate": float(rate)}
+            sort_key = self._sort_key(entry)
+            locked = bool(location_locked)
+            for book_key in set(self._book_keys(community_id, locked)):
+                self._book(book_key).insert(sort_key, entry)
+            position = _position(lat, lng)
+            if position is not None:
+                self._geo.insert(user_id, position[0], position[1], (locked, entry), order=sort_key)
+            self._lenders[user_id] = (sort_key, community_id, locked, entry, position)
+
+    def set_capital(self, user_id: str, capital: float) -> None:
+        """Re-file a known lender with new available capital."""
+        with self._lock:
+            existing = self._lenders.get(user_id)
+            if not existing:
+                return
+            _, community_id, locked, entry, position = existing
+            lat, lng = position if position is not None else (None, None)
+            self.upsert(user_id, capital, entry["rate"], community_id, locked, lat, lng)
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            self._remove_locked(user_id)
+
+    def rebuild(self, rows: Iterable) -> int:
+        """Replace every book with the given lender rows; returns the count."""
+        staged: Dict[BookKey, List[Tuple[SortKey, Dict]]] = {}
+        lenders: Dict[str, Tuple[SortKey, Optional[str], bool, Dict, Position]] = {}
+        points: List[Tuple[str, float, float, Tuple[bool, Dict], SortKey]] = []
+        for row in rows:
+            capital = row["max_amount"]
+            if not capital or capital <= 0:
+                continue
+            entry = {"id": row["id"], "capital": float(capital), "rate": float(row["min_rate"])}
+            sort_key = self._sort_key(entry)
+            community_id = row["community_id"]
+            locked = bool(row["location_locked"])
+            for book_key in set(self._book_keys(community_id, locked)):
+                staged.setdefault(book_key, []).append((sort_key, entry))
+            position = _position(row["lat"], row["lng"])
+            if position is not None:
+                points.append((row["id"], position[0], position[1], (locked, entry), sort_key))
+            lenders[row["id"]] = (sort_key, community_id, locked, entry, position)
+
+        books: Dict[BookKey, _Book] = {}
+        for book_key, items in staged.items():
+            items.sort(key=lambda item: item[0])
+            book = books[book_key] = _Book()
+            book.keys = [item[0] for item in items]
+            book.entries = [item[1] for item in items]
+            by_capital = sorted(book.entries, key=_capital_key)
+            book.capital_keys = [_capital_key(entry) for entry in by_capital]
+            book.capital_entries = by_capital
+            book.total_capital = sum(entry["capital"] for entry in book.entries)
+        geo = GridIndex(self._geo_cell_km)
+        geo.load(points)
+        with self._lock:
+            self._books = books
+            self._lenders = lenders
+            self._geo = geo
+        return len(lenders)
+
+    def lenders(
+        self,
+        community_id: Optional[str] = None,
+        require_lock: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        with self._lock:
+            book = self._books.get((community_id, bool(require_lock)))
+            if book is None:
+                return []
+            entries = book.entries if limit is None else book.entries[:limit]
+            return [dict(entry) for entry in entries]
+
+    def covering(
+        self,
+        amount: float,
+        community_id: Optional[str] = None,
+        require_lock: bool = False,
+    ) -> List[Dict]:
+        """Cheapest prefix of the book whose capital covers ``amount``.
+
+        Cost is proportional to the prefix, not the size of the community.
+        """
+        with self._lock:
+            book = self._books.get((community_id, bool(require_lock)))
+            if book is None:
+                return []
+            selected: List[Dict] = []
+            covered = 0.0
+            for entry in book.entries:
+                selected.append(dict(entry))
+                covered += entry["capital"]
+                if covered >= amount:
+                    break
+            return selected
+
+    def candidates(
+        self,
+        community_id: Optional[str] = None,
+        require_lock: bool = False,
+        cheapest: int = 200,
+        largest: int = 50,
+    ) -> List[Dict]:
+        """Bounded candidate pool: the cheapest offers plus the deepest pockets.
+
+        Returned in rate order; used by the combination engine so its search
+        space stays fixed no matter how many lenders a community has.
+        """
+        with self._lock:
+            book = self._books.get((community_id, bool(require_lock)))
+            if book is None:
+                return []
+            picked: Dict[str, Dict] = {}
+            for entry in book.entries[:cheapest]:
+                picked[entry["id"]] = entry
+            for entry in book.capital_entries[:largest]:
+                picked.setdefault(entry["id"], entry)
+            ordered = sorted(picked.values(), key=self._sort_key)
+            return [dict(entry) for entry in ordered]
+
+    def total_capital(
+        self,
+        community_id: Optional[str] = None,
+        require_lock: bool = False,
+    ) -> float:
+        with self._lock:
+            book = self._books.get((community_id, bool(require_lock)))
+            return book.total_capital if book else 0.0
+
+    def size(
+        self,
+        community_id: Optional[str] = None,
+        require_lock: bool = False,
+    ) -> int:
+        with self._lock:
+            book = self._books.get((community_id, bool(require_lock)))
+            return len(book.entries) if book else 0
+
+    def _nearby_ordered(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float,
+        require_lock: bool,
+    ) -> Iterator[Tuple[float, Dict]]:
+        """``(chord, entry)`` within ``radius_km``, lazily in book order; hold the lock."""
+        for _, chord, _, (locked, entry) in self._geo.ordered_within(lat, lng, radius_km):
+            if locked or not require_lock:
+                yield chord, entry
+
+    def _nearby_unordered(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float,
+        require_lock: bool,
+    ) -> List[Tuple[SortKey, float, Dict]]:
+        return [
+            (sort_key, chord, entry)
+            for chord, sort_key, _, (locked, entry) in self._geo.within(lat, lng, radius_km)
+            if locked or not require_lock
+        ]
+
+    @staticmethod
+    def _with_distance(entry: Dict, chord: float) -> Dict:
+        return {**entry, "distance_km": round(chord_km(chord), 3)}
+
+    def nearby(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float,
+        require_lock: bool = False,
+        amount: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        """Lenders within ``radius_km`` of a point, in book order.
+
+        With ``amount`` only the cheapest prefix covering it is returned, as
+        in ``covering``; the cells are merged lazily, so cost follows the
+        prefix rather than the number of lenders in range. Each lender
+        carries its ``distance_km``.
+        """
+        with self._lock:
+            if amount is None and limit is None:
+                hits = self._nearby_unordered(lat, lng, radius_km, require_lock)
+                hits.sort(key=lambda hit: hit[0])
+                return [self._with_distance(entry, chord) for _, chord, entry in hits]
+            selected: List[Dict] = []
+            covered = 0.0
+            for chord, entry in self._nearby_ordered(lat, lng, radius_km, require_lock):
+                if limit is not None and len(selected) >= limit:
+                    break
+                selected.append(self._with_distance(entry, chord))
+                covered += entry["capital"]
+                if amount is not None and covered >= amount:
+                    break
+            return selected
+
+    def nearby_candidates(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float,
+        require_lock: bool = False,
+        cheapest: int = 200,
+        largest: int = 50,
+    ) -> List[Dict]:
+        """``candidates`` for the lenders within ``radius_km`` of a point."""
+        with self._lock:
+            hits = self._nearby_unordered(lat, lng, radius_km, require_lock)
+        picked = {hit[2]["id"]: hit for hit in heapq.nsmallest(cheapest, hits, key=lambda hit: hit[0])}
+        for hit in heapq.nsmallest(largest, hits, key=lambda hit: _capital_key(hit[2])):
+            picked.setdefault(hit[2]["id"], hit)
+        ordered = sorted(picked.values(), key=lambda hit: hit[0])
+        return [self._with_distance(entry, chord) for _, chord, entry in ordered]
+
+    def nearby_capital(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float,
+        require_lock: bool = False,
+    ) -> float:
+        with self._lock:
+            hits = self._nearby_unordered(lat, lng, radius_km, require_lock)
+        return sum(entry["capital"] for _, _, entry in hits)
+
+    def geo_stats(self) -> Dict:
+        with self._lock:
+            return self._geo.stats()
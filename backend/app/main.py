@@ -11,6 +11,7 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+import copy
 import json
 import logging
 import os
@@ -18,19 +19,39 @@ import random
 import re
 import string
 import math
-from datetime import datetime, timedelta
-from functools import lru_cache
+from contextlib import asynccontextmanager
+from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import httpx
-import requests
-from fastapi import FastAPI, HTTPException, File, Form, UploadFile
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from oauthlib.oauth1 import Client as OAuth1Client
 from pydantic import BaseModel, Field
-from requests_oauthlib import OAuth1
 
-from . import database
+from . import (
+    dashboards,
+    database,
+    http_clients,
+    id_retention,
+    id_storage,
+    jobs,
+    knot_ingest,
+    knot_store,
+    ledger,
+    metrics,
+    payments,
+    portfolio,
+    repricing,
+    schedules,
+    settlement,
+)
+from .cache import SWRCache, TTLCache
+from .lender_book import LenderOrderBook
+from .matching import best_combinations, clear_batch
 
 # Load optional env keys for future integrations.
 KNOT_API_KEY = os.getenv("KNOT_API_KEY")
@@ -64,6 +85,23 @@ FINANCE_BOT_PROMPT = os.getenv(
 )
 BANK_AVG_RATE = float(os.getenv("BANK_AVG_RATE", "9.5"))
 COMMUNITY_PRECISION_DEGREES = float(os.getenv("COMMUNITY_PRECISION_DEGREES", "0.05"))
+# "community" matches on exact community_id; "radius" matches lenders within LENDER_RADIUS_KM.
+LENDER_MATCH_MODE = os.getenv("LENDER_MATCH_MODE", "community").lower()
+LENDER_RADIUS_KM = float(os.getenv("LENDER_RADIUS_KM", "10"))
+LENDER_MAX_RADIUS_KM = float(os.getenv("LENDER_MAX_RADIUS_KM", "250"))
+LENDER_GEO_CELL_KM = float(os.getenv("LENDER_GEO_CELL_KM", "5"))
+LOAN_RESERVE_ATTEMPTS = int(os.getenv("LOAN_RESERVE_ATTEMPTS", "5"))
+RISK_RULES_VERSION = "rules-v1"
+RISK_CACHE_TTL_SECONDS = float(os.getenv("RISK_CACHE_TTL_SECONDS", "900"))
+RISK_CACHE_MAX_ENTRIES = int(os.getenv("RISK_CACHE_MAX_ENTRIES", "10000"))
+X_FEED_CACHE_TTL_SECONDS = float(os.getenv("X_FEED_CACHE_TTL_SECONDS", "60"))
+X_FEED_CACHE_STALE_SECONDS = float(os.getenv("X_FEED_CACHE_STALE_SECONDS", "600"))
+X_USER_CACHE_TTL_SECONDS = float(os.getenv("X_USER_CACHE_TTL_SECONDS", str(6 * 3600)))
+X_CACHE_MAX_ENTRIES = int(os.getenv("X_CACHE_MAX_ENTRIES", "1024"))
+COMBO_TOP_K = int(os.getenv("COMBO_TOP_K", "3"))
+COMBO_TIME_BUDGET_MS = float(os.getenv("COMBO_TIME_BUDGET_MS", "25"))
+COMBO_CANDIDATES_BY_RATE = int(os.getenv("COMBO_CANDIDATES_BY_RATE", "200"))
+COMBO_CANDIDATES_BY_CAPITAL = int(os.getenv("COMBO_CANDIDATES_BY_CAPITAL", "50"))
 DEFAULT_COMMUNITY_LAT = float(os.getenv("DEFAULT_COMMUNITY_LAT", "40.3573"))
 DEFAULT_COMMUNITY_LNG = float(os.getenv("DEFAULT_COMMUNITY_LNG", "-74.6672"))
 KNOT_DATA_DIR = Path(__file__).resolve().parent / "knot_mock_data"
@@ -81,25 +119,6 @@ KNOT_MERCHANTS = {
         "description": "Food delivery history",
     },
 }
-ESSENTIAL_KEYWORDS = (
-    "grocery",
-    "milk",
-    "baby",
-    "diaper",
-    "produce",
-    "household",
-    "electric",
-    "utility",
-    "medicine",
-    "pharmacy",
-    "tuition",
-    "rent",
-    "gas",
-    "school",
-    "food",
-    "meal",
-    "pantry",
-)
 
 INTEGRATIONS_ENABLED = {
     "knot": bool(KNOT_API_KEY),
@@ -112,36 +131,36 @@ logger = logging.getLogger(__name__)
 
 database.init_db()
 
-_x_user_cache: Dict[str, Tuple[str, datetime]] = {}
-_x_tweet_cache: Dict[str, Tuple[List[Dict], datetime]] = {}
+_lender_book = LenderOrderBook(LENDER_GEO_CELL_KM)
+_risk_cache: TTLCache = TTLCache(RISK_CACHE_MAX_ENTRIES, RISK_CACHE_TTL_SECONDS)
+
+_x_user_cache = SWRCache("x_user", X_CACHE_MAX_ENTRIES, X_USER_CACHE_TTL_SECONDS, X_USER_CACHE_TTL_SECONDS)
+_x_tweet_cache = SWRCache("x_tweets", X_CACHE_MAX_ENTRIES, X_FEED_CACHE_TTL_SECONDS, X_FEED_CACHE_STALE_SECONDS)
 
-ID_UPLOAD_DIR = Path(
-    os.getenv(
-        "ID_UPLOAD_DIR",
-        Path(__file__).resolve().parent / "uploads" / "id_documents",
-    )
-)
-ID_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-ALLOWED_ID_MIME_TYPES = {
-    "image/jpeg",
-    "image/png",
-    "image/heic",
-    "image/heif",
-    "application/pdf",
-}
-ALLOWED_ID_EXTENSIONS = {".jpg", ".jpeg", ".png", ".pdf", ".heic", ".heif"}
-MIME_EXTENSION_MAP = {
-    "image/jpeg": ".jpg",
-    "image/png": ".png",
-    "image/heic": ".heic",
-    "image/heif": ".heif",
-    "application/pdf": ".pdf",
-}
-MAX_ID_UPLOAD_BYTES = int(os.getenv("ID_UPLOAD_MAX_BYTES", 5 * 1024 * 1024))
-ID_UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-app = FastAPI(title="LendLocal AI API")
+@asynccontextmanager
+async def _lifespan(_: FastAPI):
+    # Holds left behind by a crash mid-request go back to their lenders.
+    ledger.release_expired()
+    _load_lender_book()
+    dashboards.backfill()
+    await http_clients.startup()
+    await jobs.start()
+    await ledger.start(_apply_balances)
+    await payments.start()
+    await settlement.start()
+    try:
+        yield
+    finally:
+        await settlement.stop()
+        await payments.stop()
+        await ledger.stop()
+        await jobs.stop()
+        await http_clients.shutdown()
+        database.close_pool()
+
+
+app = FastAPI(title="LendLocal AI API", lifespan=_lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -149,33 +168,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so it is outermost and times CORS handling too.
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 
 def _generate_id(prefix: str) -> str:
     return f"{prefix}_{''.join(random.choices(string.ascii_lowercase + string.digits, k=8))}"
 
 
-def _safe_document_extension(filename: Optional[str], content_type: str) -> str:
-    suffix = Path(filename or "").suffix.lower()
-    if suffix in ALLOWED_ID_EXTENSIONS:
-        return suffix
-    return MIME_EXTENSION_MAP.get(content_type, ".jpg")
-
-
 def _x_headers() -> Dict[str, str]:
     if not X_API_KEY:
         raise HTTPException(status_code=503, detail="X integration disabled")
     return {"Authorization": f"Bearer {X_API_KEY}"}
 
 
-def _get_x_user_id(handle: str) -> str:
-    key = handle.lower()
-    cached = _x_user_cache.get(key)
-    if cached and cached[1] > datetime.utcnow() - timedelta(hours=6):
-        return cached[0]
+async def _get_x_user_id(handle: str) -> str:
+    return await _x_user_cache.get_or_load(handle.lower(), lambda: _load_x_user_id(handle))
+
+
+async def _load_x_user_id(handle: str) -> str:
     url = f"https://api.x.com/2/users/by/username/{handle}"
     try:
-        resp = httpx.get(url, headers=_x_headers(), timeout=10)
+        resp = await http_clients.request("x", "GET", url, headers=_x_headers())
         resp.raise_for_status()
     except httpx.HTTPError as exc:
         raise HTTPException(status_code=502, detail=f"Failed to reach X API: {exc}") from exc
@@ -183,18 +197,19 @@ def _get_x_user_id(handle: str) -> str:
     user_id = data.get("data", {}).get("id")
     if not user_id:
         raise HTTPException(status_code=404, detail="X user not found")
-    _x_user_cache[key] = (user_id, datetime.utcnow())
     return user_id
 
 
-def _get_x_tweets(handle: str, limit: int) -> List[Dict]:
+async def _get_x_tweets(handle: str, limit: int) -> List[Dict]:
     limit = max(1, min(limit, 20))
-    cache_key = f"{handle.lower()}:{limit}"
-    cached = _x_tweet_cache.get(cache_key)
-    if cached and cached[1] > datetime.utcnow() - timedelta(minutes=1):
-        return cached[0]
+    return await _x_tweet_cache.get_or_load(
+        f"{handle.lower()}:{limit}",
+        lambda: _load_x_tweets(handle, limit),
+    )
 
-    user_id = _get_x_user_id(handle)
+
+async def _load_x_tweets(handle: str, limit: int) -> List[Dict]:
+    user_id = await _get_x_user_id(handle)
     params = {
         "max_results": str(limit),
         "tweet.fields": "created_at,public_metrics,text",
@@ -202,7 +217,7 @@ def _get_x_tweets(handle: str, limit: int) -> List[Dict]:
     }
     url = f"https://api.x.com/2/users/{user_id}/tweets"
     try:
-        resp = httpx.get(url, headers=_x_headers(), params=params, timeout=10)
+        resp = await http_clients.request("x", "GET", url, headers=_x_headers(), params=params)
         resp.raise_for_status()
     except httpx.HTTPError as exc:
         raise HTTPException(status_code=502, detail=f"Failed to fetch tweets: {exc}") from exc
@@ -221,7 +236,6 @@ def _get_x_tweets(handle: str, limit: int) -> List[Dict]:
                 "quote_count": metrics.get("quote_count"),
             }
         )
-    _x_tweet_cache[cache_key] = (tweets, datetime.utcnow())
     return tweets
 
 
@@ -229,7 +243,7 @@ def _can_post_to_x() -> bool:
     return all([X_CONSUMER_KEY, X_CONSUMER_SECRET, X_ACCESS_TOKEN, X_ACCESS_TOKEN_SECRET])
 
 
-def _share_loan_on_x(user_id: str, amount: float, lenders: List[Dict]) -> Tuple[Optional[str], Optional[str]]:
+async def _share_loan_on_x(user_id: str, amount: float, lenders: List[Dict]) -> Tuple[Optional[str], Optional[str]]:
     if not _can_post_to_x():
         logger.info("X posting disabled; missing OAuth credentials.")
         return None, "disabled"
@@ -242,23 +256,31 @@ def _share_loan_on_x(user_id: str, amount: float, lenders: List[Dict]) -> Tuple[
         f"A neighbor just borrowed ${amount:,.0f} for educational expenses "
         f"from {lender_count} local supporter(s). #BorrowLocal #FairFlow"
     )
-    auth = OAuth1(
+    url = "https://api.x.com/2/tweets"
+    oauth = OAuth1Client(
         X_CONSUMER_KEY,
-        X_CONSUMER_SECRET,
-        X_ACCESS_TOKEN,
-        X_ACCESS_TOKEN_SECRET,
+        client_secret=X_CONSUMER_SECRET,
+        resource_owner_key=X_ACCESS_TOKEN,
+        resource_owner_secret=X_ACCESS_TOKEN_SECRET,
     )
+    # JSON bodies are not part of the OAuth 1.0a signature base string.
+    _, signed_headers, _ = oauth.sign(url, http_method="POST")
     try:
-        resp = requests.post(
-            "https://api.x.com/2/tweets",
+        resp = await http_clients.request(
+            "x",
+            "POST",
+            url,
             json={"text": text},
-            auth=auth,
-            timeout=10,
+            headers=signed_headers,
         )
         resp.raise_for_status()
-    except requests.RequestException as exc:
-        body = getattr(getattr(exc, "response", None), "text", "")
+    except httpx.HTTPError as exc:
+        response = getattr(exc, "response", None)
+        body = getattr(response, "text", "")
         logger.warning("X share failed for %s: %s | body=%s", user_id, exc, (body or "")[:200])
+        # X rejected the post itself (bad credentials, duplicate text, ...); only rate limits clear up.
+        if response is not None and 400 <= response.status_code < 500 and response.status_code != 429:
+            return None, "post_rejected"
         return None, "post_failed"
     data = resp.json().get("data", {})
     tweet_id = data.get("id")
@@ -267,150 +289,26 @@ def _share_loan_on_x(user_id: str, amount: float, lenders: List[Dict]) -> Tuple[
     return tweet_id, None
 
 
-@lru_cache(maxsize=8)
-def _load_knot_orders(merchant_id: int):
-    meta = KNOT_MERCHANTS.get(merchant_id)
-    if not meta:
-        raise KeyError(f"Unknown merchant id {merchant_id}")
-    path = KNOT_DATA_DIR / meta["file"]
-    if not path.exists():
-        raise FileNotFoundError(f"Mock data file missing for merchant {merchant_id}")
-    with path.open() as fp:
-        return json.load(fp)
-
-
-def _extract_knot_entries(payload) -> List[Dict]:
-    if isinstance(payload, list):
-        return payload
-    if isinstance(payload, dict):
-        for key in ("transactions", "orders", "data", "items"):
-            value = payload.get(key)
-            if isinstance(value, list):
-                return value
-        return [payload]
-    return []
-
-
-def _to_float(value) -> float:
-    if value is None:
-        return 0.0
-    if isinstance(value, (int, float)):
-        return float(value)
-    if isinstance(value, str):
-        cleaned = value.replace("$", "").replace(",", "").strip()
-        try:
-            return float(cleaned)
-        except ValueError:
-            return 0.0
-    return 0.0
+X_SHARE_JOB = "x_share"
 
 
-def _is_essential_purchase(text: str) -> bool:
-    if not text:
-        return False
-    lowered = text.lower()
-    return any(keyword in lowered for keyword in ESSENTIAL_KEYWORDS)
-
-
-def _orders_to_transactions(merchant_id: int) -> List[Dict]:
-    meta = KNOT_MERCHANTS[merchant_id]
-    payload = _load_knot_orders(merchant_id)
-    orders = _extract_knot_entries(payload)
-    transactions: List[Dict] = []
-    for order in orders:
-        if not isinstance(order, dict):
-            continue
-        amount = float(order.get("price", {}).get("total") or 0)
-        if "price" in order:
-            amount = _to_float(order["price"].get("total") or order["price"].get("sub_total"))
-        elif order.get("amount"):
-            amount = _to_float(order.get("amount"))
-        if amount <= 0:
-            continue
-        products = order.get("products") or order.get("line_items") or []
-        product_names = [p.get("name", "").strip() for p in products if isinstance(p, dict) and p.get("name")]
-        description = ", ".join(product_names[:2]) or meta["description"]
-        if len(product_names) > 2:
-            description += "…"
-        posted_at = (
-            order.get("dateTime")
-            or order.get("datetime")
-            or order.get("posted_at")
-            or order.get("timestamp")
-            or datetime.utcnow().isoformat()
-        )
-        status = (
-            order.get("orderStatus")
-            or order.get("order_status")
-            or order.get("category")
-            or "order"
-        )
-        record_id = order.get("externalId") or order.get("external_id") or order.get("id") or _generate_id(
-            f"{meta['slug']}"
-        )
-        transactions.append(
-            {
-                "id": f"{meta['slug']}_{record_id}",
-                "merchant": meta["merchant_name"],
-                "merchant_id": merchant_id,
-                "amount": round(amount, 2),
-                "category": str(status).lower(),
-                "description": description,
-                "is_essential": None,
-                "posted_at": posted_at,
-            }
-        )
-    return transactions
-
-
-def _get_knot_profile(user_id: str) -> Optional[Dict]:
-    row = database.fetchone(
-        "SELECT merchants_json, transactions_json, updated_at FROM knot_profiles WHERE user_id = ?",
-        (user_id,),
-    )
-    if not row:
-        return None
-    merchants = json.loads(row["merchants_json"])
-    transactions = json.loads(row["transactions_json"])
-    return {
-        "merchants": merchants,
-        "transactions": transactions,
-        "updated_at": row["updated_at"],
-    }
+async def _run_x_share_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    tweet_id, error = await _share_loan_on_x(payload["user_id"], payload["amount"], payload["lenders"])
+    if error == "post_failed":
+        raise jobs.RetryJob(error)
+    if error == "post_rejected":
+        raise jobs.FailJob(error)
+    return {"tweet_id": tweet_id, "error": error}
 
 
-def _save_knot_profile(user_id: str, merchants: List[Dict], transactions: List[Dict]) -> Dict:
-    updated_at = datetime.utcnow().isoformat()
-    database.execute(
-        """
-        INSERT INTO knot_profiles (user_id, merchants_json, transactions_json, updated_at)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            merchants_json = excluded.merchants_json,
-            transactions_json = excluded.transactions_json,
-            updated_at = excluded.updated_at
-        """,
-        (user_id, json.dumps(merchants), json.dumps(transactions), updated_at),
-    )
-    return {"merchants": merchants, "transactions": transactions, "updated_at": updated_at}
+jobs.register(X_SHARE_JOB, _run_x_share_job)
 
 
-def _compute_knot_summary(profile: Optional[Dict]) -> Optional[Dict]:
-    if not profile:
-        return None
-    transactions = profile.get("transactions") or []
-    if not transactions:
-        return None
-    total = sum(t.get("amount", 0) for t in transactions)
-    if total <= 0:
-        return None
-    merchants = profile.get("merchants", [])
+def _knot_profile(user_id: str, transaction_limit: int = 50) -> Dict:
     return {
-        "merchants": [m.get("merchant_name") for m in merchants],
-        "avg_monthly_spend": round(total / 3, 2),
-        "orders": len(transactions),
-        "essentials_ratio": None,
-        "last_sync": profile.get("updated_at"),
+        "merchants": knot_store.merchants(user_id),
+        "transactions": knot_store.recent_transactions(user_id, transaction_limit),
+        "updated_at": knot_store.last_sync(user_id),
     }
 
 
@@ -440,7 +338,7 @@ def _format_transactions_for_prompt(transactions: List[Dict], limit: int = 10) -
     return "\n".join(snippets) if snippets else "No purchase history linked."
 
 
-def _call_grok_risk_analysis(
+async def _call_grok_risk_analysis(
     user_id: str,
     amount: float,
     knot_summary: Optional[Dict],
@@ -470,11 +368,12 @@ def _call_grok_risk_analysis(
     }
     headers = {"Authorization": f"Bearer {GROK_API_KEY}", "Content-Type": "application/json"}
     try:
-        response = httpx.post(
+        response = await http_clients.request(
+            "grok",
+            "POST",
             f"{GROK_BASE_URL.rstrip('/')}/v1/chat/completions",
             headers=headers,
             json=payload,
-            timeout=20,
         )
         response.raise_for_status()
     except httpx.HTTPError as exc:
@@ -551,6 +450,11 @@ class LoanRequest(BaseModel):
     user_id: str
 
 
+class MatchBatchRequest(BaseModel):
+    community_id: str
+    require_lock: bool = False
+
+
 class NessieTransferRequest(BaseModel):
     match_id: str
 
@@ -683,62 +587,41 @@ def _get_borrow_amount(user_id: str) -> Optional[float]:
     return row["amount"] if row else None
 
 
-def _create_payment_schedule(user_id: str, total_amount: float) -> None:
-    if total_amount <= 0:
-        database.execute(
-            "DELETE FROM payment_schedules WHERE user_id = ?",
-            (user_id,),
-        )
-        return
+def _require_borrower_amount(user_id: str) -> Tuple[Dict, Optional[float]]:
+    return _require_user(user_id), _get_borrow_amount(user_id)
 
-    database.execute(
-        "DELETE FROM payment_schedules WHERE user_id = ?",
-        (user_id,),
-    )
 
-    base_payment = total_amount / 12
-    remaining = total_amount
-    first_due = datetime.utcnow() + timedelta(weeks=4)
-
-    for index in range(12):
-        if index == 11:
-            payment_amount = round(remaining, 2)
-        else:
-            payment_amount = round(min(base_payment, remaining), 2)
-        if payment_amount <= 0:
-            break
-        due_date = (first_due + timedelta(weeks=4 * index)).replace(microsecond=0)
-        database.execute(
-            """
-            INSERT INTO payment_schedules (user_id, due_date, amount, status)
-            VALUES (?, ?, ?, 'pending')
-            """,
-            (user_id, due_date.isoformat(), payment_amount),
-        )
-        remaining = round(max(0.0, remaining - payment_amount), 2)
-        if remaining <= 0:
-            break
+def _blended_apr(legs: List[Tuple[float, float]]) -> float:
+    """Loan APR from ``(amount, rate)`` lender legs."""
+    total = sum(amount for amount, _ in legs)
+    return schedules.loan_apr(sum(amount * rate for amount, rate in legs) / total) if total else 0.0
 
 
-def _get_next_scheduled_payment(user_id: str) -> Optional[Dict[str, Any]]:
-    row = database.fetchone(
+def _write_payment_schedules(tx: database.Transaction, loans: List[Tuple[str, str, schedules.Schedule]]) -> None:
+    """Store ``(user_id, match_id, schedule)`` rows, retiring each borrower's previous schedule."""
+    now = datetime.utcnow().isoformat()
+    tx.executemany(
         """
-        SELECT due_date, amount
-        FROM payment_schedules
-        WHERE user_id = ? AND status = 'pending'
-        ORDER BY due_date ASC
-        LIMIT 1
+        UPDATE loan_schedules SET status = 'replaced', next_due_date = NULL, updated_at = ?
+        WHERE user_id = ? AND status = 'active'
         """,
-        (user_id,),
+        [(now, user_id) for user_id, _, _ in loans],
     )
-    if not row:
-        return None
-    due_date_raw = row["due_date"]
-    try:
-        due_date = datetime.fromisoformat(due_date_raw)
-    except (TypeError, ValueError):
-        return None
-    return {"due_date": due_date, "amount": float(row["amount"])}
+    tx.executemany(
+        """
+        INSERT INTO loan_schedules (
+            match_id, user_id, principal, apr, frequency, installments, first_due,
+            payment, final_payment, next_due_date, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [(match_id, user_id, *schedule, schedule.first_due, now) for user_id, match_id, schedule in loans],
+    )
+
+
+def _create_payment_schedule(tx: database.Transaction, user_id: str, match_id: str, total_amount: float, apr: float) -> None:
+    schedule = schedules.compact(total_amount, apr)
+    if schedule is not None:
+        _write_payment_schedules(tx, [(user_id, match_id, schedule)])
 
 
 def _weeks_until_due(due_date: datetime) -> int:
@@ -749,16 +632,59 @@ def _weeks_until_due(due_date: datetime) -> int:
     return max(0, math.ceil(weeks))
 
 
-def _risk_logic(user_id: str) -> Dict:
+def _base_risk_score(amount: float, ceiling: Optional[float]) -> float:
+    ratio = amount / ceiling if ceiling else 1
+    ratio = min(max(ratio, 0), 1.2)
+    return max(5, 95 - ratio * 60)
+
+
+def _risk_model_version() -> str:
+    grok = GROK_MODEL if GROK_API_KEY else "off"
+    return f"{RISK_RULES_VERSION}:{grok}"
+
+
+def _risk_stamp(user_id: str) -> Tuple[Optional[float], Optional[str], str]:
+    amount = _get_borrow_amount(user_id)
+    return amount, knot_store.last_sync(user_id), _risk_model_version()
+
+
+async def _risk_logic(user_id: str) -> Dict:
+    """Risk result for a borrower, memoized on everything that feeds it.
+
+    Entries are keyed by user and stamped with (borrow amount, Knot profile
+    sync time, model version); a changed stamp is treated as a miss, and
+    /borrow/amount and /knot/link drop the entry outright.
+    """
+    stamp = await run_in_threadpool(_risk_stamp, user_id)
+    cached = _risk_cache.get(user_id)
+    if cached is not None and cached[0] == stamp:
+        return copy.deepcopy(cached[1])
+    result = await _compute_risk(user_id)
+    ttl = None
+    if GROK_API_KEY and result.get("analysis_source") != "grok":
+        # Grok was expected but failed; retry it soon rather than pinning rules.
+        ttl = min(60.0, RISK_CACHE_TTL_SECONDS)
+    _risk_cache.set(user_id, (stamp, result), ttl_seconds=ttl)
+    return copy.deepcopy(result)
+
+
+async def _compute_risk(user_id: str) -> Dict:
+    # SQLite reads and rule scoring run in the threadpool; only the Grok call
+    # is awaited on the event loop.
+    result, knot_summary, amount, transactions = await run_in_threadpool(_rules_risk, user_id)
+    grok_result = await _call_grok_risk_analysis(user_id, amount, knot_summary, transactions)
+    if grok_result:
+        _merge_grok_result(result, knot_summary, grok_result)
+    return result
+
+
+def _rules_risk(user_id: str) -> Tuple[Dict, Optional[Dict], float, List[Dict]]:
     user = _require_user(user_id)
     amount = _get_borrow_amount(user_id) or 0.0
     ceiling = user.get("max_amount", 1500)
-    ratio = amount / ceiling if ceiling else 1
-    ratio = min(max(ratio, 0), 1.2)
-    base_score = max(5, 95 - ratio * 60)
+    base_score = _base_risk_score(amount, ceiling)
 
-    knot_profile = _get_knot_profile(user_id)
-    knot_summary = _compute_knot_summary(knot_profile)
+    knot_summary = knot_store.summary(user_id)
     adjustment = 0
     if knot_summary:
         ess_ratio = knot_summary.get("essentials_ratio")
@@ -807,43 +733,38 @@ def _risk_logic(user_id: str) -> Dict:
     }
     if knot_summary:
         result["knot_summary"] = knot_summary
+    transactions = knot_store.recent_transactions(user_id, 10) if knot_summary else []
+    return result, knot_summary, amount, transactions
 
-    grok_result = _call_grok_risk_analysis(
-        user_id,
-        amount,
-        knot_summary,
-        knot_profile["transactions"] if knot_profile else [],
-    )
-    if grok_result:
-        grok_score = grok_result.get("score")
+
+def _merge_grok_result(result: Dict, knot_summary: Optional[Dict], grok_result: Dict) -> None:
+    grok_score = grok_result.get("score")
+    try:
+        grok_score = max(5, min(95, int(round(float(grok_score)))))
+    except (TypeError, ValueError):
+        grok_score = result["score"]
+    result["analysis_source"] = "grok"
+    result["score"] = grok_score
+    result["label"] = "low" if grok_score >= 70 else "med" if grok_score >= 45 else "high"
+    grok_rec = (grok_result.get("recommendation") or "").lower()
+    if grok_rec in {"yes", "maybe", "no"}:
+        result["recommendation"] = grok_rec
+    if grok_result.get("explanation"):
+        result["explanation"] = grok_result["explanation"]
+    if grok_result.get("model"):
+        result["analysis_model"] = grok_result["model"]
+    ratio_val = grok_result.get("essentials_ratio")
+    if ratio_val is not None:
         try:
-            grok_score = max(5, min(95, int(round(float(grok_score)))))
+            ratio_float = float(ratio_val)
+            if ratio_float > 1:
+                ratio_float = ratio_float / 100.0
+            ratio_float = max(0.0, min(1.0, ratio_float))
+            if knot_summary:
+                knot_summary["essentials_ratio"] = ratio_float
+                result["knot_summary"] = knot_summary
         except (TypeError, ValueError):
-            grok_score = result["score"]
-        result["analysis_source"] = "grok"
-        result["score"] = grok_score
-        result["label"] = "low" if grok_score >= 70 else "med" if grok_score >= 45 else "high"
-        grok_rec = (grok_result.get("recommendation") or "").lower()
-        if grok_rec in {"yes", "maybe", "no"}:
-            result["recommendation"] = grok_rec
-        if grok_result.get("explanation"):
-            result["explanation"] = grok_result["explanation"]
-        if grok_result.get("model"):
-            result["analysis_model"] = grok_result["model"]
-        ratio_val = grok_result.get("essentials_ratio")
-        if ratio_val is not None:
-            try:
-                ratio_float = float(ratio_val)
-                if ratio_float > 1:
-                    ratio_float = ratio_float / 100.0
-                ratio_float = max(0.0, min(1.0, ratio_float))
-                if knot_summary:
-                    knot_summary["essentials_ratio"] = ratio_float
-                    result["knot_summary"] = knot_summary
-            except (TypeError, ValueError):
-                pass
-
-    return result
+            pass
 
 
 # --- Knot mock linking ---
@@ -854,41 +775,29 @@ def link_knot_account(payload: KnotLinkRequest):
     if not merchant_meta:
         raise HTTPException(status_code=400, detail="Unsupported merchant.")
 
-    transactions_new = _orders_to_transactions(payload.merchant_id)
-    total = sum(t["amount"] for t in transactions_new)
-    merchant_summary = {
-        "merchant_id": payload.merchant_id,
-        "merchant_name": merchant_meta["merchant_name"],
-        "avg_monthly_spend": round(total / 3, 2) if total else 0,
-        "orders": len(transactions_new),
-        "essentials_ratio": None,
-        "last_sync": datetime.utcnow().isoformat(),
-    }
-
-    profile = _get_knot_profile(payload.user_id) or {"merchants": [], "transactions": []}
-    merchants = [m for m in profile["merchants"] if m.get("merchant_id") != payload.merchant_id]
-    merchants.append(merchant_summary)
-    transactions = [
-        txn for txn in profile.get("transactions", []) if txn.get("merchant_id") != payload.merchant_id
-    ]
-    transactions.extend(transactions_new)
-    saved = _save_knot_profile(payload.user_id, merchants, transactions)
+    path = KNOT_DATA_DIR / merchant_meta["file"]
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Merchant export not found.")
+    try:
+        ingested = knot_ingest.ingest_export(payload.user_id, payload.merchant_id, merchant_meta, path)
+    except ValueError as exc:
+        # JSONDecodeError is a ValueError too.
+        raise HTTPException(status_code=422, detail=f"Malformed merchant export: {exc}") from exc
+    _risk_cache.invalidate(payload.user_id)
 
     return {
         "linked": True,
-        "merchant": merchant_summary,
-        "sample_transactions": transactions_new[:5],
-        "profile": saved,
+        "merchant": ingested["merchant"],
+        "sample_transactions": ingested["sample"],
+        "synced_rows": ingested["written"],
+        "profile": _knot_profile(payload.user_id),
     }
 
 
 @app.get("/knot/profile")
-def get_knot_profile(user_id: str):
+def get_knot_profile(user_id: str, limit: int = 50):
     _require_user(user_id)
-    profile = _get_knot_profile(user_id)
-    if not profile:
-        return {"merchants": [], "transactions": [], "updated_at": None}
-    return profile
+    return _knot_profile(user_id, max(1, min(limit, 500)))
 
 
 # --- Auth/Session ---
@@ -899,37 +808,43 @@ def create_user(payload: UserCreateRequest):
     max_amount = payload.max_amount or 1500.0
     geo = payload.geo or Geo(lat=DEFAULT_COMMUNITY_LAT, lng=DEFAULT_COMMUNITY_LNG)
     community_id = _community_from_geo(geo)
-    database.execute(
-        """
-        INSERT INTO users (
-            id,
-            role,
-            is_borrower,
-            is_verified,
-            lat,
-            lng,
-            min_rate,
-            max_amount,
-            created_at,
-            community_id,
-            location_locked
+    with database.transaction() as tx:
+        tx.execute(
+            """
+            INSERT INTO users (
+                id,
+                role,
+                is_borrower,
+                is_verified,
+                lat,
+                lng,
+                min_rate,
+                max_amount,
+                created_at,
+                community_id,
+                location_locked
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                user_id,
+                payload.role,
+                int(payload.role == "borrower"),
+                0,
+                geo.lat,
+                geo.lng,
+                min_rate,
+                max_amount,
+                datetime.utcnow().isoformat(),
+                community_id,
+                0,
+            ),
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            user_id,
-            payload.role,
-            int(payload.role == "borrower"),
-            0,
-            geo.lat,
-            geo.lng,
-            min_rate,
-            max_amount,
-            datetime.utcnow().isoformat(),
-            community_id,
-            0,
-        ),
-    )
+        if payload.role == "lender":
+            ledger.open_balance(user_id, max_amount)
+        dashboards.refresh(tx, [user_id])
+    if payload.role == "lender":
+        _lender_book.upsert(user_id, max_amount, min_rate, community_id, False, geo.lat, geo.lng)
     return {
         "user_id": user_id,
         "role": payload.role,
@@ -938,15 +853,63 @@ def create_user(payload: UserCreateRequest):
     }
 
 
-@app.post("/verify-id")
-async def verify_id(
-    user_id: str = Form(...),
-    document: UploadFile = File(...),
-    detected_lat: Optional[float] = Form(None),
-    detected_lng: Optional[float] = Form(None),
-):
+_VERIFY_ID_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["user_id", "document"],
+                    "properties": {
+                        "user_id": {"type": "string"},
+                        "document": {"type": "string", "format": "binary"},
+                        "detected_lat": {"type": "number"},
+                        "detected_lng": {"type": "number"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+@app.post("/verify-id", openapi_extra=_VERIFY_ID_FORM)
+async def verify_id(request: Request):
+    # The body is parsed by hand so the document streams into storage and a
+    # mislabeled or oversized file is refused without being received in full.
+    try:
+        form, stored = await id_storage.receive_upload(request)
+    except id_storage.UnsupportedDocument as exc:
+        raise HTTPException(
+            status_code=422,
+            detail="Unsupported file type. Upload a JPG, PNG, HEIC, or PDF.",
+        ) from exc
+    except id_storage.MismatchedDocument as exc:
+        raise HTTPException(
+            status_code=422,
+            detail="File contents don't match its type. Upload a JPG, PNG, HEIC, or PDF.",
+        ) from exc
+    except id_storage.UploadTooLarge as exc:
+        raise HTTPException(
+            status_code=413,
+            detail="File too large. Maximum size is 5 MB.",
+        ) from exc
+    except id_storage.EmptyUpload as exc:
+        raise HTTPException(status_code=422, detail="Uploaded file is empty.") from exc
+    except id_storage.BadUploadForm as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    except OSError as exc:
+        raise HTTPException(status_code=500, detail="Could not save document.") from exc
+
+    user_id = form.get("user_id", "")
     if not user_id:
         raise HTTPException(status_code=422, detail="User ID is required.")
+    for field in ("detected_lat", "detected_lng"):
+        try:
+            float(form.get(field) or 0)
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=f"{field} must be a number.") from exc
     try:
         user = _require_user(user_id)
     except HTTPException as exc:
@@ -954,50 +917,20 @@ async def verify_id(
             raise
         user = None
 
-    content_type = document.content_type or ""
-    if content_type not in ALLOWED_ID_MIME_TYPES:
-        raise HTTPException(
-            status_code=422,
-            detail="Unsupported file type. Upload a JPG, PNG, HEIC, or PDF.",
-        )
-
-    extension = _safe_document_extension(document.filename, content_type)
-    storage_name = f"{user_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}{extension}"
-    destination = ID_UPLOAD_DIR / storage_name
+    if user:
+        await run_in_threadpool(_record_verification, user_id, stored)
 
-    size = 0
-    try:
-        with destination.open("wb") as buffer:
-            while True:
-                chunk = await document.read(ID_UPLOAD_CHUNK_SIZE)
-                if not chunk:
-                    break
-                size += len(chunk)
-                if size > MAX_ID_UPLOAD_BYTES:
-                    raise HTTPException(
-                        status_code=413,
-                        detail="File too large. Maximum size is 5 MB.",
-                    )
-                buffer.write(chunk)
-    except HTTPException:
-        if destination.exists():
-            destination.unlink()
-        raise
-    except Exception as exc:
-        if destination.exists():
-            destination.unlink()
-        raise HTTPException(status_code=500, detail="Could not save document.") from exc
-    finally:
-        await document.close()
+    return {
+        "verified": True,
+        "message": "Location verified! Welcome to the Princeton community!",
+        "status": "verified",
+    }
 
-    if size == 0:
-        if destination.exists():
-            destination.unlink()
-        raise HTTPException(status_code=422, detail="Uploaded file is empty.")
 
+def _record_verification(user_id: str, stored: id_storage.StoredDocument) -> None:
     demo_geo = Geo(lat=DEFAULT_COMMUNITY_LAT, lng=DEFAULT_COMMUNITY_LNG)
-    if user:
-        database.execute(
+    with database.transaction() as tx:
+        tx.execute(
             """
             UPDATE users
             SET lat = ?, lng = ?, community_id = ?, location_locked = 1, is_verified = 1
@@ -1011,26 +944,25 @@ async def verify_id(
             ),
         )
 
-        database.execute(
+        tx.execute(
             """
-            INSERT INTO id_verifications (user_id, filename, content_type, size_bytes, status, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO id_verifications (
+                user_id, filename, content_type, size_bytes, content_sha256, status, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 user_id,
-                storage_name,
-                content_type,
-                size,
+                stored.storage_name,
+                stored.content_type,
+                stored.size,
+                stored.sha256,
                 "verified",
                 datetime.utcnow().isoformat(),
             ),
         )
-
-    return {
-        "verified": True,
-        "message": "Location verified! Welcome to the Princeton community!",
-        "status": "verified",
-    }
+        dashboards.refresh(tx, [user_id])
+    _refresh_lender(user_id)
 
 
 # --- Borrow flow ---
@@ -1059,24 +991,26 @@ def save_borrow_amount(payload: BorrowAmountRequest):
         raise HTTPException(status_code=400, detail="Only borrowers can set amounts.")
     if payload.amount <= 0:
         raise HTTPException(status_code=422, detail="Amount must be positive.")
-    database.execute(
-        """
-        INSERT INTO borrow_amounts (user_id, amount)
-        VALUES (?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET amount = excluded.amount
-        """,
-        (payload.user_id, payload.amount),
-    )
+    with database.transaction() as tx:
+        tx.execute(
+            """
+            INSERT INTO borrow_amounts (user_id, amount)
+            VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET amount = excluded.amount
+            """,
+            (payload.user_id, payload.amount),
+        )
+        dashboards.refresh(tx, [payload.user_id])
+    _risk_cache.invalidate(payload.user_id)
     return {"ok": True}
 
 
 @app.get("/borrow/risk")
-def get_borrow_risk(user_id: str):
-    _require_user(user_id)
-    amount = _get_borrow_amount(user_id)
+async def get_borrow_risk(user_id: str):
+    _, amount = await run_in_threadpool(_require_borrower_amount, user_id)
     if amount is None:
         raise HTTPException(status_code=404, detail="Borrow amount not set.")
-    return _risk_logic(user_id)
+    return await _risk_logic(user_id)
 
 
 @app.post("/borrow/options")
@@ -1087,9 +1021,11 @@ def get_borrow_options(payload: BorrowOptionsRequest):
         raise HTTPException(status_code=404, detail="Borrow amount missing.")
 
     community_filter = borrower["community_id"] if borrower["location_locked"] else None
-    lenders = _fetch_lenders(
+    origin = _matching_origin(borrower)
+    lenders = _fetch_lender_candidates(
         community_filter,
         require_lock=borrower["location_locked"],
+        near=origin,
     )
     if not lenders:
         if borrower["location_locked"] and community_filter:
@@ -1099,7 +1035,11 @@ def get_borrow_options(payload: BorrowOptionsRequest):
             )
         raise HTTPException(status_code=404, detail="No community lenders available yet.")
 
-    total_pool = sum(l["capital"] for l in lenders)
+    total_pool = _lender_pool_capital(
+        community_filter,
+        require_lock=borrower["location_locked"],
+        near=origin,
+    )
     if total_pool < amount:
         raise HTTPException(
             status_code=422,
@@ -1119,11 +1059,41 @@ def get_borrow_options(payload: BorrowOptionsRequest):
     return {"combos": combos}
 
 
+@app.get("/lenders/nearby")
+def lenders_nearby(
+    lat: float,
+    lng: float,
+    radius_km: float = LENDER_RADIUS_KM,
+    require_lock: bool = False,
+    limit: int = 50,
+):
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        raise HTTPException(status_code=422, detail="Coordinates out of range.")
+    if radius_km <= 0 or radius_km > LENDER_MAX_RADIUS_KM:
+        raise HTTPException(
+            status_code=422,
+            detail=f"radius_km must be between 0 and {LENDER_MAX_RADIUS_KM:g}.",
+        )
+    lenders = _lender_book.nearby(lat, lng, radius_km, require_lock, limit=max(1, min(limit, 500)))
+    return {
+        "radius_km": radius_km,
+        "lenders": [
+            {
+                "lenderId": _format_lender_id(lender["id"]),
+                "rate": round(lender["rate"], 2),
+                "available": round(lender["capital"], 2),
+                "distance_km": lender["distance_km"],
+            }
+            for lender in lenders
+        ],
+    }
+
+
 @app.post("/borrow/decline")
-def borrow_decline(payload: BorrowDeclineRequest):
-    _require_user(payload.user_id)
-    risk = _risk_logic(payload.user_id)
-    amount = _get_borrow_amount(payload.user_id) or 0.0
+async def borrow_decline(payload: BorrowDeclineRequest):
+    _, amount = await run_in_threadpool(_require_borrower_amount, payload.user_id)
+    risk = await _risk_logic(payload.user_id)
+    amount = amount or 0.0
     feedback = (
         f"Risk score {risk['score']} suggests waiting. "
         f"Reduce your request by ${amount * 0.2:.0f} or add savings."
@@ -1132,13 +1102,54 @@ def borrow_decline(payload: BorrowDeclineRequest):
 
 
 # --- Match + transfers ---
-@app.post("/loans/request")
-def create_loan_request(payload: LoanRequest):
-    borrower = _require_user(payload.user_id)
-    amount = _get_borrow_amount(payload.user_id)
-    if not amount:
-        raise HTTPException(status_code=404, detail="Borrow amount missing.")
-    risk = _risk_logic(payload.user_id)
+def _apply_balances(balances: Dict[str, float]) -> None:
+    for lender_id, available in balances.items():
+        _lender_book.set_capital(lender_id, available)
+
+
+def _reserve_allocations(
+    borrower_id: str,
+    amount: float,
+    community_id: Optional[str],
+    require_lock: bool,
+    near: Optional[Geo] = None,
+) -> Tuple[str, List[Dict]]:
+    """Pick the cheapest lenders for ``amount`` and hold their capital.
+
+    The order book can lag a concurrent request by a moment; when a
+    conditional decrement loses that race, the lender is re-read from the
+    ledger and matching is retried against the corrected book.
+    """
+    for _ in range(LOAN_RESERVE_ATTEMPTS):
+        lenders = _fetch_lenders(community_id, require_lock=require_lock, amount=amount, near=near)
+        if not lenders:
+            raise HTTPException(
+                status_code=404,
+                detail="No lenders available in your community yet.",
+            )
+
+        allocations = _allocate_from_lenders(amount, lenders)
+        if not allocations:
+            raise HTTPException(
+                status_code=422,
+                detail="Community pool does not have enough capital to fulfill this request.",
+            )
+        legs = [(allocation["user_id"], allocation["amount"]) for allocation in allocations]
+        try:
+            reservation_id, balances = ledger.reserve(legs, borrower_id)
+        except ledger.CapitalUnavailable as exc:
+            logger.info("Capital for %s moved during matching; retrying.", exc.lender_id)
+            _refresh_lender(exc.lender_id)
+            continue
+        _apply_balances(balances)
+        return reservation_id, allocations
+    raise HTTPException(
+        status_code=409,
+        detail="Lender capital changed while matching. Please try again.",
+    )
+
+
+def _write_loan_match(user_id: str, amount: float, risk_score: int, borrower: Dict) -> Tuple[str, List[Dict]]:
     if borrower["location_locked"]:
         community_filter = borrower["community_id"]
         require_lock = True
@@ -1147,121 +1158,437 @@ def create_loan_request(payload: LoanRequest):
         demo_geo = Geo(lat=DEFAULT_COMMUNITY_LAT, lng=DEFAULT_COMMUNITY_LNG)
         community_filter = borrower["community_id"] or _community_from_geo(demo_geo)
         require_lock = False
-    lenders = _fetch_lenders(community_filter, require_lock=require_lock)
-    if not lenders:
+    reservation_id, allocations = _reserve_allocations(
+        user_id,
+        amount,
+        community_filter,
+        require_lock,
+        near=_matching_origin(borrower),
+    )
+    # From here on every way out except a committed match gives the hold back.
+    try:
+        lender_parts = [
+            {k: v for k, v in allocation.items() if k != "user_id"}
+            for allocation in allocations
+        ]
+        match_id = _generate_id("match")
+        apr = _blended_apr([(allocation["amount"], allocation["rate"]) for allocation in allocations])
+        with database.transaction() as tx:
+            tx.execute(
+                """
+                INSERT INTO matches (id, user_id, total_amount, lenders_json, risk_score, apr, installments, frequency)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    match_id,
+                    user_id,
+                    amount,
+                    json.dumps(lender_parts),
+                    risk_score,
+                    apr,
+                    *schedules.DEFAULT_TERMS,
+                ),
+            )
+            _create_payment_schedule(tx, user_id, match_id, amount, apr)
+            ledger.commit(reservation_id, match_id)
+            portfolio.record(
+                tx,
+                [
+                    (match_id, allocation["user_id"], allocation["amount"], allocation["rate"])
+                    for allocation in allocations
+                ],
+            )
+            dashboards.refresh(tx, [user_id, *(allocation["user_id"] for allocation in allocations)])
+            if _can_post_to_x():
+                # Queued with the match so a crash can't lose or orphan the announcement.
+                jobs.enqueue(
+                    X_SHARE_JOB,
+                    {"match_id": match_id, "user_id": user_id, "amount": amount, "lenders": lender_parts},
+                    dedupe_key=f"{X_SHARE_JOB}:{match_id}",
+                )
+    except ledger.ReservationExpired as exc:
+        # Held so long that the sweep already returned the capital.
         raise HTTPException(
-            status_code=404,
-            detail="No lenders available in your community yet.",
-        )
+            status_code=409,
+            detail="Lender capital changed while matching. Please try again.",
+        ) from exc
+    except BaseException:
+        try:
+            _apply_balances(ledger.release(reservation_id))
+        except Exception:  # noqa: BLE001 - the sweep releases it once it expires
+            logger.exception("Could not release reservation %s", reservation_id)
+        raise
+    return match_id, lender_parts
 
-    allocations = _allocate_from_lenders(amount, lenders)
-    if not allocations:
-        raise HTTPException(
-            status_code=422,
-            detail="Community pool does not have enough capital to fulfill this request.",
-        )
 
-    lender_parts = [
-        {k: v for k, v in allocation.items() if k != "user_id"}
-        for allocation in allocations
-    ]
-    match_id = _generate_id("match")
-    database.execute(
-        """
-        INSERT INTO matches (id, user_id, total_amount, lenders_json, risk_score)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (
-            match_id,
-            payload.user_id,
-            amount,
-            json.dumps(lender_parts),
-            risk["score"],
-        ),
+@app.post("/loans/request")
+async def create_loan_request(payload: LoanRequest):
+    borrower, amount = await run_in_threadpool(_require_borrower_amount, payload.user_id)
+    if not amount:
+        raise HTTPException(status_code=404, detail="Borrow amount missing.")
+    risk = await _risk_logic(payload.user_id)
+    match_id, lender_parts = await run_in_threadpool(
+        _write_loan_match,
+        payload.user_id,
+        amount,
+        risk["score"],
+        borrower,
     )
-    _create_payment_schedule(payload.user_id, amount)
     advice = "Great fit—community lenders ready." if risk["recommendation"] == "yes" else "Matched with cautious lenders."
-    tweet_id, tweet_error = _share_loan_on_x(payload.user_id, amount, lender_parts)
+    if _can_post_to_x():
+        jobs.notify()
+        x_post_error = "queued"
+    else:
+        x_post_error = "disabled"
     return {
         "match_id": match_id,
         "total_amount": amount,
         "lenders": lender_parts,
         "risk_score": risk["score"],
         "ai_advice": advice,
-        "x_post_id": tweet_id,
-        "x_post_error": tweet_error,
+        "x_post_id": None,
+        "x_post_error": x_post_error,
+    }
+
+
+@app.get("/loans/{match_id}/x-share")
+def loan_x_share(match_id: str):
+    job = jobs.get(f"{X_SHARE_JOB}:{match_id}")
+    if not job:
+        if not database.fetchone("SELECT 1 FROM matches WHERE id = ?", (match_id,)):
+            raise HTTPException(status_code=404, detail="Match not found.")
+        return {"match_id": match_id, "status": "disabled", "x_post_id": None, "x_post_error": "disabled"}
+    result = job["result"] or {}
+    return {
+        "match_id": match_id,
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "x_post_id": result.get("tweet_id"),
+        "x_post_error": result.get("error") or job["last_error"],
+        "updated_at": job["updated_at"],
     }
 
 
+def _run_batch_match(community_id: str, require_lock: bool = False) -> Dict[str, Any]:
+    """Clear every pending borrower in a community against its lender book.
+
+    Pending means a borrow amount is set and no match exists yet. Borrowers
+    are cleared first-come first-served, lender capital is decremented as it
+    is promised, and all matches, schedules and capital updates are written
+    in one transaction.
+    """
+    started = datetime.utcnow()
+    rows = database.fetchall(
+        """
+        SELECT b.user_id, b.amount, u.max_amount
+        FROM borrow_amounts b
+        JOIN users u ON u.id = b.user_id
+        LEFT JOIN matches m ON m.user_id = b.user_id
+        WHERE u.community_id = ? AND m.id IS NULL
+        ORDER BY b.rowid
+        """,
+        (community_id,),
+    )
+    ceilings = {row["user_id"]: row["max_amount"] for row in rows}
+    borrowers = [(row["user_id"], float(row["amount"])) for row in rows]
+    first_due = schedules.first_due_date(schedules.LOAN_FREQUENCY)
+
+    for attempt in range(LOAN_RESERVE_ATTEMPTS):
+        lenders = _lender_book.lenders(community_id, require_lock)
+        fills, unmatched, balances = clear_batch(borrowers, lenders)
+
+        match_rows = []
+        ledger_entries: List[Tuple[str, str, float]] = []
+        drawn: List[Tuple[str, float]] = []
+        allocation_legs: List[Tuple[str, str, float, float]] = []
+        loans: List[Tuple[Tuple[str, str], float, float]] = []
+        for fill in fills:
+            match_id = _generate_id("match")
+            lender_parts = []
+            for lender, contribution in fill.allocations:
+                lender_parts.append(
+                    {
+                        "lenderId": _format_lender_id(lender["id"]),
+                        "amount": round(contribution, 2),
+                        "rate": round(lender["rate"], 2),
+                    }
+                )
+                allocation_legs.append((match_id, lender["id"], contribution, lender["rate"]))
+                drawn.append((lender["id"], contribution))
+                ledger_entries.append((lender["id"], match_id, contribution))
+            score = round(_base_risk_score(fill.amount, ceilings.get(fill.user_id)))
+            apr = _blended_apr([(contribution, lender["rate"]) for lender, contribution in fill.allocations])
+            match_rows.append(
+                (match_id, fill.user_id, fill.amount, json.dumps(lender_parts), score, apr, *schedules.DEFAULT_TERMS)
+            )
+            loans.append(((fill.user_id, match_id), fill.amount, apr))
+
+        if not fills:
+            break
+        try:
+            with database.transaction() as tx:
+                ledger.commit_direct(tx, drawn, ledger_entries)
+                tx.executemany(
+                    """
+                    INSERT INTO matches (id, user_id, total_amount, lenders_json, risk_score, apr, installments, frequency)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    match_rows,
+                )
+                # Every borrower in a batch shares a start date and terms, so the
+                # whole batch is amortized in one pass.
+                _write_payment_schedules(
+                    tx,
+                    [(user_id, match_id, schedule) for (user_id, match_id), schedule in schedules.bulk(loans, first_due)],
+                )
+                portfolio.record(tx, allocation_legs)
+                dashboards.refresh(tx, [*(fill.user_id for fill in fills), *(lender_id for lender_id, _ in drawn)])
+        except ledger.CapitalUnavailable as exc:
+            if attempt + 1 >= LOAN_RESERVE_ATTEMPTS:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Lender capital changed during batch matching. Please try again.",
+                ) from exc
+            logger.info("Batch match lost a race on %s; retrying.", exc.lender_id)
+            _refresh_lender(exc.lender_id)
+            continue
+        _apply_balances(ledger.available_balances(list(balances)))
+        break
+
+    return {
+        "community_id": community_id,
+        "pending": len(rows),
+        "matched": len(fills),
+        "unmatched": len(unmatched),
+        "amount_cleared": round(sum(fill.amount for fill in fills), 2),
+        "lenders_drawn": len(balances),
+        "duration_ms": round((datetime.utcnow() - started).total_seconds() * 1000, 1),
+    }
+
+
+@app.post("/loans/match-batch")
+def match_batch(payload: MatchBatchRequest):
+    return _run_batch_match(payload.community_id, require_lock=payload.require_lock)
+
+
 @app.post("/nessie/transfer")
-def mock_transfer(payload: NessieTransferRequest):
+def mock_transfer(payload: NessieTransferRequest, idempotency_key: Optional[str] = Header(default=None)):
     match = database.fetchone(
         "SELECT id FROM matches WHERE id = ?",
         (payload.match_id,),
     )
     if not match:
         raise HTTPException(status_code=404, detail="Match not found.")
-    txn_id = _generate_id("txn")
-    return {"txn_id": txn_id, "message": "Funds transferred (mock)"}
+    try:
+        return settlement.request_transfer(payload.match_id, idempotency_key)
+    except settlement.IdempotencyConflict as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    except settlement.NothingToTransfer as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+
+
+@app.get("/nessie/transfers/{txn_id}")
+def transfer_status(txn_id: str):
+    transfer = settlement.get(txn_id)
+    if transfer is None:
+        raise HTTPException(status_code=404, detail="Transfer not found.")
+    return transfer
 
 
 @app.get("/x/feed")
-def x_feed(handle: str = "raymo8980", limit: int = 10):
-    tweets = _get_x_tweets(handle, limit)
+async def x_feed(handle: str = "raymo8980", limit: int = 10):
+    tweets = await _get_x_tweets(handle, limit)
     return {"handle": handle, "tweets": tweets}
 
 
+# --- System ---
+@app.get("/system/db-pool")
+def db_pool_stats():
+    return database.pool_stats()
+
+
+@app.get("/system/http-clients")
+def http_client_stats():
+    return http_clients.stats()
+
+
+@app.get("/system/jobs")
+def job_stats():
+    return jobs.stats()
+
+
+@app.get("/system/lender-index")
+def lender_index_stats():
+    return {"match_mode": LENDER_MATCH_MODE, "radius_km": LENDER_RADIUS_KM, **_lender_book.geo_stats()}
+
+
+@app.post("/system/id-retention")
+def id_retention_run(dry_run: bool = False):
+    return id_retention.compact(dry_run=dry_run)
+
+
+@app.post("/system/schedules/reprice")
+def schedules_reprice(dry_run: bool = False):
+    return repricing.reprice(dry_run=dry_run)
+
+
+@app.get("/system/payments")
+def payment_processor_stats():
+    return payments.stats()
+
+
+@app.post("/system/payments/process")
+def payments_process():
+    try:
+        return payments.process_due()
+    except payments.PassInProgress as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+
+
+@app.get("/system/settlement")
+def settlement_stats():
+    return settlement.stats()
+
+
+@app.post("/system/settlement/run")
+def settlement_run():
+    return settlement.settle_pending()
+
+
+_CACHES: Dict[str, Any] = {"risk": _risk_cache, "x_user": _x_user_cache, "x_tweets": _x_tweet_cache}
+
+
+def _cache_metrics() -> List[metrics.Family]:
+    stats = {name: cache.stats() for name, cache in _CACHES.items()}
+
+    def samples(key: str) -> List[Tuple[Dict[str, str], Any]]:
+        return [({"cache": name}, values[key]) for name, values in stats.items()]
+
+    return [
+        ("cache_hits_total", "counter", "Cache lookups answered from memory.", samples("hits")),
+        ("cache_misses_total", "counter", "Cache lookups that missed.", samples("misses")),
+        ("cache_entries", "gauge", "Entries currently cached.", samples("entries")),
+        ("cache_hit_ratio", "gauge", "Hits over lookups since start.", samples("hit_ratio")),
+    ]
+
+
+metrics.register_collector(_cache_metrics)
+
+
+@app.get("/system/caches")
+def cache_stats():
+    return {name: cache.stats() for name, cache in _CACHES.items()}
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # --- Dashboards ---
-@app.get("/dashboard/borrower")
-def borrower_dashboard(user_id: str):
-    _require_user(user_id)
-    borrow_amount = _get_borrow_amount(user_id)
-    schedule = None
-    if borrow_amount is not None:
-        schedule = _get_next_scheduled_payment(user_id)
-        if schedule is None:
-            _create_payment_schedule(user_id, borrow_amount)
-            schedule = _get_next_scheduled_payment(user_id)
+def _load_dashboard(user_id: str) -> Dict[str, Any]:
+    summary = dashboards.get(user_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return summary
+
+
+def _next_payment(summary: Dict[str, Any], fallback_amount: float) -> Dict[str, Any]:
+    due_date = summary["next_due_date"]
+    if due_date is None or summary["next_payment_amount"] is None:
+        return {"amount": round(fallback_amount, 2), "due_in_weeks": 1}
+    return {
+        "amount": round(summary["next_payment_amount"], 2),
+        "due_in_weeks": _weeks_until_due(datetime.fromisoformat(due_date)),
+    }
+
+
+def _borrower_view(summary: Dict[str, Any]) -> Dict[str, Any]:
+    if summary["loans"] and not summary["payments_remaining"]:
+        # Every loan is paid off: nothing due and nothing owed.
+        return {
+            "next_payment": {"amount": 0.0, "due_in_weeks": 0},
+            "total_owed_year": 0.0,
+            "savings_vs_bank_year": 0.0,
+        }
+    borrow_amount = summary["borrow_amount"]
     amount = borrow_amount if borrow_amount is not None else 200.0
-    if schedule:
-        next_payment_amount = round(schedule["amount"], 2)
-        due_in_weeks = _weeks_until_due(schedule["due_date"])
-    else:
-        next_payment_amount = round(min(amount / 10, 50), 2)
-        due_in_weeks = 1
     return {
-        "next_payment": {"amount": next_payment_amount, "due_in_weeks": due_in_weeks},
+        "next_payment": _next_payment(summary, min(amount / 10, 50)),
         "total_owed_year": round(amount, 2),
         "savings_vs_bank_year": round((BANK_AVG_RATE / 100) * amount, 2),
     }
 
 
-@app.get("/dashboard/lender")
-def lender_dashboard(user_id: str):
-    user = _require_user(user_id)
-    capital = user.get("max_amount", 1500)
-    schedule = _get_next_scheduled_payment(user_id)
-    due_in_weeks = _weeks_until_due(schedule["due_date"]) if schedule else 1
+def _lender_view(summary: Dict[str, Any]) -> Dict[str, Any]:
+    inflow_date = summary["next_inflow_date"]
     return {
-        "next_payment": {"amount": round(capital * 0.01, 2), "due_in_weeks": due_in_weeks},
-        "expected_revenue_year": round(capital * 0.12, 2),
+        "next_payment": {
+            "amount": round(summary["inflow_next_cycle"], 2),
+            "due_in_weeks": _weeks_until_due(datetime.fromisoformat(inflow_date)) if inflow_date else 0,
+        },
+        "expected_revenue_year": round(summary["expected_yield_year"], 2),
+        "principal_outstanding": round(summary["principal_outstanding"], 2),
     }
 
 
-@app.post("/finance-bot", response_model=FinanceBotResponse)
-async def finance_bot(payload: FinanceBotRequest):
-    logger.info("Finance Bot request received: prompt length=%s, history=%s", len(payload.prompt or ""), len(payload.history))
-    prompt = payload.prompt.strip()
-    if not prompt:
-        raise HTTPException(status_code=422, detail="Prompt is required.")
+@app.get("/dashboard")
+def dashboard(user_id: str):
+    """Everything the dashboards show, from the user's materialized summary row."""
+    summary = _load_dashboard(user_id)
+    borrower = _borrower_view(summary)
+    borrower.update(
+        {
+            "borrow_amount": summary["borrow_amount"],
+            "payments_remaining": summary["payments_remaining"],
+            "balance_remaining": round(summary["balance_remaining"], 2),
+            "schedule_projected": summary["schedule_projected"],
+            "loans": summary["loans"],
+            "borrowed_total": round(summary["borrowed_total"], 2),
+        }
+    )
+    lender = _lender_view(summary)
+    lender.update(
+        {
+            "capital_total": summary["capital_total"],
+            "capital_available": summary["capital_available"],
+            "capital_committed": summary["capital_committed"],
+            "loans_funded": summary["loans_funded"],
+        }
+    )
+    return {
+        "user_id": summary["user_id"],
+        "role": summary["role"],
+        "is_verified": summary["is_verified"],
+        "borrower": borrower,
+        "lender": lender,
+        "knot": summary["knot"],
+        "updated_at": summary["updated_at"],
+    }
+
+
+@app.get("/dashboard/borrower")
+def borrower_dashboard(user_id: str):
+    return _borrower_view(_load_dashboard(user_id))
+
+
+@app.get("/dashboard/lender")
+def lender_dashboard(user_id: str):
+    return _lender_view(_load_dashboard(user_id))
 
-    trimmed_history = payload.history[-FINANCE_BOT_HISTORY_LIMIT :]
-    if not GEMINI_API_KEY:
-        logger.warning("Finance Bot missing GEMINI_API_KEY, falling back.")
-        return {"reply": _fallback_finance_reply(prompt, trimmed_history)}
 
+@app.get("/dashboard/lender/portfolio")
+def lender_portfolio(user_id: str, horizon_days: int = portfolio.PORTFOLIO_HORIZON_DAYS):
+    """Allocations, outstanding principal and upcoming inflows for a lender."""
+    if not 1 <= horizon_days <= 366:
+        raise HTTPException(status_code=422, detail="horizon_days must be between 1 and 366")
+    _require_user(user_id)
+    return portfolio.portfolio(user_id, horizon_days)
+
+
+def _finance_bot_body(prompt: str, history: List[FinanceBotMessage]) -> Dict[str, object]:
     contents: List[Dict[str, object]] = []
-    for entry in trimmed_history:
+    for entry in history:
         text = entry.text.strip()
         if not text:
             continue
@@ -1269,26 +1596,118 @@ async def finance_bot(payload: FinanceBotRequest):
         contents.append({"role": role, "parts": [{"text": text}]})
     contents.append({"role": "user", "parts": [{"text": prompt}]})
 
-    body = {
+    return {
         "contents": contents,
         "system_instruction": {"parts": [{"text": FINANCE_BOT_PROMPT}]},
         "generationConfig": {"temperature": 0.3},
     }
 
+
+def _sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def _finance_bot_stream_events(
+    prompt: str,
+    history: List[FinanceBotMessage],
+) -> AsyncIterator[str]:
+    """Relay Gemini's streamed tokens as SSE, or the fallback reply if it fails.
+
+    Emits ``data: {"text": ...}`` events followed by one ``event: done``
+    carrying the reply source. If Gemini drops after tokens were already
+    sent, an ``event: error`` is emitted instead of mixing in the fallback.
+    """
+    sent = False
+    failed = False
+    if GEMINI_API_KEY:
+        endpoint = f"{FINANCE_BOT_URL}/{FINANCE_BOT_MODEL}:streamGenerateContent"
+        try:
+            async with http_clients.stream(
+                "gemini",
+                "POST",
+                endpoint,
+                params={"key": GEMINI_API_KEY, "alt": "sse"},
+                headers={"Content-Type": "application/json"},
+                json=_finance_bot_body(prompt, history),
+            ) as response:
+                if response.status_code >= 400:
+                    error_body = await response.aread()
+                    logger.warning(
+                        "Finance Bot Gemini stream error %s: %s",
+                        response.status_code,
+                        error_body[:300],
+                    )
+                    failed = True
+                else:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        try:
+                            chunk = json.loads(line[len("data:") :].strip())
+                        except json.JSONDecodeError:
+                            continue
+                        for candidate in chunk.get("candidates", [])[:1]:
+                            for part in candidate.get("content", {}).get("parts", []):
+                                if part.get("text"):
+                                    sent = True
+                                    yield _sse_event({"text": part["text"]})
+        except httpx.HTTPError as exc:  # pragma: no cover - network defensive
+            logger.warning("Finance Bot Gemini stream request error: %s", exc)
+            failed = True
+    else:
+        logger.warning("Finance Bot missing GEMINI_API_KEY, falling back.")
+
+    if sent:
+        if failed:
+            yield _sse_event({"message": "Stream interrupted."}, event="error")
+        yield _sse_event({"source": "gemini"}, event="done")
+        return
+    yield _sse_event({"text": _fallback_finance_reply(prompt, history)})
+    yield _sse_event({"source": "fallback"}, event="done")
+
+
+@app.post("/finance-bot/stream")
+async def finance_bot_stream(payload: FinanceBotRequest):
+    prompt = payload.prompt.strip()
+    if not prompt:
+        raise HTTPException(status_code=422, detail="Prompt is required.")
+    trimmed_history = payload.history[-FINANCE_BOT_HISTORY_LIMIT :]
+    return StreamingResponse(
+        _finance_bot_stream_events(prompt, trimmed_history),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/finance-bot", response_model=FinanceBotResponse)
+async def finance_bot(payload: FinanceBotRequest):
+    logger.info("Finance Bot request received: prompt length=%s, history=%s", len(payload.prompt or ""), len(payload.history))
+    prompt = payload.prompt.strip()
+    if not prompt:
+        raise HTTPException(status_code=422, detail="Prompt is required.")
+
+    trimmed_history = payload.history[-FINANCE_BOT_HISTORY_LIMIT :]
+    if not GEMINI_API_KEY:
+        logger.warning("Finance Bot missing GEMINI_API_KEY, falling back.")
+        return {"reply": _fallback_finance_reply(prompt, trimmed_history)}
+
+    body = _finance_bot_body(prompt, trimmed_history)
     endpoint = f"{FINANCE_BOT_URL}/{FINANCE_BOT_MODEL}:generateContent"
 
     logger.info("Finance Bot calling Gemini model=%s endpoint=%s", FINANCE_BOT_MODEL, endpoint)
 
     try:
         logger.debug("Finance Bot payload preview: %s", json.dumps(body).encode("utf-8")[:400])
-        async with httpx.AsyncClient(timeout=15) as client:
-            response = await client.post(
-                endpoint,
-                params={"key": GEMINI_API_KEY},
-                headers={"Content-Type": "application/json"},
-                json=body,
-            )
-    except httpx.RequestError as exc:  # pragma: no cover - network defensive
+        response = await http_clients.request(
+            "gemini",
+            "POST",
+            endpoint,
+            params={"key": GEMINI_API_KEY},
+            headers={"Content-Type": "application/json"},
+            json=body,
+        )
+    except httpx.HTTPError as exc:  # pragma: no cover - network defensive
         logger.warning("Finance Bot Gemini request error: %s", exc)
         return {"reply": _fallback_finance_reply(prompt, trimmed_history)}
 
@@ -1328,32 +1747,134 @@ def _format_lender_id(user_id: str) -> str:
     return f"Lender-{suffix[:4].upper()}"
 
 
+def _load_lender_book() -> int:
+    rows = database.fetchall(
+        """
+        SELECT
+            u.id,
+            COALESCE(b.available, 0) AS max_amount,
+            u.min_rate,
+            u.community_id,
+            u.location_locked,
+            u.lat,
+            u.lng
+        FROM users u
+        LEFT JOIN lender_balances b ON b.lender_id = u.id
+        WHERE u.role = 'lender'
+        """
+    )
+    count = _lender_book.rebuild(rows)
+    logger.info("Lender order book rebuilt with %s lenders.", count)
+    return count
+
+
+def _refresh_lender(user_id: str) -> None:
+    """Re-file a user in the order book after their lender row changes."""
+    row = database.fetchone(
+        """
+        SELECT
+            u.id,
+            u.role,
+            COALESCE(b.available, 0) AS max_amount,
+            u.min_rate,
+            u.community_id,
+            u.location_locked,
+            u.lat,
+            u.lng
+        FROM users u
+        LEFT JOIN lender_balances b ON b.lender_id = u.id
+        WHERE u.id = ?
+        """,
+        (user_id,),
+    )
+    if not row or row["role"] != "lender":
+        _lender_book.remove(user_id)
+        return
+    _lender_book.upsert(
+        row["id"],
+        row["max_amount"],
+        row["min_rate"],
+        row["community_id"],
+        bool(row["location_locked"]),
+        row["lat"],
+        row["lng"],
+    )
+
+
 def _fetch_lenders(
     community_id: Optional[str] = None,
     require_lock: bool = False,
+    amount: Optional[float] = None,
+    near: Optional[Geo] = None,
+    radius_km: Optional[float] = None,
 ) -> List[Dict]:
-    params: List = []
-    query = """
-        SELECT id, max_amount, min_rate
-        FROM users
-        WHERE role = 'lender'
+    """Lenders sorted by rate then capital, served from the in-memory book.
+
+    When ``amount`` is given only the cheapest prefix covering it is returned,
+    which keeps matching cost independent of community size. Passing ``near``
+    switches to radius mode: lenders within ``radius_km`` of that point, from
+    any community, instead of exact ``community_id`` equality.
     """
-    if community_id:
-        query += " AND community_id = ?"
-        params.append(community_id)
-    if require_lock:
-        query += " AND location_locked = 1"
-    query += " ORDER BY min_rate ASC, max_amount DESC"
-    rows = database.fetchall(query, tuple(params))
-    return [
-        {
-            "id": row["id"],
-            "capital": float(row["max_amount"]),
-            "rate": float(row["min_rate"]),
-        }
-        for row in rows
-        if row["max_amount"] and row["max_amount"] > 0
-    ]
+    if near is not None:
+        return _lender_book.nearby(
+            near.lat,
+            near.lng,
+            radius_km or LENDER_RADIUS_KM,
+            require_lock,
+            amount=amount,
+        )
+    if amount is not None:
+        return _lender_book.covering(amount, community_id, require_lock)
+    return _lender_book.lenders(community_id, require_lock)
+
+
+def _fetch_lender_candidates(
+    community_id: Optional[str] = None,
+    require_lock: bool = False,
+    near: Optional[Geo] = None,
+    radius_km: Optional[float] = None,
+) -> List[Dict]:
+    """Bounded, rate-sorted candidate pool for the combination engine."""
+    if near is not None:
+        return _lender_book.nearby_candidates(
+            near.lat,
+            near.lng,
+            radius_km or LENDER_RADIUS_KM,
+            require_lock,
+            cheapest=COMBO_CANDIDATES_BY_RATE,
+            largest=COMBO_CANDIDATES_BY_CAPITAL,
+        )
+    return _lender_book.candidates(
+        community_id,
+        require_lock,
+        cheapest=COMBO_CANDIDATES_BY_RATE,
+        largest=COMBO_CANDIDATES_BY_CAPITAL,
+    )
+
+
+def _lender_pool_capital(
+    community_id: Optional[str] = None,
+    require_lock: bool = False,
+    near: Optional[Geo] = None,
+    radius_km: Optional[float] = None,
+) -> float:
+    if near is not None:
+        return _lender_book.nearby_capital(near.lat, near.lng, radius_km or LENDER_RADIUS_KM, require_lock)
+    return _lender_book.total_capital(community_id, require_lock)
+
+
+def _matching_origin(borrower: Dict) -> Optional[Geo]:
+    """Borrower position for radius matching, or None to match by community.
+
+    Only location-locked borrowers are matched by radius; their position is
+    the verified one.
+    """
+    if LENDER_MATCH_MODE != "radius" or not borrower["location_locked"]:
+        return None
+    geo = borrower["geo"]
+    if geo["lat"] is None or geo["lng"] is None:
+        return None
+    return Geo(lat=geo["lat"], lng=geo["lng"])
 
 
 def _allocate_from_lenders(amount: float, lenders: List[Dict]) -> List[Dict]:
@@ -1388,17 +1909,15 @@ def _allocate_from_lenders(amount: float, lenders: List[Dict]) -> List[Dict]:
 
 def _generate_lender_combos(amount: float, lenders: List[Dict]) -> List[Dict]:
     combos: List[Dict] = []
-    seen_sources = set()
-    max_window = min(3, len(lenders))
-    for window in range(1, max_window + 1):
-        window_lenders = lenders[:window]
-        parts = _allocate_from_lenders(amount, window_lenders)
+    for candidate in best_combinations(
+        amount,
+        lenders,
+        top_k=COMBO_TOP_K,
+        time_budget_ms=COMBO_TIME_BUDGET_MS,
+    ):
+        parts = _allocate_from_lenders(amount, candidate.lenders)
         if not parts:
             continue
-        source_ids = tuple(part["user_id"] for part in parts)
-        if source_ids in seen_sources:
-            continue
-        seen_sources.add(source_ids)
         combos.append(
             {
                 "id": f"c{len(combos) + 1}",
@@ -1407,28 +1926,9 @@ def _generate_lender_combos(amount: float, lenders: List[Dict]) -> List[Dict]:
                     {k: v for k, v in part.items() if k != "user_id"}
                     for part in parts
                 ],
-                "source_user_ids": [part["user_id"] for part in parts],
-            }
-        )
-
-    if combos:
-        return combos
-
-    # Fall back to using the full lender list if earlier windows lacked coverage.
-    parts = _allocate_from_lenders(amount, lenders)
-    if parts:
-        source_ids = tuple(part["user_id"] for part in parts)
-        if source_ids in seen_sources:
-            return combos
-        seen_sources.add(source_ids)
-        combos.append(
-            {
-                "id": "c_all",
-                "total": round(amount, 2),
-                "parts": [
-                    {k: v for k, v in part.items() if k != "user_id"}
-                    for part in parts
-                ],
+                "blended_rate": round(candidate.blended_rate, 2),
+                "lender_count": candidate.lender_count,
+                "strategy": candidate.strategy,
                 "source_user_ids": [part["user_id"] for part in parts],
             }
         )
@@ -0,0 +1,48 @@
+"""Offline batch clearing job.
+
+Usage (from ``backend/``)::
+
+    python -m app.match_batch <community_id> [--require-lock]
+    python -m app.match_batch --all
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+
+from . import database
+from .main import _load_lender_book, _run_batch_match
+
+
+def _pending_communities():
+    rows = database.fetchall(
+        """
+        SELECT DISTINCT u.community_id
+        FROM borrow_amounts b
+        JOIN users u ON u.id = b.user_id
+        LEFT JOIN matches m ON m.user_id = b.user_id
+        WHERE m.id IS NULL AND u.community_id IS NOT NULL
+        """
+    )
+    return [row["community_id"] for row in rows]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Clear pending borrowers against lender books.")
+    parser.add_argument("community_id", nargs="?", help="Community to clear.")
+    parser.add_argument("--all", action="store_true", help="Clear every community with pending borrowers.")
+    parser.add_argument("--require-lock", action="store_true", help="Only use location-locked lenders.")
+    args = parser.parse_args()
+    if not args.all and not args.community_id:
+        parser.error("Pass a community_id or --all.")
+
+    _load_lender_book()
+    communities = _pending_communities() if args.all else [args.community_id]
+    for community_id in communities:
+        summary = _run_batch_match(community_id, require_lock=args.require_lock)
+        print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Lender combination search used by /borrow/options.
+
+Given a funding amount and lenders with a per-lender capital cap and rate,
+find the best ways to fund the request:
+
+* by blended APR - the cheapest lender sets, found with Lawler-style
+  K-best search where each node re-solves the greedy rate-ordered fill with
+  some lenders excluded;
+* by fewest lenders - branch-and-bound over sets of the minimum possible
+  size, pruned on reachable capital and a blended-cost lower bound.
+
+Both searches stop at a hard deadline and return whatever they found so far,
+so latency stays bounded regardless of community size.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+
+@dataclass(order=True)
+class Combination:
+    blended_rate: float
+    lender_count: int
+    lenders: List[Dict] = field(compare=False)
+    strategy: str = field(default="lowest_rate", compare=False)
+
+    @property
+    def key(self) -> FrozenSet[str]:
+        return frozenset(lender["id"] for lender in self.lenders)
+
+
+def _greedy_fill(
+    amount: float,
+    lenders: Sequence[Dict],
+    excluded: FrozenSet[str] = frozenset(),
+) -> Optional[Tuple[float, List[Dict]]]:
+    """Cheapest way to fund ``amount`` from rate-sorted ``lenders``.
+
+    Filling in rate order is optimal for a fixed set of capped lenders, so
+    this is the exact minimum-cost allocation for the set it is given.
+    """
+    remaining = amount
+    cost = 0.0
+    used: List[Dict] = []
+    for lender in lenders:
+        if lender["id"] in excluded:
+            continue
+        contribution = min(lender["capital"], remaining)
+        if contribution <= 0:
+            continue
+        used.append(lender)
+        cost += contribution * lender["rate"]
+        remaining -= contribution
+        if remaining <= 1e-9:
+            return cost, used
+    return None
+
+
+def _cheapest(
+    amount: float,
+    lenders: Sequence[Dict],
+    top_k: int,
+    deadline: float,
+) -> List[Combination]:
+    results: List[Combination] = []
+    first = _greedy_fill(amount, lenders)
+    if first is None:
+        return results
+    counter = itertools.count()
+    heap = [(first[0], next(counter), frozenset(), first[1])]
+    seen_sets = set()
+    seen_exclusions = {frozenset()}
+    while heap and len(results) < top_k:
+        cost, _, excluded, used = heapq.heappop(heap)
+        key = frozenset(lender["id"] for lender in used)
+        if key not in seen_sets:
+            seen_sets.add(key)
+            results.append(Combination(round(cost / amount, 4), len(used), used, "lowest_rate"))
+        if time.perf_counter() >= deadline:
+            break
+        for lender in used:
+            branch = excluded | {lender["id"]}
+            if branch in seen_exclusions:
+                continue
+            seen_exclusions.add(branch)
+            solved = _greedy_fill(amount, lenders, branch)
+            if solved is not None:
+                heapq.heappush(heap, (solved[0], next(counter), branch, solved[1]))
+    return results
+
+
+def _fewest(
+    amount: float,
+    lenders: Sequence[Dict],
+    top_k: int,
+    deadline: float,
+) -> List[Combination]:
+    capitals = sorted((lender["capital"] for lender in lenders), reverse=True)
+    # Smallest set size whose largest capitals can cover the request.
+    size = 0
+    reach = 0.0
+    prefix = [0.0]
+    for capital in capitals:
+        size += 1
+        reach += capital
+        prefix.append(reach)
+        if reach >= amount:
+            break
+    else:
+        return []
+
+    best: List[Tuple[float, int, List[Dict]]] = []  # max-heap on cost via negation
+    counter = itertools.count()
+    count = len(lenders)
+    steps = 0
+
+    def worst_cost() -> float:
+        return -best[0][0] if len(best) >= top_k else float("inf")
+
+    def search(start: int, chosen: List[Dict], capital: float, cost: float, remaining: float) -> bool:
+        nonlocal steps
+        if len(chosen) == size:
+            if remaining <= 1e-9:
+                entry = (-cost, next(counter), list(chosen))
+                if len(best) < top_k:
+                    heapq.heappush(best, entry)
+                elif cost < worst_cost():
+                    heapq.heapreplace(best, entry)
+            return True
+        slots = size - len(chosen)
+        if capital + prefix[slots] < amount:
+            return True
+        for index in range(start, count - slots + 1):
+            steps += 1
+            if steps & 0xFF == 0 and time.perf_counter() >= deadline:
+                return False
+            lender = lenders[index]
+            # Lenders are in rate order, so no later pick can beat this rate.
+            if cost + remaining * lender["rate"] >= worst_cost():
+                break
+            if capital + lender["capital"] + prefix[slots - 1] < amount:
+                # Even the biggest remaining lenders can't close the gap with this one.
+                continue
+            contribution = min(lender["capital"], remaining)
+            chosen.append(lender)
+            finished = search(
+                index + 1,
+                chosen,
+                capital + lender["capital"],
+                cost + contribution * lender["rate"],
+                remaining - contribution,
+            )
+            chosen.pop()
+            if not finished:
+                return False
+        return True
+
+    search(0, [], 0.0, 0.0, amount)
+    ordered = sorted(best, key=lambda item: -item[0])
+    return [
+        Combination(round(-neg_cost / amount, 4), len(used), used, "fewest_lenders")
+        for neg_cost, _, used in ordered
+    ]
+
+
+def best_combinations(
+    amount: float,
+    lenders: Sequence[Dict],
+    top_k: int = 3,
+    time_budget_ms: float = 25.0,
+) -> List[Combination]:
+    """Top-K lender sets by blended APR and by lender count, deduplicated.
+
+    ``lenders`` must be sorted by rate ascending. The lowest-rate options come
+    first, followed by any fewest-lender options not already listed.
+    """
+    if amount <= 0 or not lenders:
+        return []
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    # Split the budget so the second search always gets a turn.
+    cheapest_deadline = time.perf_counter() + time_budget_ms / 2000
+    combos = _cheapest(amount, lenders, top_k, cheapest_deadline)
+    seen = {combo.key for combo in combos}
+    for combo in _fewest(amount, lenders, top_k, deadline):
+        if combo.key not in seen:
+            seen.add(combo.key)
+            combos.append(combo)
+    return combos
+
+
+@dataclass
+class BatchFill:
+    user_id: str
+    amount: float
+    allocations: List[Tuple[Dict, float]]
+
+
+def clear_batch(
+    borrowers: Sequence[Tuple[str, float]],
+    lenders: Sequence[Dict],
+) -> Tuple[List[BatchFill], List[str], Dict[str, float]]:
+    """Clear many borrowers against one rate-sorted lender book in one pass.
+
+    Borrowers are filled in the order given, each entirely or not at all,
+    always from the cheapest capital still available. Capital is tracked in
+    integer cents and decremented as it is promised, so no two borrowers are
+    ever allocated the same dollars. Runs in O(borrowers + lenders).
+
+    Returns the fills, the ids left unmatched, and the remaining capital of
+    every lender that was drawn on.
+    """
+    remaining = [int(round(lender["capital"] * 100)) for lender in lenders]
+    available = sum(remaining)
+    position = 0
+    fills: List[BatchFill] = []
+    unmatched: List[str] = []
+    touched: Dict[int, None] = {}
+    for user_id, amount in borrowers:
+        need = int(round(amount * 100))
+        if need <= 0 or need > available:
+            unmatched.append(user_id)
+            continue
+        allocations: List[Tuple[Dict, float]] = []
+        while need > 0:
+            take = min(remaining[position], need)
+            if take > 0:
+                allocations.append((lenders[position], take / 100))
+                remaining[position] -= take
+                need -= take
+                available -= take
+                touched[position] = None
+            if remaining[position] == 0:
+                position += 1
+        fills.append(BatchFill(user_id, amount, allocations))
+    balances = {lenders[index]["id"]: remaining[index] / 100 for index in touched}
+    return fills, unmatched, balances
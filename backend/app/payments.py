@@ -0,0 +1,390 @@
+"""Collect due installments in the background.
+
+Usage (from ``backend/``)::
+
+    python -m app.payments [--batch-size 2000]
+
+An installment is due once its loan's ``loan_schedules.next_due_date`` has
+passed; the ``(status, next_due_date, match_id)`` index finds due loans
+without touching the rest. Each due installment is collected with a Nessie
+transfer (mocked) and recorded in ``payment_schedules`` under its
+installment index:
+
+* ``paid`` - the transfer went through; the schedule advances and the
+  lenders' outstanding principal drops by their share of the principal part;
+* ``late`` - the transfer failed within ``PAYMENT_GRACE_DAYS`` of the due
+  date; the schedule stays put and the next pass retries it;
+* ``missed`` - the transfer failed after the grace period; the schedule
+  moves on and the row records the arrears.
+
+A loan whose last installment settles is ``closed``.
+
+A pass fixes a cutoff time and walks due loans in ``(next_due_date,
+match_id)`` order, thousands per transaction. The position reached is
+written to ``processor_checkpoints`` in the same transaction as the
+installments, so a restarted process resumes mid-pass without settling
+anything twice. Each transfer carries the reference
+``<match_id>:<installment>``, which Nessie treats as an idempotency key, so
+an installment collected by a batch that crashed before committing is not
+charged again when the batch is retried. Borrower dashboards are refreshed with each batch and
+lender dashboards once the pass ends. The app runs a pass every
+``PAYMENT_PROCESSOR_INTERVAL_SECONDS``; one pass runs at a time per process,
+so a pass requested through ``POST /system/payments/process`` while the
+background pass is running is refused rather than run alongside it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import string
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import dashboards, database, schedules
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_PROCESSOR_ENABLED = os.getenv("PAYMENT_PROCESSOR_ENABLED", "1") == "1"
+PAYMENT_PROCESSOR_INTERVAL_SECONDS = float(os.getenv("PAYMENT_PROCESSOR_INTERVAL_SECONDS", "60"))
+PAYMENT_PROCESSOR_BATCH_SIZE = int(os.getenv("PAYMENT_PROCESSOR_BATCH_SIZE", "2000"))
+PAYMENT_GRACE_DAYS = float(os.getenv("PAYMENT_GRACE_DAYS", "7"))
+
+CHECKPOINT = "due_payments"
+
+_task: Optional[asyncio.Task] = None
+_last_report: Optional[Dict[str, Any]] = None
+_pass_lock = threading.Lock()
+
+
+class TransferFailed(Exception):
+    """Nessie could not collect an installment from the borrower."""
+
+
+class PassInProgress(Exception):
+    """Another pass over the due installments is already running."""
+
+
+def transfer(match_id: str, installment: int, amount: float, reference: str) -> str:
+    """Collect ``amount`` for installment ``installment`` of ``match_id``; returns the transfer id.
+
+    Nessie is mocked, so every transfer succeeds; a real client passes
+    ``reference`` as the request's idempotency key so a retried installment
+    is not collected twice.
+    """
+    return f"txn_{''.join(random.choices(string.ascii_lowercase + string.digits, k=8))}"
+
+
+def _checkpoint(tx: database.Transaction, now: datetime) -> Tuple[str, str, str]:
+    """``(cutoff, last_due, last_match_id)`` of the pass in progress, starting one if needed."""
+    row = tx.fetchone(
+        "SELECT cutoff, last_due, last_match_id FROM processor_checkpoints WHERE name = ?",
+        (CHECKPOINT,),
+    )
+    if row is None or row["cutoff"] is None:
+        return now.isoformat(), "", ""
+    return row["cutoff"], row["last_due"], row["last_match_id"]
+
+
+def _save_checkpoint(tx: database.Transaction, cutoff: Optional[str], last_due: str, last_match_id: str) -> None:
+    tx.execute(
+        """
+        INSERT INTO processor_checkpoints (name, cutoff, last_due, last_match_id, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            cutoff = excluded.cutoff,
+            last_due = excluded.last_due,
+            last_match_id = excluded.last_match_id,
+            updated_at = excluded.updated_at
+        """,
+        (CHECKPOINT, cutoff, last_due, last_match_id, datetime.utcnow().isoformat()),
+    )
+
+
+def _collect(row, cutoff: str, now: datetime, report: Dict[str, Any]) -> Tuple[int, float, List[Tuple]]:
+    """Collect ``row``'s installments due by ``cutoff``.
+
+    Returns the new ``paid_through``, the principal paid and the
+    ``payment_schedules`` rows to write.
+    """
+    schedule = schedules.Schedule(
+        row["principal"],
+        row["apr"],
+        row["frequency"],
+        row["installments"],
+        row["first_due"],
+        row["payment"],
+        row["final_payment"],
+    )
+    grace = timedelta(days=PAYMENT_GRACE_DAYS)
+    settled_at = now.isoformat()
+    index = row["paid_through"]
+    principal_paid = 0.0
+    records: List[Tuple] = []
+    while index < schedule.installments:
+        due = schedules.installment(schedule, index)
+        if due.due_date > cutoff:
+            break
+        number = row["base_index"] + index
+        try:
+            txn_id: Optional[str] = transfer(row["match_id"], number, due.amount, f"{row['match_id']}:{number}")
+        except TransferFailed as exc:
+            txn_id = None
+            status = "missed" if now - datetime.fromisoformat(due.due_date) >= grace else "late"
+            logger.info("Installment %s of %s is %s: %s", number, row["match_id"], status, exc)
+        else:
+            status = "paid"
+            principal_paid += due.principal
+            report["amount_collected"] += due.amount
+        report[f"installments_{status}"] += 1
+        records.append(
+            (
+                row["user_id"],
+                row["match_id"],
+                number,
+                due.due_date,
+                due.amount,
+                due.principal,
+                due.interest,
+                status,
+                txn_id,
+                settled_at if status != "late" else None,
+            )
+        )
+        if status == "late":
+            break
+        index += 1
+    return index, round(principal_paid, 2), records
+
+
+def _process_batch(batch_size: int, report: Dict[str, Any]) -> Tuple[str, bool]:
+    """Collect the next ``batch_size`` due loans of the current pass.
+
+    Returns the pass cutoff and whether any due loans were left.
+    """
+    now = datetime.utcnow()
+    with database.transaction() as tx:
+        cutoff, last_due, last_match = _checkpoint(tx, now)
+        # CROSS JOIN keeps the due-date index walk as the outer loop.
+        rows = tx.fetchall(
+            """
+            SELECT s.*, m.total_amount
+            FROM loan_schedules s
+            CROSS JOIN matches m ON m.id = s.match_id
+            WHERE s.status = 'active'
+              AND (s.next_due_date, s.match_id) > (?, ?)
+              AND s.next_due_date <= ?
+            ORDER BY s.next_due_date, s.match_id
+            LIMIT ?
+            """,
+            (last_due, last_match, cutoff, batch_size),
+        )
+        if not rows:
+            return cutoff, False
+
+        records: List[Tuple] = []
+        advanced: List[Tuple] = []
+        repaid: List[Tuple] = []
+        closed: List[str] = []
+        borrowers: List[str] = []
+        for row in rows:
+            paid_through, principal_paid, collected = _collect(row, cutoff, now, report)
+            records.extend(collected)
+            if paid_through == row["paid_through"]:
+                continue
+            if paid_through >= row["installments"]:
+                next_due, status = None, "closed"
+                closed.append(row["match_id"])
+            else:
+                next_due, status = schedules.due_date(row["first_due"], paid_through, row["frequency"]), "active"
+            advanced.append((paid_through, next_due, status, now.isoformat(), row["match_id"]))
+            if principal_paid:
+                repaid.append((principal_paid, row["total_amount"], row["match_id"]))
+            borrowers.append(row["user_id"])
+
+        tx.executemany(
+            """
+            INSERT INTO payment_schedules (
+                user_id, match_id, installment, due_date, amount, principal, interest, status, txn_id, settled_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(match_id, installment) DO UPDATE SET
+                status = excluded.status,
+                txn_id = excluded.txn_id,
+                settled_at = excluded.settled_at
+            WHERE payment_schedules.status = 'late'
+            """,
+            records,
+        )
+        tx.executemany(
+            """
+            UPDATE loan_schedules
+            SET paid_through = ?, next_due_date = ?, status = ?, updated_at = ?
+            WHERE match_id = ?
+            """,
+            advanced,
+        )
+        tx.executemany(
+            """
+            UPDATE match_allocations
+            SET outstanding = max(round(outstanding - ? * amount / ?, 2), 0)
+            WHERE match_id = ?
+            """,
+            repaid,
+        )
+        # Rounding can leave cents on a loan repaid in full.
+        tx.executemany(
+            """
+            UPDATE match_allocations SET outstanding = 0
+            WHERE match_id = ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM payment_schedules p
+                  WHERE p.match_id = match_allocations.match_id AND p.status = 'missed'
+              )
+            """,
+            [(match_id,) for match_id in closed],
+        )
+        report["dashboards_refreshed"] += dashboards.refresh(tx, borrowers)
+        report["loans"] += len(rows)
+        report["loans_closed"] += len(closed)
+        _save_checkpoint(tx, cutoff, rows[-1]["next_due_date"], rows[-1]["match_id"])
+    return cutoff, True
+
+
+def _finish_pass(cutoff: str, batch_size: int, report: Dict[str, Any]) -> None:
+    """Refresh the lenders of every loan the pass advanced, then close the pass.
+
+    A lender funds many loans and their refresh reads all of them, so it is
+    done once per pass rather than once per batch. The loans are found by
+    the ``updated_at`` index, which also covers batches committed before a
+    restart.
+    The checkpoint is only written by a batch that found due loans, so an
+    idle pass skips the scan.
+    """
+    checkpoint = database.fetchone("SELECT cutoff FROM processor_checkpoints WHERE name = ?", (CHECKPOINT,))
+    if checkpoint is None or checkpoint["cutoff"] is None:
+        return
+    lenders = [
+        row["lender_id"]
+        for row in database.fetchall(
+            """
+            SELECT DISTINCT a.lender_id
+            FROM loan_schedules s
+            CROSS JOIN match_allocations a ON a.match_id = s.match_id
+            WHERE s.updated_at >= ?
+            """,
+            (cutoff,),
+        )
+    ]
+    for start in range(0, len(lenders), batch_size):
+        with database.transaction() as tx:
+            report["dashboards_refreshed"] += dashboards.refresh(tx, lenders[start : start + batch_size])
+    with database.transaction() as tx:
+        _save_checkpoint(tx, None, "", "")
+
+
+def _new_report() -> Dict[str, Any]:
+    return {
+        "loans": 0,
+        "installments_paid": 0,
+        "installments_late": 0,
+        "installments_missed": 0,
+        "loans_closed": 0,
+        "amount_collected": 0.0,
+        "dashboards_refreshed": 0,
+    }
+
+
+def process_due(batch_size: int = PAYMENT_PROCESSOR_BATCH_SIZE) -> Dict[str, Any]:
+    """Run one pass over the installments due now, resuming an interrupted pass first.
+
+    Raises ``PassInProgress`` if a pass is already running in this process.
+    """
+    if not _pass_lock.acquire(blocking=False):
+        raise PassInProgress("A payment pass is already running.")
+    try:
+        return _process_due(batch_size)
+    finally:
+        _pass_lock.release()
+
+
+def _process_due(batch_size: int) -> Dict[str, Any]:
+    global _last_report
+    report = _new_report()
+    started = time.perf_counter()
+    while True:
+        cutoff, more = _process_batch(batch_size, report)
+        if not more:
+            break
+    _finish_pass(cutoff, batch_size, report)
+    report["amount_collected"] = round(report["amount_collected"], 2)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["finished_at"] = datetime.utcnow().isoformat()
+    _last_report = report
+    return report
+
+
+async def _run_forever() -> None:
+    while True:
+        try:
+            report = await asyncio.to_thread(process_due)
+            if report["loans"]:
+                logger.info("Payment pass: %s", report)
+        except PassInProgress:
+            logger.debug("Skipping the payment pass; one requested manually is still running.")
+        except Exception:  # noqa: BLE001 - retry on the next tick
+            logger.exception("Payment pass failed")
+        await asyncio.sleep(PAYMENT_PROCESSOR_INTERVAL_SECONDS)
+
+
+async def start() -> None:
+    global _task
+    if _task is not None or not PAYMENT_PROCESSOR_ENABLED:
+        return
+    _task = asyncio.create_task(_run_forever(), name="payment-processor")
+    logger.info("Started the payment processor (every %ss).", PAYMENT_PROCESSOR_INTERVAL_SECONDS)
+
+
+async def stop() -> None:
+    """Cancel the processor; a batch already running commits with its checkpoint."""
+    global _task
+    task, _task = _task, None
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def stats() -> Dict[str, Any]:
+    checkpoint = database.fetchone(
+        "SELECT cutoff, last_due, last_match_id, updated_at FROM processor_checkpoints WHERE name = ?",
+        (CHECKPOINT,),
+    )
+    due = database.fetchone(
+        "SELECT COUNT(*) AS total FROM loan_schedules WHERE status = 'active' AND next_due_date <= ?",
+        (datetime.utcnow().isoformat(),),
+    )
+    return {
+        "running": _task is not None,
+        "interval_seconds": PAYMENT_PROCESSOR_INTERVAL_SECONDS,
+        "loans_due": due["total"],
+        "checkpoint": dict(checkpoint) if checkpoint else None,
+        "last_pass": _last_report,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Collect installments that are due now.")
+    parser.add_argument("--batch-size", type=int, default=PAYMENT_PROCESSOR_BATCH_SIZE)
+    args = parser.parse_args()
+    database.init_db()
+    print(json.dumps(process_due(args.batch_size)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Lender portfolios built from ``match_allocations``.
+
+Every match writes one allocation row per lender leg (lender user id,
+amount, rate and outstanding principal), so portfolio figures are aggregate
+queries over a lender's own rows instead of a scan of
+``matches.lenders_json``. The ``(lender_id, outstanding, rate, amount)``
+index covers the totals, which are answered from the index alone.
+
+Inflows are the lender's pro-rata share of each installment still due on
+the matches they funded, derived from the match's compact ``loan_schedules``
+row: only installments inside the requested window are expanded.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import database, schedules
+
+PORTFOLIO_HORIZON_DAYS = 90
+
+
+def record(
+    tx: database.Transaction,
+    legs: Iterable[Tuple[str, str, float, float]],
+    created_at: Optional[str] = None,
+) -> None:
+    """Persist ``(match_id, lender_id, amount, rate)`` legs, any number of matches at once."""
+    created_at = created_at or datetime.utcnow().isoformat()
+    tx.executemany(
+        """
+        INSERT INTO match_allocations (match_id, lender_id, amount, rate, outstanding, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(match_id, lender_id) DO UPDATE SET
+            amount = round(amount + excluded.amount, 2),
+            outstanding = round(outstanding + excluded.outstanding, 2)
+        """,
+        [
+            (match_id, lender_id, round(amount, 2), rate, round(amount, 2), created_at)
+            for match_id, lender_id, amount, rate in legs
+        ],
+    )
+
+
+def _placeholders(ids: List[str]) -> str:
+    return ", ".join("?" for _ in ids)
+
+
+def totals(lender_ids: List[str]) -> Dict[str, Dict[str, float]]:
+    """Loans funded, principal lent, outstanding and yield per lender."""
+    rows = database.fetchall(
+        f"""
+        SELECT
+            lender_id,
+            COUNT(*) AS loans,
+            SUM(amount) AS principal,
+            SUM(outstanding) AS outstanding,
+            SUM(outstanding * rate) / 100.0 AS yield_year
+        FROM match_allocations
+        WHERE lender_id IN ({_placeholders(lender_ids)})
+        GROUP BY lender_id
+        """,
+        lender_ids,
+    )
+    return {
+        row["lender_id"]: {
+            "loans": row["loans"],
+            "principal": round(row["principal"], 2),
+            "outstanding": round(row["outstanding"], 2),
+            "expected_yield_year": round(row["yield_year"], 2),
+        }
+        for row in rows
+    }
+
+
+# CROSS JOIN keeps the lender's allocation rows as the outer loop: with a
+# long IN list SQLite otherwise prefers walking every active schedule.
+_SCHEDULED_SHARES = """
+    SELECT
+        a.lender_id, a.amount / m.total_amount AS share,
+        s.frequency, s.installments, s.first_due, s.payment, s.final_payment, s.paid_through, s.next_due_date
+    FROM match_allocations a
+    CROSS JOIN loan_schedules s ON s.match_id = a.match_id AND s.status = 'active'
+    CROSS JOIN matches m ON m.id = a.match_id
+    WHERE a.lender_id IN ({ids}) AND a.outstanding > 0
+"""
+
+
+def _due_before(row, end: str) -> Iterator[Tuple[str, float]]:
+    """``(due_date, lender share)`` of the row's unsettled installments due before ``end``."""
+    for index in range(row["paid_through"], row["installments"]):
+        due = schedules.due_date(row["first_due"], index, row["frequency"])
+        if due >= end:
+            return
+        amount = schedules.installment_amount(row["payment"], row["final_payment"], row["installments"], index)
+        yield due, amount * row["share"]
+
+
+def next_inflows(lender_ids: List[str], now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+    """Earliest pending inflow and what is due within one installment cycle."""
+    now = now or datetime.utcnow()
+    cycle_end = now + schedules.INSTALLMENT_INTERVAL
+    inflows: Dict[str, Dict[str, Any]] = {}
+    for row in database.fetchall(_SCHEDULED_SHARES.format(ids=_placeholders(lender_ids)), lender_ids):
+        entry = inflows.setdefault(row["lender_id"], {"next_due": None, "cycle": 0.0})
+        next_due = row["next_due_date"]
+        if next_due is not None and (entry["next_due"] is None or next_due < entry["next_due"]):
+            entry["next_due"] = next_due
+        # Installments paid_through..upto fall in the cycle; level payments make that a difference of totals.
+        installments, paid_through = row["installments"], row["paid_through"]
+        upto = min(installments, schedules.due_count(row["first_due"], row["frequency"], cycle_end))
+        if upto > paid_through:
+            payment, final_payment = row["payment"], row["final_payment"]
+            due = schedules.remaining_due(payment, final_payment, installments, paid_through) - schedules.remaining_due(
+                payment, final_payment, installments, upto
+            )
+            entry["cycle"] += due * row["share"]
+    for entry in inflows.values():
+        entry["cycle"] = round(entry["cycle"], 2)
+    return inflows
+
+
+def portfolio(
+    lender_id: str,
+    horizon_days: int = PORTFOLIO_HORIZON_DAYS,
+    recent: int = 20,
+) -> Dict[str, Any]:
+    """Totals, upcoming inflows by due date and the latest allocations."""
+    summary = totals([lender_id]).get(
+        lender_id,
+        {"loans": 0, "principal": 0.0, "outstanding": 0.0, "expected_yield_year": 0.0},
+    )
+    outstanding = summary["outstanding"]
+    summary["weighted_rate"] = (
+        round(summary["expected_yield_year"] * 100 / outstanding, 2) if outstanding else None
+    )
+    horizon_end = (datetime.utcnow() + timedelta(days=horizon_days)).isoformat()
+    by_date: Dict[str, float] = {}
+    for row in database.fetchall(_SCHEDULED_SHARES.format(ids="?"), (lender_id,)):
+        for due, amount in _due_before(row, horizon_end):
+            by_date[due[:10]] = by_date.get(due[:10], 0.0) + amount
+    inflows = sorted(by_date.items())
+    allocations = database.fetchall(
+        """
+        SELECT match_id, amount, rate, outstanding, created_at
+        FROM match_allocations
+        WHERE lender_id = ?
+        ORDER BY created_at DESC
+        LIMIT ?
+        """,
+        (lender_id, recent),
+    )
+    return {
+        **summary,
+        "horizon_days": horizon_days,
+        "inflows": [{"due_date": due, "amount": round(amount, 2)} for due, amount in inflows],
+        "upcoming_inflows": round(sum(amount for _, amount in inflows), 2),
+        "recent_allocations": [dict(row) for row in allocations],
+    }
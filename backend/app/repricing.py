@@ -0,0 +1,141 @@
+"""Reprice active payment schedules after a rate-policy change.
+
+Usage (from ``backend/``)::
+
+    python -m app.repricing [--batch-size 2000] [--dry-run]
+
+Re-amortizes the outstanding principal of every active schedule at the
+current policy (``schedules.loan_apr`` over the match's blended allocation
+rate), keeping the next due date and the installments left. The compact
+``loan_schedules`` row is rebased in place: settled installments move into
+``base_index`` and the remainder becomes a fresh level schedule. Matches
+whose APR is unchanged are skipped, and the affected borrower and lender
+dashboards are refreshed in the same transaction.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from . import dashboards, database, schedules
+
+SCHEDULE_REPRICE_BATCH_SIZE = int(os.getenv("SCHEDULE_REPRICE_BATCH_SIZE", "2000"))
+
+
+def _rebase(row, apr: float) -> Tuple:
+    """Update parameters re-amortizing ``row``'s unsettled installments at ``apr``."""
+    paid_through = row["paid_through"]
+    left = row["installments"] - paid_through
+    outstanding = schedules.principal_outstanding(
+        row["principal"], row["apr"], row["installments"], row["frequency"], paid_through
+    )
+    first_due = row["next_due_date"] or schedules.due_date(row["first_due"], paid_through, row["frequency"])
+    schedule = schedules.compact(
+        outstanding, apr, datetime.fromisoformat(first_due), schedules.Terms(left, row["frequency"])
+    )
+    return (
+        schedule.principal,
+        apr,
+        schedule.installments,
+        schedule.first_due,
+        schedule.payment,
+        schedule.final_payment,
+        paid_through,
+        schedule.first_due,
+    )
+
+
+def _reprice_batch(after: str, batch_size: int, report: Dict[str, Any], dry_run: bool) -> str:
+    """Reprice the next ``batch_size`` active schedules; returns the last match id seen."""
+    # Read inside the write transaction so a payment settled meanwhile is never overwritten.
+    # ``+s.status`` keeps the keyset walk on the primary key instead of
+    # re-reading every active schedule through the status index each batch.
+    with database.transaction() as tx:
+        rows = tx.fetchall(
+            """
+            SELECT s.*, SUM(a.amount * a.rate) / SUM(a.amount) AS rate
+            FROM loan_schedules s
+            LEFT JOIN match_allocations a ON a.match_id = s.match_id
+            WHERE s.match_id > ? AND +s.status = 'active'
+            GROUP BY s.match_id
+            ORDER BY s.match_id
+            LIMIT ?
+            """,
+            (after, batch_size),
+        )
+        if not rows:
+            return ""
+        updates: List[Tuple] = []
+        borrowers: List[str] = []
+        now = datetime.utcnow().isoformat()
+        for row in rows:
+            apr = schedules.loan_apr(row["rate"] or 0.0)
+            if apr == row["apr"] or row["paid_through"] >= row["installments"]:
+                continue
+            updates.append((*_rebase(row, apr), now, row["match_id"]))
+            borrowers.append(row["user_id"])
+        report["schedules"] += len(rows)
+        report["schedules_repriced"] += len(updates)
+        if dry_run or not updates:
+            return rows[-1]["match_id"]
+
+        tx.executemany(
+            """
+            UPDATE loan_schedules
+            SET principal = ?, apr = ?, installments = ?, first_due = ?, payment = ?, final_payment = ?,
+                base_index = base_index + ?, paid_through = 0, next_due_date = ?, updated_at = ?
+            WHERE match_id = ?
+            """,
+            updates,
+        )
+        match_ids = [update[-1] for update in updates]
+        tx.executemany("UPDATE matches SET apr = ? WHERE id = ?", [(update[1], update[-1]) for update in updates])
+        lenders = tx.fetchall(
+            f"SELECT DISTINCT lender_id FROM match_allocations WHERE match_id IN ({', '.join('?' for _ in match_ids)})",
+            match_ids,
+        )
+        report["dashboards_refreshed"] += dashboards.refresh(
+            tx, [*borrowers, *(row["lender_id"] for row in lenders)]
+        )
+    return rows[-1]["match_id"]
+
+
+def reprice(batch_size: int = SCHEDULE_REPRICE_BATCH_SIZE, dry_run: bool = False) -> Dict[str, Any]:
+    """Re-amortize every active schedule at the current rate policy.
+
+    Walks schedules in ``match_id`` order, one batch per transaction, so the
+    write lock is held briefly and memory stays bounded however many loans
+    are active.
+    """
+    report: Dict[str, Any] = {
+        "schedules": 0,
+        "schedules_repriced": 0,
+        "dashboards_refreshed": 0,
+    }
+    started = time.perf_counter()
+    last_match = ""
+    while True:
+        last_match = _reprice_batch(last_match, batch_size, report, dry_run)
+        if not last_match:
+            break
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["dry_run"] = dry_run
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-amortize active schedules at the current rate policy.")
+    parser.add_argument("--batch-size", type=int, default=SCHEDULE_REPRICE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing.")
+    args = parser.parse_args()
+    database.init_db()
+    print(json.dumps(reprice(args.batch_size, args.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Amortized repayment schedules for borrowers.
+
+A loan is repaid in equal installments that include interest at the match's
+APR: the lenders' rates blended by amount, capped by ``LOAN_APR_CAP``. Each
+installment charges interest on the balance still owed and the rest of the
+payment retires principal. The last installment absorbs rounding, so the
+principal parts always sum to the amount borrowed. At an APR of zero this is
+the plain equal split.
+
+Terms (number of installments and frequency) default to ``LOAN_INSTALLMENTS``
+and ``LOAN_FREQUENCY``; matches store the terms and APR they were written
+with.
+
+Schedules are stored compactly, one ``loan_schedules`` row per loan: the
+``Schedule`` parameters plus how many installments are settled
+(``paid_through``). Every installment is level except the last, so the next
+due date and amount and the balance left are arithmetic on that row, with no
+per-installment rows to sort or sum. ``payment_schedules`` only holds
+installments that were paid, missed or adjusted.
+
+``bulk`` builds schedules for many loans that share a start date and terms;
+each distinct (amount, APR) split is computed once, so a loan mostly costs a
+cache hit and the caller writes every row with one ``executemany``.
+
+``repricing`` re-amortizes active schedules when the rate policy changes.
+"""
+
+from __future__ import annotations
+
+import calendar
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+FREQUENCIES: Dict[str, int] = {"weekly": 52, "biweekly": 26, "four_weekly": 13, "monthly": 12}
+_WEEKS = {"weekly": 1, "biweekly": 2, "four_weekly": 4}
+
+LOAN_INSTALLMENTS = int(os.getenv("LOAN_INSTALLMENTS", "12"))
+LOAN_FREQUENCY = os.getenv("LOAN_FREQUENCY", "four_weekly")
+LOAN_APR_CAP = float(os.getenv("LOAN_APR_CAP", "36"))
+
+if LOAN_FREQUENCY not in FREQUENCIES:
+    raise ValueError(f"LOAN_FREQUENCY must be one of {', '.join(FREQUENCIES)}")
+
+
+class Terms(NamedTuple):
+    installments: int = LOAN_INSTALLMENTS
+    frequency: str = LOAN_FREQUENCY
+
+
+class Installment(NamedTuple):
+    due_date: str
+    amount: float
+    principal: float
+    interest: float
+
+
+class Schedule(NamedTuple):
+    """Compact form of an amortized loan; installments are derived from it."""
+
+    principal: float
+    apr: float
+    frequency: str
+    installments: int
+    first_due: str
+    payment: float
+    final_payment: float
+
+
+DEFAULT_TERMS = Terms()
+
+
+def interval(frequency: str) -> timedelta:
+    """Nominal length of one period; months are averaged."""
+    weeks = _WEEKS.get(frequency)
+    return timedelta(weeks=weeks) if weeks else timedelta(days=365.25 / FREQUENCIES[frequency])
+
+
+INSTALLMENT_INTERVAL = interval(LOAN_FREQUENCY)
+
+
+def _add_months(start: datetime, months: int) -> datetime:
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+    return start.replace(year=year, month=month, day=day)
+
+
+def first_due_date(frequency: str, start: Optional[datetime] = None) -> datetime:
+    start = start or datetime.utcnow()
+    weeks = _WEEKS.get(frequency)
+    return start + timedelta(weeks=weeks) if weeks else _add_months(start, 1)
+
+
+def due_date(first_due: str, index: int, frequency: str) -> str:
+    """Due date of installment ``index`` (0-based) of a schedule."""
+    start = datetime.fromisoformat(first_due)
+    weeks = _WEEKS.get(frequency)
+    if weeks is None:
+        return _add_months(start, index).isoformat()
+    return (start + timedelta(weeks=weeks * index)).isoformat()
+
+
+def due_count(first_due: str, frequency: str, before: datetime) -> int:
+    """How many installments of a schedule starting at ``first_due`` fall due before ``before``."""
+    start = datetime.fromisoformat(first_due)
+    if before <= start:
+        return 0
+    weeks = _WEEKS.get(frequency)
+    if weeks is not None:
+        return -((start - before) // timedelta(weeks=weeks))
+    count = (before.year - start.year) * 12 + before.month - start.month + 1
+    while count > 0 and _add_months(start, count - 1) >= before:
+        count -= 1
+    return count
+
+
+def loan_apr(blended_rate: float) -> float:
+    """Rate policy: the lenders' blended rate, capped."""
+    return round(min(max(blended_rate, 0.0), LOAN_APR_CAP), 4)
+
+
+@lru_cache(maxsize=1024)
+def _factors(apr: float, installments: int, frequency: str) -> Tuple[float, float]:
+    """Per-period rate and the level payment per unit of principal."""
+    rate = apr / 100.0 / FREQUENCIES[frequency]
+    if rate <= 0:
+        return 0.0, 1.0 / installments
+    return rate, rate / (1.0 - (1.0 + rate) ** -installments)
+
+
+@lru_cache(maxsize=65536)
+def split(principal: float, apr: float, count: int, frequency: str) -> Tuple[Tuple[float, float, float], ...]:
+    """``(amount, principal, interest)`` per installment, to the cent.
+
+    Cached: loan amounts and blended rates repeat, so a batch computes each
+    distinct split once.
+    """
+    rate, payment_factor = _factors(apr, count, frequency)
+    payment = round(principal * payment_factor, 2)
+    balance = round(principal, 2)
+    last = count - 1
+    parts = []
+    for index in range(count):
+        interest = round(balance * rate, 2)
+        if index == last:
+            retired = balance
+        else:
+            retired = min(balance, round(payment - interest, 2))
+        balance = round(balance - retired, 2)
+        parts.append((round(retired + interest, 2), retired, interest))
+    return tuple(parts)
+
+
+@lru_cache(maxsize=65536)
+def _level(principal: float, apr: float, count: int, frequency: str) -> Tuple[int, float, float]:
+    """``(installments, payment, final_payment)`` of a level schedule."""
+    # Only a loan of a few cents can round into uneven installments; fewer
+    # installments keep it level.
+    while True:
+        parts = split(principal, apr, count, frequency)
+        payment = parts[0][0]
+        if count == 1 or (parts[-1][0] > 0 and all(amount == payment for amount, _, _ in parts[:-1])):
+            return count, payment, parts[-1][0]
+        count -= 1
+
+
+@lru_cache(maxsize=65536)
+def _retired_before(principal: float, apr: float, count: int, frequency: str) -> Tuple[float, ...]:
+    """Principal repaid before each installment index (and after the last)."""
+    retired = [0.0]
+    for _, part, _ in split(principal, apr, count, frequency):
+        retired.append(round(retired[-1] + part, 2))
+    return tuple(retired)
+
+
+def compact(
+    principal: float,
+    apr: float = 0.0,
+    first_due: Optional[datetime] = None,
+    terms: Terms = DEFAULT_TERMS,
+) -> Optional[Schedule]:
+    """The ``Schedule`` repaying ``principal`` at ``apr`` percent a year."""
+    principal = round(principal, 2)
+    if principal <= 0 or terms.installments <= 0:
+        return None
+    first_due = (first_due or first_due_date(terms.frequency)).replace(microsecond=0)
+    count, payment, final_payment = _level(principal, apr, terms.installments, terms.frequency)
+    return Schedule(principal, apr, terms.frequency, count, first_due.isoformat(), payment, final_payment)
+
+
+def installment_amount(payment: float, final_payment: float, installments: int, index: int) -> float:
+    if index >= installments:
+        return 0.0
+    return final_payment if index == installments - 1 else payment
+
+
+def remaining_due(payment: float, final_payment: float, installments: int, paid_through: int) -> float:
+    """Total still to pay once ``paid_through`` installments are settled."""
+    left = installments - paid_through
+    if left <= 0:
+        return 0.0
+    return round(payment * (left - 1) + final_payment, 2)
+
+
+def principal_outstanding(principal: float, apr: float, installments: int, frequency: str, paid_through: int) -> float:
+    retired = _retired_before(principal, apr, installments, frequency)
+    return round(principal - retired[min(paid_through, installments)], 2)
+
+
+def installment(schedule: Schedule, index: int) -> Installment:
+    """Installment ``index`` (0-based) of ``schedule``."""
+    parts = split(schedule.principal, schedule.apr, schedule.installments, schedule.frequency)
+    return Installment(due_date(schedule.first_due, index, schedule.frequency), *parts[index])
+
+
+def expand(schedule: Optional[Schedule]) -> List[Installment]:
+    """Every installment of ``schedule``."""
+    if schedule is None:
+        return []
+    return [installment(schedule, index) for index in range(schedule.installments)]
+
+
+def amortize(
+    principal: float,
+    apr: float = 0.0,
+    first_due: Optional[datetime] = None,
+    terms: Terms = DEFAULT_TERMS,
+) -> List[Installment]:
+    """The installments repaying ``principal`` at ``apr`` percent a year."""
+    return expand(compact(principal, apr, first_due, terms))
+
+
+def bulk(
+    loans: Iterable[Tuple[Hashable, float, float]],
+    first_due: Optional[datetime] = None,
+    terms: Terms = DEFAULT_TERMS,
+) -> Iterator[Tuple[Hashable, Schedule]]:
+    """``(key, schedule)`` for ``(key, principal, apr)`` loans sharing a start date."""
+    first = (first_due or first_due_date(terms.frequency)).replace(microsecond=0).isoformat()
+    installments, frequency = terms
+    for key, principal, apr in loans:
+        principal = round(principal, 2)
+        if principal <= 0:
+            continue
+        count, payment, final_payment = _level(principal, apr, installments, frequency)
+        yield key, Schedule(principal, apr, frequency, count, first, payment, final_payment)
@@ -0,0 +1,314 @@
+"""Loan disbursements through Nessie, settled in batched runs.
+
+``POST /nessie/transfer`` only records the transfer: one ``transfers`` row
+per match and one ``transfer_legs`` row per lender allocation, written in a
+single short transaction. Requests are idempotent. The key is the client's
+``Idempotency-Key`` or, by default, the match itself, and a match has at
+most one transfer, so a retry returns the original transfer instead of
+moving the money twice. A retry is answered from an indexed read without
+taking the write lock.
+
+A background settler groups queued legs into ``settlement_runs`` of up to
+``SETTLEMENT_BATCH_SIZE`` legs, nets each run per lender and submits one
+Nessie transfer per lender (mocked). Claiming a run and settling it are
+separate transactions. A claim is a lease: the run records its owner and
+claim time, so the background worker and ``POST /system/settlement/run``
+never settle the same run at once. A run left ``open`` by a crash is
+claimed again once its lease (``SETTLEMENT_LEASE_SECONDS``) lapses and
+submitted with the same per-lender references, which Nessie treats as
+duplicates. An idle check is a plain read and takes no write lock.
+
+Matches made before lender allocations were recorded have no legs to
+queue; their transfer is recorded as settled in one piece.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import string
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+SETTLEMENT_ENABLED = os.getenv("SETTLEMENT_ENABLED", "1") == "1"
+SETTLEMENT_INTERVAL_SECONDS = float(os.getenv("SETTLEMENT_INTERVAL_SECONDS", "2"))
+SETTLEMENT_BATCH_SIZE = int(os.getenv("SETTLEMENT_BATCH_SIZE", "5000"))
+SETTLEMENT_LEASE_SECONDS = float(os.getenv("SETTLEMENT_LEASE_SECONDS", "300"))
+
+_task: Optional[asyncio.Task] = None
+_last_report: Optional[Dict[str, Any]] = None
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different match."""
+
+
+class NothingToTransfer(Exception):
+    """The match has nothing to disburse."""
+
+
+def _transfer_id() -> str:
+    return f"txn_{''.join(random.choices(string.ascii_lowercase + string.digits, k=8))}"
+
+
+def _serialize(transfer, legs) -> Dict[str, Any]:
+    settled = transfer["status"] == "settled"
+    return {
+        "txn_id": transfer["id"],
+        "match_id": transfer["match_id"],
+        "amount": transfer["amount"],
+        "status": transfer["status"],
+        "legs": [{"lender_id": leg["lender_id"], "amount": leg["amount"], "status": leg["status"]} for leg in legs],
+        "created_at": transfer["created_at"],
+        "settled_at": transfer["settled_at"],
+        "message": "Funds transferred (mock)" if settled else "Transfer queued for settlement (mock)",
+    }
+
+
+def _existing(query, match_id: str, key: str) -> Optional[Dict[str, Any]]:
+    transfer = query.fetchone(
+        "SELECT * FROM transfers WHERE idempotency_key = ? OR match_id = ? ORDER BY idempotency_key = ? DESC LIMIT 1",
+        (key, match_id, key),
+    )
+    if transfer is None:
+        return None
+    if transfer["idempotency_key"] == key and transfer["match_id"] != match_id:
+        raise IdempotencyConflict(f"Idempotency key already used for match {transfer['match_id']}.")
+    legs = query.fetchall(
+        "SELECT lender_id, amount, status FROM transfer_legs WHERE transfer_id = ? ORDER BY id",
+        (transfer["id"],),
+    )
+    return _serialize(transfer, legs)
+
+
+def request_transfer(match_id: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """Queue the disbursement of ``match_id``, or return the transfer already queued for it."""
+    key = idempotency_key or f"match:{match_id}"
+    existing = _existing(database, match_id, key)
+    if existing is not None:
+        return existing
+    with database.transaction() as tx:
+        # Another request may have queued it while this one waited for the lock.
+        existing = _existing(tx, match_id, key)
+        if existing is not None:
+            return existing
+        legs = tx.fetchall(
+            "SELECT lender_id, amount FROM match_allocations WHERE match_id = ? ORDER BY lender_id",
+            (match_id,),
+        )
+        transfer_id = _transfer_id()
+        now = datetime.utcnow().isoformat()
+        if not legs:
+            _disburse_unallocated(tx, match_id, transfer_id, key, now)
+            return _existing(tx, match_id, key)
+        tx.execute(
+            "INSERT INTO transfers (id, idempotency_key, match_id, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+            (transfer_id, key, match_id, round(sum(leg["amount"] for leg in legs), 2), now),
+        )
+        tx.executemany(
+            "INSERT INTO transfer_legs (transfer_id, lender_id, amount) VALUES (?, ?, ?)",
+            [(transfer_id, leg["lender_id"], leg["amount"]) for leg in legs],
+        )
+        return _existing(tx, match_id, key)
+
+
+def _disburse_unallocated(tx: database.Transaction, match_id: str, transfer_id: str, key: str, now: str) -> None:
+    """Record a match that predates ``match_allocations`` as one settled transfer.
+
+    Its lenders aren't recorded anywhere (``lenders_json`` only has display
+    ids), so there are no legs to queue; the whole amount is disbursed at
+    once, as before transfers were batched.
+    """
+    match = tx.fetchone("SELECT total_amount FROM matches WHERE id = ?", (match_id,))
+    if match is None or not match["total_amount"]:
+        raise NothingToTransfer(f"Match {match_id} has nothing to disburse.")
+    tx.execute(
+        """
+        INSERT INTO transfers (id, idempotency_key, match_id, amount, status, created_at, settled_at)
+        VALUES (?, ?, ?, ?, 'settled', ?, ?)
+        """,
+        (transfer_id, key, match_id, round(match["total_amount"], 2), now, now),
+    )
+
+
+def get(transfer_id: str) -> Optional[Dict[str, Any]]:
+    transfer = database.fetchone("SELECT * FROM transfers WHERE id = ?", (transfer_id,))
+    if transfer is None:
+        return None
+    return _existing(database, transfer["match_id"], transfer["idempotency_key"])
+
+
+def _submit(reference: str, lender_id: str, amount: float) -> None:
+    """Send one lender's netted amount for a run to Nessie.
+
+    Nessie is mocked, so nothing is sent; a real client passes ``reference``
+    as the request's idempotency key so a resubmitted run is not paid twice.
+    """
+
+
+_ABANDONED_RUN = """
+    SELECT id FROM settlement_runs
+    WHERE status = 'open' AND (claimed_at IS NULL OR claimed_at < ?)
+    ORDER BY id LIMIT 1
+"""
+_QUEUED_LEGS = "SELECT id, amount FROM transfer_legs WHERE status = 'queued' ORDER BY id LIMIT ?"
+
+
+def _claim_run(batch_size: int, owner: str) -> Optional[int]:
+    """Lease an abandoned open run, or a new run of queued legs, to ``owner``; None when idle."""
+    now = datetime.utcnow()
+    expired = (now - timedelta(seconds=SETTLEMENT_LEASE_SECONDS)).isoformat()
+    # Most ticks find nothing; only take the write lock when there is work.
+    if database.fetchone(_ABANDONED_RUN, (expired,)) is None and not database.fetchone(_QUEUED_LEGS, (1,)):
+        return None
+    with database.transaction() as tx:
+        run = tx.fetchone(_ABANDONED_RUN, (expired,))
+        if run is not None:
+            tx.execute(
+                "UPDATE settlement_runs SET owner = ?, claimed_at = ? WHERE id = ?",
+                (owner, now.isoformat(), run["id"]),
+            )
+            return run["id"]
+        legs = tx.fetchall(_QUEUED_LEGS, (batch_size,))
+        if not legs:
+            return None
+        run_id = tx.execute(
+            "INSERT INTO settlement_runs (legs, amount, started_at, owner, claimed_at) VALUES (?, ?, ?, ?, ?)",
+            (len(legs), round(sum(leg["amount"] for leg in legs), 2), now.isoformat(), owner, now.isoformat()),
+        ).lastrowid
+        tx.executemany(
+            "UPDATE transfer_legs SET status = 'submitted', run_id = ? WHERE id = ?",
+            [(run_id, leg["id"]) for leg in legs],
+        )
+    return run_id
+
+
+def _settle_run(run_id: int, owner: str, report: Dict[str, Any]) -> None:
+    netted = database.fetchall(
+        "SELECT lender_id, SUM(amount) AS amount FROM transfer_legs WHERE run_id = ? GROUP BY lender_id",
+        (run_id,),
+    )
+    for row in netted:
+        _submit(f"run_{run_id}:{row['lender_id']}", row["lender_id"], round(row["amount"], 2))
+    now = datetime.utcnow().isoformat()
+    with database.transaction() as tx:
+        finished = tx.execute(
+            """
+            UPDATE settlement_runs SET status = 'settled', nessie_transfers = ?, finished_at = ?
+            WHERE id = ? AND status = 'open' AND owner = ?
+            """,
+            (len(netted), now, run_id, owner),
+        ).rowcount
+        if not finished:
+            # The lease lapsed and another settler took the run over; it reports the run.
+            logger.warning("Lost the lease on settlement run %s", run_id)
+            return
+        legs = tx.execute(
+            "UPDATE transfer_legs SET status = 'settled' WHERE run_id = ? AND status = 'submitted'",
+            (run_id,),
+        ).rowcount
+        transfers = tx.execute(
+            """
+            UPDATE transfers SET status = 'settled', settled_at = ?
+            WHERE id IN (SELECT transfer_id FROM transfer_legs WHERE run_id = ?)
+              AND status != 'settled'
+              AND NOT EXISTS (
+                  SELECT 1 FROM transfer_legs l
+                  WHERE l.transfer_id = transfers.id AND l.status != 'settled'
+              )
+            """,
+            (now, run_id),
+        ).rowcount
+    report["runs"] += 1
+    report["legs_settled"] += legs
+    report["transfers_settled"] += transfers
+    report["nessie_transfers"] += len(netted)
+
+
+def settle_pending(batch_size: int = SETTLEMENT_BATCH_SIZE) -> Dict[str, Any]:
+    """Settle queued legs in runs until none are left."""
+    global _last_report
+    report: Dict[str, Any] = {"runs": 0, "legs_settled": 0, "transfers_settled": 0, "nessie_transfers": 0}
+    started = time.perf_counter()
+    owner = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"
+    while True:
+        run_id = _claim_run(batch_size, owner)
+        if run_id is None:
+            break
+        try:
+            _settle_run(run_id, owner, report)
+        except BaseException:
+            # Hand the run straight back so the next pass retries it instead of waiting out the lease.
+            database.execute(
+                "UPDATE settlement_runs SET owner = NULL, claimed_at = NULL WHERE id = ? AND owner = ?",
+                (run_id, owner),
+            )
+            raise
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["finished_at"] = datetime.utcnow().isoformat()
+    if report["runs"]:
+        _last_report = report
+    return report
+
+
+async def _run_forever() -> None:
+    while True:
+        try:
+            report = await asyncio.to_thread(settle_pending)
+            if report["runs"]:
+                logger.info("Settlement: %s", report)
+        except Exception:  # noqa: BLE001 - the open run is retried on the next tick
+            logger.exception("Settlement run failed")
+        await asyncio.sleep(SETTLEMENT_INTERVAL_SECONDS)
+
+
+async def start() -> None:
+    global _task
+    if _task is not None or not SETTLEMENT_ENABLED:
+        return
+    _task = asyncio.create_task(_run_forever(), name="settlement")
+    logger.info("Started the settlement worker (every %ss).", SETTLEMENT_INTERVAL_SECONDS)
+
+
+async def stop() -> None:
+    """Cancel the worker; a run interrupted before it settled stays open and is resubmitted."""
+    global _task
+    task, _task = _task, None
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def stats() -> Dict[str, Any]:
+    legs = database.fetchall("SELECT status, COUNT(*) AS total FROM transfer_legs GROUP BY status")
+    runs = database.fetchone("SELECT COUNT(*) AS total FROM settlement_runs WHERE status = 'open'")
+    return {
+        "running": _task is not None,
+        "interval_seconds": SETTLEMENT_INTERVAL_SECONDS,
+        "legs_by_status": {row["status"]: row["total"] for row in legs},
+        "open_runs": runs["total"],
+        "last_settlement": _last_report,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Settle queued Nessie transfers.")
+    parser.add_argument("--batch-size", type=int, default=SETTLEMENT_BATCH_SIZE)
+    args = parser.parse_args()
+    database.init_db()
+    print(json.dumps(settle_pending(args.batch_size)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark schedule generation, storage and repricing.
+
+Times ``schedules.bulk`` against expanding every installment of each loan,
+then seeds a scratch SQLite database with matches, allocations and compact
+schedules, reports the schedule table's size, times dashboard summaries that
+derive the next payment and balance, and times a full
+``repricing.reprice`` pass after a rate-policy change.
+
+    cd backend && python -m benchmarks.amortization --loans 200000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="amortization-bench-"))
+os.environ.setdefault("DATABASE_URL", str(SCRATCH / "bench.db"))
+
+from app import dashboards, database, portfolio, repricing, schedules  # noqa: E402
+
+
+def seed(loans, first_due: datetime) -> None:
+    created = datetime.utcnow().isoformat()
+    with database.transaction() as tx:
+        tx.executemany(
+            """
+            INSERT INTO users (id, role, is_borrower, is_verified, lat, lng, min_rate, max_amount, created_at)
+            VALUES (?, ?, ?, 1, 0, 0, 0, 5000, ?)
+            """,
+            [(user_id, "borrower", 1, created) for (user_id, _), _, _ in loans]
+            + [(f"lender_{index:05d}", "lender", 0, created) for index in range(len(loans) // 20 + 1)],
+        )
+        tx.executemany(
+            """
+            INSERT INTO matches (id, user_id, total_amount, lenders_json, risk_score, apr, installments, frequency)
+            VALUES (?, ?, ?, '[]', 70, ?, ?, ?)
+            """,
+            [(match_id, user_id, amount, apr, *schedules.DEFAULT_TERMS) for (user_id, match_id), amount, apr in loans],
+        )
+        portfolio.record(
+            tx,
+            [
+                (match_id, f"lender_{index // 20:05d}", amount, apr)
+                for index, ((_, match_id), amount, apr) in enumerate(loans)
+            ],
+        )
+        tx.executemany(
+            """
+            INSERT INTO loan_schedules (
+                match_id, user_id, principal, apr, frequency, installments, first_due,
+                payment, final_payment, next_due_date, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (match_id, user_id, *schedule, schedule.first_due, created)
+                for (user_id, match_id), schedule in schedules.bulk(loans, first_due)
+            ),
+        )
+
+
+def table_bytes(table: str) -> int:
+    row = database.fetchone(
+        "SELECT SUM(pgsize) AS size FROM dbstat WHERE name = ? OR name IN "
+        "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?)",
+        (table, table),
+    )
+    return row["size"] or 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=repricing.SCHEDULE_REPRICE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    first_due = schedules.first_due_date(schedules.LOAN_FREQUENCY)
+    loans = [
+        ((f"user_{index:07d}", f"match_{index:07d}"), rng.choice([250.0, 500.0, 1000.0, 2000.0]), round(rng.uniform(2.5, 9.0), 2))
+        for index in range(args.loans)
+    ]
+
+    started = time.perf_counter()
+    installments = sum(len(schedules.amortize(amount, apr, first_due)) for _, amount, apr in loans)
+    expanded = time.perf_counter() - started
+    started = time.perf_counter()
+    rows = sum(1 for _ in schedules.bulk(loans, first_due))
+    bulk = time.perf_counter() - started
+    print(f"expand x{args.loans}: {expanded:.2f}s ({installments} installments)   bulk: {bulk:.2f}s ({rows} schedules)")
+
+    database.init_db()
+    started = time.perf_counter()
+    seed(loans, first_due)
+    print(f"seeded {args.loans} loans in {time.perf_counter() - started:.1f}s")
+    try:
+        print(f"loan_schedules + indexes: {table_bytes('loan_schedules') / 1e6:.1f} MB")
+    except sqlite3.OperationalError:
+        pass  # SQLite built without the dbstat table.
+
+    sample = [user_id for (user_id, _), _, _ in random.Random(3).sample(loans, min(len(loans), 5000))]
+    started = time.perf_counter()
+    for start in range(0, len(sample), 500):
+        dashboards.compute(sample[start : start + 500])
+    print(f"dashboard summaries: {(time.perf_counter() - started) / len(sample) * 1e6:.1f}µs per borrower")
+
+    # A rate-policy change: every lender leg re-rated.
+    database.execute("UPDATE match_allocations SET rate = rate + 1.5")
+    report = repricing.reprice(args.batch_size)
+    print(f"reprice: {report}")
+    report = repricing.reprice(args.batch_size)
+    print(f"reprice again (no-op): {report['seconds']}s, {report['schedules_repriced']} repriced")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark a due-payment collection pass.
+
+Seeds a scratch SQLite database with loans whose first installments are
+already due, times ``payments.process_due`` settling them in batches, then
+times a pass with nothing due and one that resumes from a checkpoint left
+mid-pass.
+
+    cd backend && python -m benchmarks.due_payments --loans 200000 --due 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="payments-bench-"))
+os.environ.setdefault("DATABASE_URL", str(SCRATCH / "bench.db"))
+
+from app import database, payments, portfolio, schedules  # noqa: E402
+
+
+def seed(loans: int, due: int, rng: random.Random) -> None:
+    created = datetime.utcnow().isoformat()
+    period = schedules.INSTALLMENT_INTERVAL
+    lenders = loans // 20 + 1
+    with database.transaction() as tx:
+        tx.executemany(
+            """
+            INSERT INTO users (id, role, is_borrower, is_verified, lat, lng, min_rate, max_amount, created_at)
+            VALUES (?, ?, ?, 1, 0, 0, 0, 5000, ?)
+            """,
+            [(f"user_{index:07d}", "borrower", 1, created) for index in range(loans)]
+            + [(f"lender_{index:05d}", "lender", 0, created) for index in range(lenders)],
+        )
+    batch = 20_000
+    for start in range(0, loans, batch):
+        match_rows, legs, schedule_rows = [], [], []
+        for index in range(start, min(start + batch, loans)):
+            user_id, match_id = f"user_{index:07d}", f"match_{index:07d}"
+            amount = rng.choice([250.0, 500.0, 1000.0, 2000.0])
+            apr = round(rng.uniform(2.5, 9.0), 2)
+            match_rows.append((match_id, user_id, amount, apr))
+            legs.append((match_id, f"lender_{index % lenders:05d}", amount / 2, apr))
+            legs.append((match_id, f"lender_{(index + 1) % lenders:05d}", amount / 2, apr))
+            # Stagger start dates so due dates spread over a few days.
+            first_due = datetime.utcnow() - period * (due - 1) - timedelta(hours=rng.randint(1, 72))
+            schedule = schedules.compact(amount, apr, first_due)
+            schedule_rows.append((match_id, user_id, *schedule, schedule.first_due, created))
+        with database.transaction() as tx:
+            tx.executemany(
+                "INSERT INTO matches (id, user_id, total_amount, lenders_json, risk_score, apr) VALUES (?, ?, ?, '[]', 70, ?)",
+                match_rows,
+            )
+            portfolio.record(tx, legs, created)
+            tx.executemany(
+                """
+                INSERT INTO loan_schedules (
+                    match_id, user_id, principal, apr, frequency, installments, first_due,
+                    payment, final_payment, next_due_date, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                schedule_rows,
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=200_000)
+    parser.add_argument("--due", type=int, default=3, help="Installments already due per loan.")
+    parser.add_argument("--batch-size", type=int, default=payments.PAYMENT_PROCESSOR_BATCH_SIZE)
+    args = parser.parse_args()
+
+    database.init_db()
+    started = time.perf_counter()
+    seed(args.loans, args.due, random.Random(7))
+    print(f"seeded {args.loans} loans in {time.perf_counter() - started:.1f}s")
+
+    report = payments.process_due(args.batch_size)
+    installments = report["installments_paid"]
+    print(f"pass: {report}")
+    print(f"  {installments / report['seconds']:.0f} installments/s")
+    report = payments.process_due(args.batch_size)
+    print(f"pass with nothing due: {report['seconds']}s, {report['loans']} loans")
+
+    # Make the next installment due everywhere, then stop after one batch.
+    database.execute(
+        "UPDATE loan_schedules SET next_due_date = first_due, paid_through = 0 WHERE status = 'active'"
+    )
+    database.execute("DELETE FROM payment_schedules")
+    payments._process_batch(args.batch_size, payments._new_report())
+    report = payments.process_due(args.batch_size)
+    print(f"resumed pass: {report['loans']} loans in {report['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark the compiled essentials matcher at millions of product lines.
+
+Compares ``essentials.is_essential`` with the original per-keyword
+substring loop on synthetic product names, then times the essentials ratio
+read from the per-merchant rollups.
+
+    cd backend && python -m benchmarks.essentials --lines 2000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="essentials-bench-"))
+os.environ.setdefault("DATABASE_URL", str(SCRATCH / "bench.db"))
+
+from app import database, essentials, knot_store  # noqa: E402
+
+WORDS = [
+    "Organic", "Whole", "Milk", "Sourdough", "Bread", "Wireless", "Earbuds", "Baby", "Wipes",
+    "Pad", "Thai", "Gaming", "Chair", "Household", "Cleaner", "Vitamin", "Gummies", "Pharmacy",
+    "Pickup", "Scented", "Candle", "Family", "Meal", "Kit", "Phone", "Case", "Produce", "Box",
+    "Diapers", "Size", "4", "Premium", "Coffee", "Beans", "School", "Supplies", "Lego", "Set",
+]
+
+
+def product_names(count: int):
+    rng = random.Random(11)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(2, 6))) for _ in range(count)]
+
+
+def naive(text: str) -> bool:
+    lowered = text.lower()
+    return any(keyword in lowered for keyword in essentials.ESSENTIAL_KEYWORDS)
+
+
+def timed(label: str, func, names) -> int:
+    started = time.perf_counter()
+    hits = sum(1 for name in names if func(name))
+    elapsed = time.perf_counter() - started
+    print(f"{label}: {len(names):,} lines in {elapsed:.2f}s ({len(names) / elapsed / 1e6:.2f}M lines/s), {hits:,} essential")
+    return hits
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    names = product_names(args.lines)
+    compiled = timed("compiled regex", essentials.is_essential, names)
+    baseline = timed("keyword loop  ", naive, names)
+    assert compiled == baseline, "matchers disagree"
+
+    started = time.perf_counter()
+    share = essentials.essential_share([(name, 1.0) for name in names])
+    print(f"essential_share over all lines: {share:.3f} in {time.perf_counter() - started:.2f}s")
+
+    database.init_db()
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    database.execute(
+        """
+        INSERT OR IGNORE INTO users (id, role, is_borrower, lat, lng, min_rate, max_amount, created_at)
+        VALUES ('user_bench', 'borrower', 1, 0, 0, 0, 0, ?)
+        """,
+        (now,),
+    )
+    with database.transaction() as tx:
+        for merchant_id in (19, 45):
+            tx.execute(
+                """
+                INSERT OR REPLACE INTO knot_merchants (
+                    user_id, merchant_id, merchant_name, orders, total_spend, essential_spend, last_sync
+                )
+                VALUES ('user_bench', ?, ?, 100000, 2500000, 1600000, ?)
+                """,
+                (merchant_id, f"Merchant {merchant_id}", now),
+            )
+    rounds = 2000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        summary = knot_store.summary("user_bench")
+    per_call = (time.perf_counter() - started) / rounds * 1e6
+    print(f"summary(): essentials_ratio={summary['essentials_ratio']} in {per_call:.0f}µs per call")
+
+
+if __name__ == "__main__":
+    main()
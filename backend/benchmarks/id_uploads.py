@@ -0,0 +1,110 @@
+"""Concurrency benchmark for /verify-id uploads.
+
+Serves the app with uvicorn on a background thread, fires many simultaneous
+5 MB uploads at it (most of them re-uploads of a few distinct files) and
+reports throughput, how many files actually landed on disk, and the worst
+stall of the server's event loop while the uploads were in flight.
+
+    cd backend && python -m benchmarks.id_uploads --uploads 64 --distinct 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="upload-bench-"))
+os.environ.setdefault("DATABASE_URL", str(SCRATCH / "bench.db"))
+os.environ.setdefault("ID_UPLOAD_DIR", str(SCRATCH / "uploads"))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from app import main as api  # noqa: E402
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+def payload(index: int, size: int) -> bytes:
+    body = os.urandom(64) + index.to_bytes(4, "big")
+    return (JPEG_HEADER + body * (size // len(body) + 1))[:size]
+
+
+async def watch_loop(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Largest extra delay seen by a task that wakes every ``interval``."""
+    worst = 0.0
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        worst = max(worst, loop.time() - started - interval)
+    return worst
+
+
+def serve() -> tuple:
+    """Start uvicorn on its own loop in a thread; returns (server, loop, base_url)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete, args=(server.serve(),), daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, loop, f"http://127.0.0.1:{port}"
+
+
+async def run(uploads: int, distinct: int, size_mb: float) -> None:
+    size = int(size_mb * 1024 * 1024)
+    files = [payload(index, size) for index in range(distinct)]
+    server, server_loop, base_url = serve()
+    limits = httpx.Limits(max_connections=uploads)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        users = [
+            (await client.post("/users/create", json={"role": "borrower"})).json()["user_id"]
+            for _ in range(uploads)
+        ]
+
+        async def upload(index: int) -> int:
+            response = await client.post(
+                "/verify-id",
+                data={"user_id": users[index]},
+                files={"document": (f"id-{index}.jpg", files[index % distinct], "image/jpeg")},
+            )
+            return response.status_code
+
+        stop = asyncio.Event()
+        watcher = asyncio.run_coroutine_threadsafe(watch_loop(stop), server_loop)
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(upload(index) for index in range(uploads)))
+        elapsed = time.perf_counter() - started
+        server_loop.call_soon_threadsafe(stop.set)
+        stall = watcher.result()
+    server.should_exit = True
+
+    stored = [path for path in Path(os.environ["ID_UPLOAD_DIR"]).rglob("*") if path.is_file()]
+    ok = sum(1 for status in statuses if status == 200)
+    total_mb = uploads * size / 2**20
+    print(f"{uploads} uploads of {size_mb:g} MB ({distinct} distinct files): {ok} ok in {elapsed:.2f}s")
+    print(f"throughput: {total_mb / elapsed:,.0f} MB/s, {uploads / elapsed:,.1f} uploads/s")
+    print(f"files on disk: {len(stored)} ({sum(path.stat().st_size for path in stored) / 2**20:,.1f} MB)")
+    print(f"worst event-loop stall: {stall * 1000:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=64)
+    parser.add_argument("--distinct", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=4.9)
+    args = parser.parse_args()
+    asyncio.run(run(args.uploads, args.distinct, args.size_mb))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark streaming Knot export ingestion against whole-file json.load.
+
+Generates a synthetic merchant export, then reports throughput of the
+streaming parse and of a full ingest into a scratch SQLite database, and the
+peak Python heap of each parse strategy.
+
+    cd backend && python -m benchmarks.knot_ingest --orders 500000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="knot-bench-"))
+os.environ.setdefault("DATABASE_URL", str(SCRATCH / "bench.db"))
+
+from app import database, knot_ingest  # noqa: E402
+
+PRODUCTS = ["Whole Milk", "Sourdough Bread", "Paper Towels", "Pad Thai", "Phone Case", "Baby Wipes"]
+META = {
+    "merchant_name": "Bench Mart",
+    "slug": "bench",
+    "description": "Synthetic export",
+}
+
+
+def write_export(path: Path, orders: int) -> int:
+    rng = random.Random(7)
+    with path.open("w", encoding="utf-8") as fp:
+        fp.write('{"merchant": {"id": 99, "name": "Bench Mart"}, "orders": [')
+        for index in range(orders):
+            if index:
+                fp.write(",")
+            products = [{"name": rng.choice(PRODUCTS), "quantity": rng.randint(1, 3)} for _ in range(rng.randint(1, 4))]
+            fp.write(
+                json.dumps(
+                    {
+                        "externalId": f"ord-{index}",
+                        "dateTime": f"2024-{1 + index % 12:02d}-{1 + index % 28:02d}T12:00:00",
+                        "orderStatus": "COMPLETED",
+                        "price": {"sub_total": "18.20", "total": f"${rng.uniform(5, 150):,.2f}"},
+                        "products": products,
+                    }
+                )
+            )
+        fp.write("]}")
+    return path.stat().st_size
+
+
+def peak_mib(func) -> float:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=knot_ingest.BATCH_SIZE)
+    parser.add_argument("--skip-baseline", action="store_true", help="don't json.load the whole export")
+    args = parser.parse_args()
+
+    export = SCRATCH / "export.json"
+    size = write_export(export, args.orders)
+    print(f"export: {args.orders:,} orders, {size / 2**20:,.1f} MiB at {export}")
+
+    started = time.perf_counter()
+    parsed = sum(1 for _ in knot_ingest.iter_transactions(export, 99, META))
+    elapsed = time.perf_counter() - started
+    print(f"stream parse: {parsed:,} orders in {elapsed:.2f}s ({parsed / elapsed:,.0f}/s)")
+    print(f"stream parse peak heap: {peak_mib(lambda: sum(1 for _ in knot_ingest.iter_transactions(export, 99, META))):.1f} MiB")
+
+    if not args.skip_baseline:
+        def load_all() -> None:
+            with export.open(encoding="utf-8") as fp:
+                payload = json.load(fp)
+            [knot_ingest.normalize_order(order, 99, META) for order in payload["orders"]]
+
+        print(f"json.load baseline peak heap: {peak_mib(load_all):.1f} MiB")
+
+    database.init_db()
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    database.execute(
+        """
+        INSERT OR IGNORE INTO users (id, role, is_borrower, lat, lng, min_rate, max_amount, created_at)
+        VALUES ('user_bench', 'borrower', 1, 0, 0, 0, 0, ?)
+        """,
+        (now,),
+    )
+    for label in ("ingest (cold)", "ingest (re-sync)"):
+        started = time.perf_counter()
+        result = knot_ingest.ingest_export("user_bench", 99, META, export, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{label}: read {result['read']:,}, wrote {result['written']:,} "
+            f"in {elapsed:.2f}s ({result['read'] / elapsed:,.0f} orders/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark radius lender lookups against the grid-cell spatial index.
+
+Files synthetic lenders in a ``LenderOrderBook`` - clustered around a few
+metro areas, like real sign-ups - then times ``nearby`` and
+``nearby_candidates`` for random borrowers and checks every answer against a
+brute-force haversine scan of a sample.
+
+    cd backend && python -m benchmarks.lender_geo --lenders 300000 --radius-km 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import time
+
+from app.geo_index import haversine_km
+from app.lender_book import LenderOrderBook
+
+METROS = [
+    (40.3573, -74.6672),  # Princeton
+    (40.7128, -74.0060),
+    (39.9526, -75.1652),
+    (41.8781, -87.6298),
+    (34.0522, -118.2437),
+    (29.7604, -95.3698),
+    (47.6062, -122.3321),
+    (64.8378, -147.7164),
+]
+
+
+def lender_rows(count: int, rng: random.Random):
+    for index in range(count):
+        lat, lng = rng.choice(METROS)
+        yield {
+            "id": f"user_{index:07d}",
+            "max_amount": rng.uniform(100, 5000),
+            "min_rate": rng.uniform(2.5, 9.0),
+            "community_id": None,
+            "location_locked": rng.random() < 0.5,
+            "lat": lat + rng.gauss(0, 0.6),
+            "lng": lng + rng.gauss(0, 0.6),
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lenders", type=int, default=300_000)
+    parser.add_argument("--radius-km", type=float, default=10.0)
+    parser.add_argument("--cell-km", type=float, default=5.0)
+    parser.add_argument("--queries", type=int, default=5_000)
+    parser.add_argument("--verify", type=int, default=50, help="Queries checked by brute force.")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    rows = list(lender_rows(args.lenders, rng))
+    book = LenderOrderBook(args.cell_km)
+    started = time.perf_counter()
+    book.rebuild(rows)
+    print(f"rebuild: {args.lenders} lenders in {time.perf_counter() - started:.2f}s; {book.geo_stats()}")
+
+    origins = []
+    for _ in range(args.queries):
+        lat, lng = rng.choice(METROS)
+        origins.append((lat + rng.gauss(0, 0.6), lng + rng.gauss(0, 0.6)))
+
+    for label, lookup in (
+        ("nearby(amount=1500)", lambda lat, lng: book.nearby(lat, lng, args.radius_km, amount=1500)),
+        ("nearby(all)", lambda lat, lng: book.nearby(lat, lng, args.radius_km)),
+        ("nearby_candidates", lambda lat, lng: book.nearby_candidates(lat, lng, args.radius_km)),
+    ):
+        timings = []
+        found = []
+        for lat, lng in origins:
+            began = time.perf_counter()
+            result = lookup(lat, lng)
+            timings.append(time.perf_counter() - began)
+            found.append(len(result))
+        timings.sort()
+        print(
+            f"{label:>22}: p50 {timings[len(timings) // 2] * 1e6:7.1f}µs  "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e6:7.1f}µs  "
+            f"mean lenders {statistics.mean(found):.1f}"
+        )
+
+    for lat, lng in origins[: args.verify]:
+        expected = {
+            row["id"]
+            for row in rows
+            if haversine_km(lat, lng, row["lat"], row["lng"]) <= args.radius_km
+        }
+        got = {lender["id"] for lender in book.nearby(lat, lng, args.radius_km)}
+        assert got == expected, (lat, lng, len(got), len(expected))
+    print(f"verified {min(args.verify, len(origins))} queries against a brute-force scan")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Benchmark lender portfolio queries over ``match_allocations``.
+
+Seeds a scratch SQLite database with synthetic lenders, matches, allocation
+legs and compact schedules, then times the dashboard's grouped portfolio
+queries, the single-lender portfolio endpoint query, and, for comparison, a
+scan of ``matches.lenders_json`` like the one the allocations table replaces.
+Prints the query plans so index use is easy to check.
+
+    cd backend && python -m benchmarks.lender_portfolio --matches 500000 --legs 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="portfolio-bench-"))
+os.environ.setdefault("DATABASE_URL", str(SCRATCH / "bench.db"))
+
+from app import database, portfolio, schedules  # noqa: E402
+
+
+def seed(lenders: int, borrowers: int, matches: int, legs: int, rng: random.Random) -> None:
+    now = datetime.utcnow()
+    created = now.isoformat()
+    with database.transaction() as tx:
+        tx.executemany(
+            """
+            INSERT INTO users (id, role, is_borrower, is_verified, lat, lng, min_rate, max_amount, created_at)
+            VALUES (?, 'lender', 0, 1, 0, 0, ?, 5000, ?)
+            """,
+            [(f"lender_{index:06d}", round(rng.uniform(2.5, 9.0), 2), created) for index in range(lenders)],
+        )
+        tx.executemany(
+            """
+            INSERT INTO users (id, role, is_borrower, is_verified, lat, lng, min_rate, max_amount, created_at)
+            VALUES (?, 'borrower', 1, 1, 0, 0, 0, 1500, ?)
+            """,
+            [(f"borrower_{index:06d}", created) for index in range(borrowers)],
+        )
+    batch = 20_000
+    for start in range(0, matches, batch):
+        match_rows, schedule_rows, allocation_legs = [], [], []
+        for index in range(start, min(start + batch, matches)):
+            match_id = f"match_{index:08d}"
+            user_id = f"borrower_{index % borrowers:06d}"
+            amount = rng.choice([250.0, 500.0, 1000.0, 2000.0])
+            parts = []
+            for lender_index in rng.sample(range(lenders), legs):
+                part = round(amount / legs, 2)
+                rate = round(rng.uniform(2.5, 9.0), 2)
+                lender_id = f"lender_{lender_index:06d}"
+                parts.append({"lenderId": lender_id, "amount": part, "rate": rate})
+                allocation_legs.append((match_id, lender_id, part, rate))
+            match_rows.append((match_id, user_id, amount, json.dumps(parts)))
+            first_due = now + timedelta(days=rng.randint(-20, 28))
+            schedule = schedules.compact(amount, 0.0, first_due)
+            schedule_rows.append((match_id, user_id, *schedule, schedule.first_due, created))
+        with database.transaction() as tx:
+            tx.executemany(
+                "INSERT INTO matches (id, user_id, total_amount, lenders_json, risk_score) VALUES (?, ?, ?, ?, 70)",
+                match_rows,
+            )
+            tx.executemany(
+                """
+                INSERT INTO loan_schedules (
+                    match_id, user_id, principal, apr, frequency, installments, first_due,
+                    payment, final_payment, next_due_date, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                schedule_rows,
+            )
+            portfolio.record(tx, allocation_legs, created)
+
+
+def timed(label: str, runs: int, call) -> None:
+    timings = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - began)
+    timings.sort()
+    print(
+        f"{label:>32}: p50 {timings[len(timings) // 2] * 1e3:8.2f}ms  "
+        f"p99 {timings[int(len(timings) * 0.99)] * 1e3:8.2f}ms"
+    )
+
+
+def json_scan(lender_id: str) -> float:
+    outstanding = 0.0
+    for row in database.fetchall("SELECT lenders_json FROM matches"):
+        for part in json.loads(row["lenders_json"]):
+            if part["lenderId"] == lender_id:
+                outstanding += part["amount"]
+    return outstanding
+
+
+def explain(query: str, params) -> None:
+    for row in database.fetchall(f"EXPLAIN QUERY PLAN {query}", params):
+        print(f"    {row['detail']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lenders", type=int, default=50_000)
+    parser.add_argument("--borrowers", type=int, default=200_000)
+    parser.add_argument("--matches", type=int, default=500_000)
+    parser.add_argument("--legs", type=int, default=4, help="Lenders per match.")
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    database.init_db()
+    rng = random.Random(7)
+    started = time.perf_counter()
+    seed(args.lenders, args.borrowers, args.matches, args.legs, rng)
+    allocations = database.fetchone("SELECT COUNT(*) AS n FROM match_allocations")["n"]
+    print(f"seeded {args.matches} matches / {allocations} allocations in {time.perf_counter() - started:.1f}s")
+
+    lender_ids = [f"lender_{index:06d}" for index in range(args.lenders)]
+    chunks = [rng.sample(lender_ids, 500) for _ in range(max(1, args.queries // 50))]
+    singles = [rng.choice(lender_ids) for _ in range(args.queries)]
+
+    timed("totals(500 lenders)", len(chunks), lambda: portfolio.totals(chunks.pop()))
+    chunks = [rng.sample(lender_ids, 500) for _ in range(max(1, args.queries // 50))]
+    timed("next_inflows(500 lenders)", len(chunks), lambda: portfolio.next_inflows(chunks.pop()))
+    queue = list(singles)
+    timed("portfolio(lender)", len(queue), lambda: portfolio.portfolio(queue.pop()))
+    timed("lenders_json scan (one lender)", 3, lambda: json_scan(singles[0]))
+
+    print("plans:")
+    explain(
+        "SELECT lender_id, COUNT(*), SUM(amount), SUM(outstanding), SUM(outstanding * rate) "
+        "FROM match_allocations WHERE lender_id IN (?, ?) GROUP BY lender_id",
+        singles[:2],
+    )
+    explain(portfolio._SCHEDULED_SHARES.format(ids="?, ?"), singles[:2])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark transfer requests and batched settlement.
+
+Seeds a scratch SQLite database with matches and lender allocations, then
+times ``settlement.request_transfer`` for new transfers and for retries,
+sequentially and from a thread pool like the API's, and finally times
+``settlement.settle_pending`` draining the queue.
+
+    cd backend && python -m benchmarks.settlement --matches 50000 --threads 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List
+
+SCRATCH = Path(tempfile.mkdtemp(prefix="settlement-bench-"))
+os.environ.setdefault("DATABASE_URL", str(SCRATCH / "bench.db"))
+
+from app import database, portfolio, settlement  # noqa: E402
+
+
+def seed(matches: int, lenders: int, legs: int, rng: random.Random) -> None:
+    created = datetime.utcnow().isoformat()
+    with database.transaction() as tx:
+        tx.executemany(
+            """
+            INSERT INTO users (id, role, is_borrower, is_verified, lat, lng, min_rate, max_amount, created_at)
+            VALUES (?, ?, ?, 1, 0, 0, 0, 5000, ?)
+            """,
+            [(f"lender_{index:05d}", "lender", 0, created) for index in range(lenders)]
+            + [(f"user_{index:07d}", "borrower", 1, created) for index in range(matches)],
+        )
+        tx.executemany(
+            "INSERT INTO matches (id, user_id, total_amount, lenders_json, risk_score) VALUES (?, ?, ?, '[]', 70)",
+            [(f"match_{index:07d}", f"user_{index:07d}", 100.0 * legs) for index in range(matches)],
+        )
+        portfolio.record(
+            tx,
+            [
+                (f"match_{index:07d}", f"lender_{lender:05d}", 100.0, 5.0)
+                for index in range(matches)
+                for lender in rng.sample(range(lenders), legs)
+            ],
+            created,
+        )
+
+
+def timed(label: str, match_ids: List[str], call: Callable[[str], object], threads: int = 1) -> None:
+    def one(match_id: str) -> float:
+        began = time.perf_counter()
+        call(match_id)
+        return time.perf_counter() - began
+
+    started = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            timings = sorted(pool.map(one, match_ids))
+    else:
+        timings = sorted(one(match_id) for match_id in match_ids)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:>34}: {len(match_ids) / elapsed:8.0f}/s  "
+        f"p50 {timings[len(timings) // 2] * 1e3:6.2f}ms  p99 {timings[int(len(timings) * 0.99)] * 1e3:6.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--matches", type=int, default=50_000)
+    parser.add_argument("--lenders", type=int, default=2_000)
+    parser.add_argument("--legs", type=int, default=3, help="Lenders per match.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=settlement.SETTLEMENT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    database.init_db()
+    rng = random.Random(7)
+    seed(args.matches, args.lenders, args.legs, rng)
+    match_ids = [f"match_{index:07d}" for index in range(args.matches)]
+    half = len(match_ids) // 2
+
+    timed("new transfers", match_ids[:half], settlement.request_transfer)
+    timed("retries", rng.sample(match_ids[:half], min(half, 10_000)), settlement.request_transfer)
+    mixed = match_ids[half:] + rng.sample(match_ids, half)
+    rng.shuffle(mixed)
+    timed(f"new + retries, {args.threads} threads", mixed, settlement.request_transfer, args.threads)
+
+    report = settlement.settle_pending(args.batch_size)
+    print(f"settle: {report}")
+    print(f"  {report['legs_settled'] / report['seconds']:.0f} legs/s, "
+          f"{report['legs_settled']} legs in {report['nessie_transfers']} Nessie transfers")
+
+
+if __name__ == "__main__":
+    main()
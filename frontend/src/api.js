@@ -65,16 +65,22 @@ export async function fetchXFeed(handle = 'raymo8980') {
   return data;
 }
 
-export async function fetchBorrowerDashboard(userId) {
-  // GET /dashboard/borrower -> {next_payment,total_owed_year,savings_vs_bank_year}
-  const { data } = await api.get('/dashboard/borrower', { params: { user_id: userId } });
+export async function fetchDashboard(userId) {
+  // GET /dashboard -> {user_id,role,is_verified,borrower,lender,knot,updated_at}
+  const { data } = await api.get('/dashboard', { params: { user_id: userId } });
   return data;
 }
 
+export async function fetchBorrowerDashboard(userId) {
+  // borrower -> {next_payment,total_owed_year,savings_vs_bank_year,...}
+  const data = await fetchDashboard(userId);
+  return data.borrower;
+}
+
 export async function fetchLenderDashboard(userId) {
-  // GET /dashboard/lender -> {next_payment,expected_revenue_year}
-  const { data } = await api.get('/dashboard/lender', { params: { user_id: userId } });
-  return data;
+  // lender -> {next_payment,expected_revenue_year,...}
+  const data = await fetchDashboard(userId);
+  return data.lender;
 }
 
 export async function linkKnotAccount(payload) {
@@ -268,9 +268,11 @@ export default function BorrowOptions() {
                     <p className="mt-2 text-sm text-muted-foreground">
                       {match.x_post_id
                         ? 'Your approval story was posted to our shared X account so the community can cheer you on.'
-                        : match.x_post_error === 'disabled'
-                          ? 'X posting is disabled in this environment, but your loan is still confirmed.'
-                          : 'We could not post to X this time, but your loan is confirmed.'}
+                        : match.x_post_error === 'queued'
+                          ? 'Your approval story is on its way to our shared X account so the community can cheer you on.'
+                          : match.x_post_error === 'disabled'
+                            ? 'X posting is disabled in this environment, but your loan is still confirmed.'
+                            : 'We could not post to X this time, but your loan is confirmed.'}
                     </p>
                     <div className="mt-3 flex flex-wrap gap-2">
                       <Button variant="outline" onClick={() => navigate('/feed')}>
@@ -17,7 +17,7 @@ export default function DashboardBorrower() {
     if (!user?.userId) return;
     async function load() {
       try {
-        // GET /dashboard/borrower -> {next_payment,total_owed_year,savings_vs_bank_year}
+        // GET /dashboard -> borrower {next_payment,total_owed_year,savings_vs_bank_year}
         const resp = await fetchBorrowerDashboard(user.userId);
         setData(resp);
       } catch (err) {
@@ -23,7 +23,7 @@ export default function DashboardLender() {
     if (!user?.userId) return;
     async function load() {
       try {
-        // GET /dashboard/lender -> {next_payment,expected_revenue_year}
+        // GET /dashboard -> lender {next_payment,expected_revenue_year}
         const resp = await fetchLenderDashboard(user.userId);
         setData(resp);
       } catch (err) {